@@ -0,0 +1,265 @@
+# USAGE
+# python BatchTracker.py --manifest sessions.json --output-dir ./batch_output --workers 8
+# python BatchTracker.py --video-dir ./sessions --page ./braille_files/page.brf --output-dir ./batch_output
+
+import argparse
+import contextlib
+import glob
+import json
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+
+import cv2
+
+import VideoTracker
+
+# settings used for a session unless the manifest overrides them
+default_settings = {
+    'tracker_type': 'CSRT',
+    'auto_calibrate': True,
+    'black_background': True,
+    'pipelined': False,
+    'output_format': 'tsv',
+    'tracking_scale': 1.0,
+    'crop_to_page': False,
+    'recalibrate': False,
+    'write_video': False,
+}
+
+video_extensions = ('.mp4', '.mov', '.avi', '.mkv', '.m4v')
+
+# keys of a session dict that describe the session rather than how it is tracked
+session_keys = ('video', 'page', 'name', 'output_dir')
+# VideoTracker arguments the batch sets itself: sessions run headless and write into their own output directory
+batch_arguments = ('video_path', 'page_path', 'headless', 'show_frame', 'show_calibration', 'output_path',
+                   'data_output_path', 'dwell_output_path', 'profile_path', 'profile_hooks')
+# settings naming input files, resolved against the manifest's directory
+path_settings = ('calibration_cache_dir', 'cell_edges_path', 'page_registry')
+
+
+def check_settings(session):
+    """
+    Makes sure every setting of a session is a VideoTracker setting the batch lets sessions choose, so a study never
+    runs with other settings than the ones it declared
+    :param session: session dict
+    """
+    arguments = VideoTracker.setting_names()
+    settings = [key for key in session if key not in session_keys]
+    reserved = sorted(key for key in settings if key in batch_arguments)
+    if reserved:
+        raise ValueError('Session {} sets {}, which the batch sets for every session'.format(
+            session.get('name') or session.get('video'), ', '.join(reserved)))
+    unknown = sorted(key for key in settings if key not in arguments)
+    if unknown:
+        raise ValueError('Session {} has unknown settings {}'.format(
+            session.get('name') or session.get('video'), ', '.join(unknown)))
+
+
+def load_manifest(manifest_path):
+    """
+    Loads a batch manifest mapping session videos to Braille pages and calibration settings
+
+    The manifest is a JSON file of the form
+    {"defaults": {"page": "page.brf", "tracker_type": "CSRT", ...},
+     "sessions": [{"video": "s01.mp4", "page": "other.brf", "name": "s01", "start_time": 3}, ...]}
+    Settings are fields of the VideoTracker settings groups, except those in batch_arguments. Relative paths are
+    resolved against the manifest's directory.
+    :param manifest_path: path of the manifest file
+    :return: list of session dicts with every setting filled in
+    """
+    with open(manifest_path, 'r') as fh:
+        manifest = json.load(fh)
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    defaults = dict(default_settings, **manifest.get('defaults', {}))
+
+    sessions = []
+    for entry in manifest['sessions']:
+        session = dict(defaults, **entry)
+        for key in ('video', 'page'):
+            if key not in session:
+                raise ValueError('Session {} is missing "{}"'.format(entry, key))
+            session[key] = os.path.join(base_dir, session[key])
+        for key in path_settings:
+            if isinstance(session.get(key), str):
+                session[key] = os.path.join(base_dir, session[key])
+        check_settings(session)
+        sessions.append(session)
+    return sessions
+
+
+def sessions_from_directory(video_dir, page_path, **settings):
+    """
+    Builds a session for every video in a directory, all reading the same Braille page
+    :param video_dir: directory holding the session videos
+    :param page_path: path of the Braille page being read
+    :param settings: VideoTracker settings applied to every session
+    :return: list of session dicts
+    """
+    videos = sorted(path for path in glob.glob(os.path.join(video_dir, '*'))
+                    if path.lower().endswith(video_extensions))
+    sessions = [dict(default_settings, video=video, page=page_path, **settings) for video in videos]
+    for session in sessions:
+        check_settings(session)
+    return sessions
+
+
+def assign_output_dirs(sessions, output_dir):
+    """
+    Gives every session a unique name and its own output directory
+    :param sessions: list of session dicts, updated in place
+    :param output_dir: root directory for all session outputs
+    :return: the sessions
+    """
+    used_names = set()
+    for session in sessions:
+        name = session.get('name') or os.path.splitext(os.path.basename(session['video']))[0]
+        unique_name = name
+        suffix = 1
+        while unique_name in used_names:
+            suffix += 1
+            unique_name = '{}_{}'.format(name, suffix)
+        used_names.add(unique_name)
+        session['name'] = unique_name
+        session['output_dir'] = os.path.join(output_dir, unique_name)
+    return sessions
+
+
+def run_session(index, session, results):
+    """
+    Worker entry point: tracks one session and reports how it went
+    :param index: position of the session in the batch, sent back with the result
+    :param session: session dict
+    :param results: multiprocessing queue the (index, result dict) pair is put on
+    """
+    # every session gets its own process, so keep OpenCV from oversubscribing the cores
+    cv2.setNumThreads(1)
+    os.makedirs(session['output_dir'], exist_ok=True)
+
+    result = {'name': session['name'], 'video': session['video'], 'frames': 0}
+    start = time.time()
+    with open(os.path.join(session['output_dir'], 'log.txt'), 'w') as log, contextlib.redirect_stdout(log):
+        try:
+            settings = {key: value for key, value in session.items() if key not in session_keys}
+            settings['output_path'] = os.path.join(session['output_dir'], 'output.mp4')
+            settings['data_output_path'] = os.path.join(session['output_dir'], 'BrailleOutput.txt')
+            tracker = VideoTracker.VideoTracker(session['video'], session['page'], headless=True,
+                                                **VideoTracker.group_settings(settings))
+            result['status'] = 'ok'
+            result['frames'] = tracker.frames_processed
+        except Exception:
+            result['status'] = 'failed'
+            result['error'] = traceback.format_exc()
+            print(result['error'])
+
+    result['seconds'] = time.time() - start
+    result['fps'] = result['frames'] / result['seconds'] if result['seconds'] > 0 else 0.0
+    results.put((index, result))
+
+
+def run_batch(sessions, output_dir, workers=None):
+    """
+    Fans sessions out across worker processes, one session per process, so a crashing session only fails itself
+    :param sessions: list of session dicts
+    :param output_dir: root directory for all session outputs
+    :param workers: number of sessions tracked at once, defaults to the number of cores
+    :return: list of per-session result dicts, in session order
+    """
+    for session in sessions:
+        check_settings(session)
+    workers = workers or os.cpu_count() or 1
+    assign_output_dirs(sessions, output_dir)
+
+    # spawn gives each worker a clean interpreter instead of a fork of this one's OpenCV state
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    pending = list(enumerate(sessions))
+    running = {}
+    finished = {}
+    batch_start = time.time()
+
+    while pending or running:
+        # keep every worker busy
+        while pending and len(running) < workers:
+            index, session = pending.pop(0)
+            process = context.Process(target=run_session, args=(index, session, results), daemon=True)
+            process.start()
+            running[index] = process
+
+        try:
+            index, result = results.get(timeout=1)
+        except queue.Empty:
+            index, result = None, None
+        # a result can still arrive from a worker already counted as failed below, keep the first outcome
+        if result is not None and index in running:
+            finished[index] = result
+            running.pop(index).join()
+            report_session(result, len(finished), len(sessions))
+
+        # a worker that died without reporting (e.g. a decoder crash) only fails its own session
+        for index, process in list(running.items()):
+            if not process.is_alive() and process.exitcode != 0:
+                finished[index] = {'name': sessions[index]['name'], 'video': sessions[index]['video'],
+                                   'status': 'failed', 'frames': 0, 'seconds': 0.0, 'fps': 0.0,
+                                   'error': 'Worker exited with code {}'.format(process.exitcode)}
+                running.pop(index)
+                report_session(finished[index], len(finished), len(sessions))
+
+    batch_results = [finished[i] for i in range(len(sessions))]
+    write_report(batch_results, output_dir, time.time() - batch_start)
+    return batch_results
+
+
+def report_session(result, n_finished, n_sessions):
+    """
+    Prints a one line summary of a finished session
+    """
+    if result['status'] == 'ok':
+        print('[{}/{}] {}: {} frames in {:.1f}s ({:.1f} fps)'.format(
+            n_finished, n_sessions, result['name'], result['frames'], result['seconds'], result['fps']))
+    else:
+        print('[{}/{}] {}: FAILED, see batch_report.json'.format(n_finished, n_sessions, result['name']))
+
+
+def write_report(batch_results, output_dir, seconds):
+    """
+    Writes per-session results and batch totals to batch_report.json in the output directory
+    """
+    total_frames = sum(result['frames'] for result in batch_results)
+    n_failed = sum(result['status'] != 'ok' for result in batch_results)
+    report = {
+        'sessions': batch_results,
+        'total_sessions': len(batch_results),
+        'failed_sessions': n_failed,
+        'total_frames': total_frames,
+        'seconds': seconds,
+        'fps': total_frames / seconds if seconds > 0 else 0.0,
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'batch_report.json'), 'w') as fh:
+        json.dump(report, fh, indent=2)
+
+    print('Tracked {} of {} sessions, {} frames in {:.1f}s ({:.1f} fps overall)'.format(
+        len(batch_results) - n_failed, len(batch_results), total_frames, seconds, report['fps']))
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Track many Braille reading sessions in parallel')
+    ap.add_argument('-m', '--manifest', help='JSON manifest mapping session videos to Braille pages and settings')
+    ap.add_argument('-d', '--video-dir', help='directory of session videos, used instead of a manifest')
+    ap.add_argument('-p', '--page', help='Braille page read in every video of --video-dir')
+    ap.add_argument('-o', '--output-dir', default='./batch_output', help='root directory for session outputs')
+    ap.add_argument('-w', '--workers', type=int, default=None, help='sessions tracked at once, defaults to core count')
+    args = vars(ap.parse_args())
+
+    if args['manifest']:
+        batch_sessions = load_manifest(args['manifest'])
+    elif args['video_dir'] and args['page']:
+        batch_sessions = sessions_from_directory(args['video_dir'], args['page'])
+    else:
+        ap.error('either --manifest or both --video-dir and --page are required')
+
+    run_batch(batch_sessions, args['output_dir'], args['workers'])
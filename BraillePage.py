@@ -1,5 +1,107 @@
+import mmap
+
 import numpy as np
 
+
+def char_grid(page_bytes, num_rows, num_columns):
+    """
+    :param page_bytes: bytes of one page of a .brf file, without its form feed
+    :param num_rows: number of rows of characters on the page
+    :param num_columns: number of characters per row
+    :return: uint8 np matrix of character codes, 0 where a line ended before that column. Lines past num_rows and
+    characters past num_columns are dropped.
+    """
+    grid = np.zeros((num_rows, num_columns), np.uint8)
+    for row, line in enumerate(bytes(page_bytes).split(b'\n')[:num_rows]):
+        line = line.rstrip(b'\r')[:num_columns]
+        grid[row, :len(line)] = np.frombuffer(line, dtype=np.uint8)
+    return grid
+
+
+class BrfBook:
+    """
+    Lazy reader for .brf files of any number of pages. The file is memory mapped and scanned once for the byte offsets
+    of its pages, page grids are only built when asked for.
+
+    Pages end at form feeds, and pages without a form feed after numRows lines.
+    """
+    def __init__(self, brf_file_path, num_rows=26, num_columns=42):
+        """
+        :param brf_file_path: path to .brf file of Braille
+        :param num_rows: number of rows of characters on a page
+        :param num_columns: number of characters per row
+        """
+        self.path = brf_file_path
+        self.num_rows = num_rows
+        self.num_columns = num_columns
+        self.fh = open(brf_file_path, 'rb')
+        try:
+            self.data = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            self.data = b''
+        self.page_offsets = self.index_pages()
+
+    def index_pages(self):
+        """
+        :return: list of (start, end) byte offsets of every page, form feeds excluded
+        """
+        data = np.frombuffer(self.data, dtype=np.uint8)
+        form_feeds = np.flatnonzero(data == ord('\f'))
+        newlines = np.flatnonzero(data == ord('\n'))
+
+        pages = []
+        starts = np.concatenate([[0], form_feeds + 1])
+        ends = np.concatenate([form_feeds, [len(data)]])
+        first_newline = np.searchsorted(newlines, starts)
+        end_newline = np.searchsorted(newlines, ends)
+        for start, end, first, last in zip(starts.tolist(), ends.tolist(), first_newline.tolist(),
+                                           end_newline.tolist()):
+            if last - first < self.num_rows:
+                pages.append((start, end))
+                continue
+            # lines ending inside this form feed page, every num_rows-th one starts a new page
+            breaks = [b for b in (newlines[first:last][self.num_rows - 1::self.num_rows] + 1).tolist() if b < end]
+            for page_start, page_end in zip([start] + breaks, breaks + [end]):
+                pages.append((page_start, page_end))
+
+        # nothing after the last page break is not a page
+        while len(pages) > 1 and not bytes(self.data[pages[-1][0]:pages[-1][1]]).strip():
+            pages.pop()
+        return pages
+
+    def __len__(self):
+        return len(self.page_offsets)
+
+    def page_bytes(self, page_number):
+        """
+        :param page_number: 0-based page
+        :return: bytes of the page
+        """
+        if not 0 <= page_number < len(self.page_offsets):
+            raise ValueError('{} has {} pages, no page {}'.format(self.path, len(self.page_offsets), page_number))
+        start, end = self.page_offsets[page_number]
+        return self.data[start:end]
+
+    def page_grid(self, page_number):
+        """
+        :param page_number: 0-based page
+        :return: uint8 np matrix of character codes of the page, see char_grid
+        """
+        return char_grid(self.page_bytes(page_number), self.num_rows, self.num_columns)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 class BraillePage:
     """
     Class representing a page of braille. Position of finger is measured from top right corner.
@@ -17,16 +119,25 @@ class BraillePage:
     topMargin = 0.5
     botMargin = 0.625
 
-    def __init__(self, brf_file_path):
+    # row/column returned for positions outside the page margins, which read as a space
+    outOfMargin = -1
+    outOfMarginCode = ord(' ')
+
+    def __init__(self, brf_file_path, page_number=0, book=None):
         """
         initialize page of Braille
         :param brf_file_path: path to .brf file of Braille to load in
+        :param page_number: 0-based page of the file to load, see BrfBook for where pages end
+        :param book: BrfBook of brf_file_path already opened, to not scan the file again
         """
-        # load in file at input path
-        fileStr = self.loadBrf(brf_file_path)
+        self.pageNumber = page_number
 
-        # convert input Braille file into a matrix
-        self.charMatrix = self.assignCharGridCoords(fileStr)
+        # convert the page of the input Braille file into a matrix
+        if book is not None:
+            self.charMatrix = book.page_grid(page_number)
+        else:
+            with BrfBook(brf_file_path, self.numRows, self.numColumns) as book:
+                self.charMatrix = book.page_grid(page_number)
     
     # Converts .brf file into text string
     def loadBrf(self, brf_file_path):
@@ -42,20 +153,11 @@ class BraillePage:
     def assignCharGridCoords(self, textFile):
         """
         :param textFile: test string obtained from text file of braille printout
-        :return: np matrix where each character is allocated a grid position on the page
+        :return: uint8 np matrix of character codes where each character is allocated a grid position on the page,
+        0 where the line ended before that column
         ex. reference 3rd row, 5th character by calling assignCharGridCoords(textFile,numRows,numColumns)[5][3]
         """
-        charCoords = np.empty((self.numRows, self.numColumns), str)
-        charCount = 0
-        for row in range(self.numRows):
-            for column in range(self.numColumns):
-                char = textFile[charCount]
-                charCount += 1
-                if char == '\n':
-                    break
-                charCoords[row][column] = char
-        print('done')
-        return charCoords
+        return char_grid(textFile.split('\f')[0].encode('latin-1', 'replace'), self.numRows, self.numColumns)
 
     def position2GridCoord(self, x_pos, y_pos):
         """
@@ -76,10 +178,43 @@ class BraillePage:
             gridCoords = self.position2GridCoord(x_pos, y_pos)
             row = gridCoords[0]
             column = gridCoords[1]
-            return self.charMatrix[column][row], row, column
+            return self.code2Char(self.charMatrix[column][row]), row, column
         else:
             #returns char = ' ' and row/column = -1 if finger outside margins
             return ' ', -1, -1
 
+    def positions2Chars(self, x_pos, y_pos):
+        """
+        Vectorized character lookup for arrays of x, y positions (continuous) measured from top left of Braille sheet
+        :param x_pos: array of x positions
+        :param y_pos: array of y positions, same shape as x_pos
+        :return: arrays shaped like the inputs of uint8 character codes, rows (line on the page) and columns
+        (cell within the line). Positions outside the margins get outOfMarginCode and row/column outOfMargin.
+        """
+        x_pos = np.asarray(x_pos, dtype=np.float64)
+        y_pos = np.asarray(y_pos, dtype=np.float64)
+
+        # NaN positions compare False and so count as outside the margins
+        inside = ((x_pos >= self.leftMargin) & (x_pos < self.pageWidth - self.rightMargin) &
+                  (y_pos >= self.topMargin) & (y_pos < self.pageHeight - self.botMargin))
+
+        # same uniform grid as position2GridCoord
+        columns = np.floor(self.numColumns * (np.where(inside, x_pos, self.leftMargin) - self.leftMargin) /
+                           (self.pageWidth - self.leftMargin - self.rightMargin)).astype(np.int16)
+        rows = np.floor(self.numRows * (np.where(inside, y_pos, self.topMargin) - self.topMargin) /
+                        (self.pageHeight - self.topMargin - self.botMargin)).astype(np.int16)
+
+        codes = np.where(inside, self.charMatrix[rows, columns], self.outOfMarginCode).astype(np.uint8)
+        rows[~inside] = self.outOfMargin
+        columns[~inside] = self.outOfMargin
+        return codes, rows, columns
+
+    @staticmethod
+    def code2Char(code):
+        """
+        :returns: the character for a code from charMatrix, '' for cells past the end of a line
+        """
+        return chr(code) if code else ''
+
 if __name__ == '__main__':
     test = BraillePage('./braille_files/B_2019 project FingerTracker.brf')
\ No newline at end of file
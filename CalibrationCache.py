@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+import scan
+
+
+@dataclass(frozen=True)
+class CachedCalibration:
+    transform_metadata: scan.TransformMetadata
+    # boxes of the requested calibration mode, None if it has none cached
+    bboxes: Any
+    colors: Any
+    second: float
+
+
+def video_fingerprint(video_path, n_samples=16, sample_size=65536):
+    """
+    Cheap content hash of a video: its size plus evenly spaced blocks of its bytes, so it survives renames and
+    copies without reading the whole file
+    :param video_path: path of a video file
+    :param n_samples: number of blocks hashed
+    :param sample_size: bytes per block
+    :return: hex digest
+    """
+    size = os.path.getsize(video_path)
+    digest = hashlib.sha1(str(size).encode('utf-8'))
+    with open(video_path, 'rb') as fh:
+        for i in range(n_samples):
+            fh.seek(max(size - sample_size, 0) * i // max(n_samples - 1, 1))
+            digest.update(fh.read(sample_size))
+    return digest.hexdigest()
+
+
+def cache_path(video_path, cache_dir):
+    """
+    :return: path of the cache entry for a video
+    """
+    return os.path.join(cache_dir, video_fingerprint(video_path) + '.json')
+
+
+def load_calibration(video_path, cache_dir='./cache/calibration', frame_size=(1920, 1080), mode='manual'):
+    """
+    Looks up a saved calibration for a video
+    :param video_path: path of a video file
+    :param cache_dir: directory calibrations are cached in
+    :param frame_size: (width, height) of the frames the calibration has to be for
+    :param mode: calibration mode whose bounding boxes are wanted, e.g. 'manual'. Boxes chosen another way are
+    never returned in their place
+    :return: CachedCalibration, or None if the video has not been calibrated before on frames of frame_size
+    """
+    path = cache_path(video_path, cache_dir)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'r') as fh:
+        entry = json.load(fh)
+    # entries without a frame size were calibrated on the video's native frames
+    if tuple(entry.get('frame_size', ())) != tuple(frame_size):
+        return None
+    transform_metadata = scan.TransformMetadata(np.array(entry['transformation_matrix']),
+                                                tuple(entry['im_dims']),
+                                                tuple(entry['desired_dimensions']))
+    boxes = entry.get('boxes', {}).get(mode)
+    if boxes is None:
+        return CachedCalibration(transform_metadata, None, None, None)
+    return CachedCalibration(transform_metadata,
+                             [tuple(bbox) for bbox in boxes['bboxes']],
+                             [tuple(color) for color in boxes['colors']],
+                             boxes['second'])
+
+
+def save_calibration(video_path, transform_metadata, bboxes=None, colors=None, second=None,
+                     cache_dir='./cache/calibration', frame_size=(1920, 1080), mode='manual'):
+    """
+    Saves the page transform of a video, and the bounding boxes chosen on it, so later runs can skip calibration.
+    Boxes already cached for other modes are kept.
+    :param video_path: path of a video file
+    :param transform_metadata: page transform
+    :param bboxes: bounding boxes of the fingers, None to only save the page transform
+    :param colors: color of each box
+    :param second: time stamp (in seconds) of the frame the boxes were chosen on
+    :param cache_dir: directory calibrations are cached in
+    :param frame_size: (width, height) of the frames the transform and boxes are in
+    :param mode: calibration mode the boxes were chosen with, e.g. 'manual'
+    """
+    path = cache_path(video_path, cache_dir)
+    boxes = {}
+    if os.path.exists(path):
+        with open(path, 'r') as fh:
+            previous = json.load(fh)
+        if tuple(previous.get('frame_size', ())) == tuple(frame_size):
+            boxes = previous.get('boxes', {})
+    if bboxes is not None:
+        boxes[mode] = {
+            'bboxes': [[float(v) for v in bbox] for bbox in bboxes],
+            'colors': [[int(c) for c in color] for color in colors],
+            'second': second,
+        }
+
+    entry = {
+        'video': os.path.abspath(video_path),
+        'frame_size': list(frame_size),
+        'transformation_matrix': np.asarray(transform_metadata.transformation_matrix).tolist(),
+        'im_dims': list(transform_metadata.im_dims),
+        'desired_dimensions': list(transform_metadata.desired_dimensions),
+        'boxes': boxes,
+    }
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, 'w') as fh:
+        json.dump(entry, fh, indent=2)
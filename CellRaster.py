@@ -0,0 +1,117 @@
+import json
+
+import cv2
+import numpy as np
+
+import BraillePage
+
+
+def uniform_cell_edges(num_rows=BraillePage.BraillePage.numRows, num_columns=BraillePage.BraillePage.numColumns):
+    """
+    Cell edges of the uniform grid BraillePage.position2GridCoord assumes
+    :return: (num_rows + 1) row edges and (num_columns + 1) column edges, in inches from the top left of the sheet
+    """
+    page = BraillePage.BraillePage
+    row_edges = np.linspace(page.topMargin, page.pageHeight - page.botMargin, num_rows + 1)
+    column_edges = np.linspace(page.leftMargin, page.pageWidth - page.rightMargin, num_columns + 1)
+    return row_edges, column_edges
+
+
+def load_cell_edges(edges_path, num_rows=BraillePage.BraillePage.numRows,
+                    num_columns=BraillePage.BraillePage.numColumns):
+    """
+    Reads cell edges measured on a calibration sheet, from a JSON file of the form
+    {"row_edges": [27 increasing y positions], "column_edges": [43 increasing x positions]} in inches from the top left
+    of the sheet. Either list may be left out to keep the uniform edges.
+    :param edges_path: path of the JSON file
+    :return: row edges, column edges
+    """
+    row_edges, column_edges = uniform_cell_edges(num_rows, num_columns)
+    with open(edges_path, 'r') as fh:
+        entry = json.load(fh)
+    row_edges = np.asarray(entry.get('row_edges', row_edges), dtype=np.float64)
+    column_edges = np.asarray(entry.get('column_edges', column_edges), dtype=np.float64)
+    for name, edges, n_cells in (('row_edges', row_edges, num_rows), ('column_edges', column_edges, num_columns)):
+        if len(edges) != n_cells + 1:
+            raise ValueError('{} needs {} edges, got {}'.format(name, n_cells + 1, len(edges)))
+        if np.any(np.diff(edges) <= 0):
+            raise ValueError('{} must be increasing'.format(name))
+    return row_edges, column_edges
+
+
+class CellRaster:
+    """
+    Lookup image in camera pixels whose value at each pixel is the Braille cell under it, so a finger center maps to
+    its character with one array index. Built once per page transform by warping a raster of the cells on the sheet
+    into the camera's view, which also allows cells of uneven size.
+    """
+    # value of pixels outside the page margins
+    outside = np.iinfo(np.uint16).max
+
+    def __init__(self, transform_metadata, frame_size=(1920, 1080), row_edges=None, column_edges=None, dpi=200):
+        """
+        :param transform_metadata: scan.TransformMetadata from camera pixels to the sheet
+        :param frame_size: (width, height) of the frames finger centers are measured in
+        :param row_edges: (numRows + 1) increasing y positions of the cell edges in inches, defaults to uniform rows
+        :param column_edges: (numColumns + 1) increasing x positions of the cell edges in inches, defaults to uniform
+        columns
+        :param dpi: resolution the sheet is rasterized at before warping
+        """
+        uniform_rows, uniform_columns = uniform_cell_edges()
+        self.row_edges = np.asarray(row_edges if row_edges is not None else uniform_rows, dtype=np.float64)
+        self.column_edges = np.asarray(column_edges if column_edges is not None else uniform_columns,
+                                       dtype=np.float64)
+        self.num_rows = len(self.row_edges) - 1
+        self.num_columns = len(self.column_edges) - 1
+        self.frame_size = frame_size
+
+        # cell of every raster pixel of the sheet, pixel i sampled at i / dpi inches
+        width = int(np.ceil(self.column_edges[-1] * dpi)) + 2
+        height = int(np.ceil(self.row_edges[-1] * dpi)) + 2
+        columns = np.searchsorted(self.column_edges, np.arange(width) / dpi, side='right') - 1
+        rows = np.searchsorted(self.row_edges, np.arange(height) / dpi, side='right') - 1
+        columns[(columns < 0) | (columns >= self.num_columns)] = -1
+        rows[(rows < 0) | (rows >= self.num_rows)] = -1
+        sheet = (rows[:, None] * self.num_columns + columns[None, :]).astype(np.int64)
+        sheet[(rows[:, None] < 0) | (columns[None, :] < 0)] = self.outside
+        sheet = sheet.astype(np.uint16)
+
+        # camera pixels -> sheet raster pixels
+        to_sheet = np.diag([dpi, dpi, 1.0]) @ transform_metadata.scaled_matrix
+        self.raster = cv2.warpPerspective(sheet, to_sheet, frame_size, flags=cv2.INTER_NEAREST | cv2.WARP_INVERSE_MAP,
+                                          borderMode=cv2.BORDER_CONSTANT, borderValue=int(self.outside))
+
+    def cells(self, x_pixels, y_pixels):
+        """
+        :param x_pixels: array of x positions in camera pixels
+        :param y_pixels: array of y positions in camera pixels, same shape as x_pixels
+        :return: int16 arrays of rows and columns, BraillePage.outOfMargin outside the margins or the frame
+        """
+        x = np.asarray(x_pixels, dtype=np.float64)
+        y = np.asarray(y_pixels, dtype=np.float64)
+        # NaN compares False and so counts as outside the frame
+        inside = (x >= -0.5) & (x < self.frame_size[0] - 0.5) & (y >= -0.5) & (y < self.frame_size[1] - 0.5)
+        xi = np.rint(np.where(inside, x, 0)).astype(np.intp)
+        yi = np.rint(np.where(inside, y, 0)).astype(np.intp)
+        cells = np.where(inside, self.raster[yi, xi], self.outside).astype(np.int32)
+
+        outside = cells == self.outside
+        rows = (cells // self.num_columns).astype(np.int16)
+        columns = (cells % self.num_columns).astype(np.int16)
+        rows[outside] = BraillePage.BraillePage.outOfMargin
+        columns[outside] = BraillePage.BraillePage.outOfMargin
+        return rows, columns
+
+    def positions2Chars(self, braille_page, x_pixels, y_pixels):
+        """
+        Same as BraillePage.positions2Chars, but for positions in camera pixels
+        :param braille_page: BraillePage.BraillePage whose characters are looked up
+        :param x_pixels: array of x positions in camera pixels
+        :param y_pixels: array of y positions in camera pixels, same shape as x_pixels
+        :return: arrays of uint8 character codes, rows and columns
+        """
+        rows, columns = self.cells(x_pixels, y_pixels)
+        outside = rows == BraillePage.BraillePage.outOfMargin
+        codes = braille_page.charMatrix[np.where(outside, 0, rows), np.where(outside, 0, columns)]
+        codes = np.where(outside, BraillePage.BraillePage.outOfMarginCode, codes).astype(np.uint8)
+        return codes, rows, columns
@@ -0,0 +1,373 @@
+import concurrent.futures
+import multiprocessing
+import os
+import time
+
+import cv2
+import numpy as np
+
+import ColorMasking
+import FingerTracking
+import FramePipeline
+import VideoSeeker
+import VideoTracker
+
+def chunk_ranges(first_frame, n_frames, chunk_frames, overlap_frames):
+    """
+    Splits a video into chunks tracked on their own. Each chunk but the first starts tracking overlap_frames before
+    its own frames, so the end of the previous chunk is tracked twice and the two can be stitched together.
+    :param first_frame: calibration frame, tracking starts on the frame after it
+    :param n_frames: number of frames in the video
+    :param chunk_frames: frames per chunk
+    :param overlap_frames: frames each chunk shares with the one before it
+    :return: list of (seed_frame, start, stop): the trackers are started on seed_frame and the chunk tracks frames
+    seed_frame + 1 up to stop, of which start up to stop are its own. stop is None for the last chunk, which runs to
+    the end of the video.
+    """
+    first_tracked = first_frame + 1
+    starts = list(range(first_tracked, n_frames, chunk_frames))
+    # fold a short last chunk into the one before it
+    if len(starts) > 1 and n_frames - starts[-1] < chunk_frames // 2:
+        starts.pop()
+    chunks = []
+    for k, start in enumerate(starts):
+        seed_frame = first_frame if k == 0 else max(start - 1 - overlap_frames, starts[k - 1])
+        stop = starts[k + 1] if k + 1 < len(starts) else None
+        chunks.append((seed_frame, start, stop))
+    return chunks
+
+
+def create_multi_tracker(settings):
+    """
+    :param settings: chunk settings, see track_chunks
+    :return: empty finger tracker and a callable creating the tracker added for each finger, None for COLOR
+    """
+    tracker_type = settings['tracker_type']
+    create = VideoTracker.VideoTracker.create_tracker_by_name
+    if tracker_type == VideoTracker.VideoTracker.colorTrackerType:
+        return ColorMasking.ColorMarkerDetector(settings['marker_colors'], settings['marker_delta_h'],
+                                                settings['marker_delta_s']), None
+    if tracker_type == VideoTracker.VideoTracker.hybridTrackerType:
+        fast_tracker_type = settings['fast_tracker_type']
+        multi_tracker = FingerTracking.HybridFingerTracker(lambda: create(fast_tracker_type),
+                                                           settings['anchor_interval'], settings['anchor_confidence'])
+        return multi_tracker, lambda: create('CSRT')
+    return FingerTracking.MultiFingerTracker(), lambda: create(tracker_type)
+
+
+def find_markers(frame, settings):
+    """
+    :param frame: full resolution frame
+    :param settings: chunk settings, see track_chunks
+    :return: (markers found, 4) boxes of the fingertip markers found on the frame, see
+    ColorMasking.ColorMarkerDetector
+    """
+    detector = ColorMasking.ColorMarkerDetector(settings['marker_colors'], settings['marker_delta_h'],
+                                                settings['marker_delta_s'])
+    success, boxes = detector.update(frame)
+    return boxes[~np.isnan(boxes).any(axis=1)]
+
+
+def marker_boxes(frame, settings):
+    """
+    Finds the fingers on a chunk's first frame from their colored markers
+    :param frame: full resolution frame
+    :param settings: chunk settings, see track_chunks
+    :return: (markers found, 4) boxes of seed_size around every marker found. Markers are not in finger order, the
+    chunk is matched to the one before it when stitching.
+    """
+    boxes = find_markers(frame, settings)
+    size = np.asarray(settings['seed_size'], dtype=np.float64)
+    centers = boxes[:, :2] + boxes[:, 2:] / 2
+    return np.hstack([centers - size / 2, np.tile(size, (len(boxes), 1))])
+
+
+def plan_chunks(video_path, first_frame, n_fingers, settings, chunk_frames=9000, overlap_frames=60):
+    """
+    Splits a video into the chunks track_chunks can start on their own. A chunk other than the first is started from
+    the fingertip markers on its seed frame, so where fewer markers than fingers are visible there it could only be
+    tracked again from the chunk before it, once that is done. Such a chunk is tracked as part of the chunk before it
+    instead. In COLOR mode every chunk finds its markers itself.
+    :param video_path: path of the video
+    :param first_frame: calibration frame, tracking starts on the frame after it
+    :param n_fingers: number of fingers tracked
+    :param settings: chunk settings, see track_chunks
+    :param chunk_frames: frames per chunk
+    :param overlap_frames: frames each chunk shares with the one before it
+    :return: list of (seed_frame, start, stop), see chunk_ranges. A single chunk if markers are never found where
+    chunks would start, then the video is better tracked in one pass.
+    """
+    if overlap_frames < 2:
+        raise ValueError('Chunks need an overlap of at least 2 frames to be stitched')
+    cap = cv2.VideoCapture(video_path)
+    try:
+        chunks = chunk_ranges(first_frame, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), chunk_frames, overlap_frames)
+        if settings['tracker_type'] == VideoTracker.VideoTracker.colorTrackerType:
+            return chunks
+        seeker = VideoSeeker.VideoSeeker(cap, video_path, cap.get(cv2.CAP_PROP_FPS))
+        planned = chunks[:1]
+        for seed_frame, start, stop in chunks[1:]:
+            seeker.seek(seed_frame)
+            success, frame = cap.read()
+            if success and len(find_markers(cv2.resize(frame, (1920, 1080)), settings)) >= n_fingers:
+                planned.append((seed_frame, start, stop))
+            else:
+                print('Not every fingertip marker is visible on frame {}, tracking frames {} onwards with the chunk '
+                      'before them'.format(seed_frame, start))
+                planned[-1] = planned[-1][:2] + (stop,)
+    finally:
+        cap.release()
+    return planned
+
+
+def track_chunk(video_path, seed_frame, stop, seed_boxes, settings):
+    """
+    Worker entry point: tracks one chunk of a video
+    :param video_path: path of the video
+    :param seed_frame: frame the trackers are started on
+    :param stop: frame to stop before, None to track to the end of the video
+    :param seed_boxes: (x, y, w, h) box of every finger on seed_frame, in full resolution pixels, or None to start
+    from the fingertip markers found on seed_frame
+    :param settings: chunk settings, see track_chunks
+    :return: (n, tracks, 4) float32 boxes of frames seed_frame + 1 onwards, in full resolution pixels. Empty if no
+    markers were found on seed_frame.
+    """
+    # every chunk gets its own process, so keep OpenCV from oversubscribing the cores
+    cv2.setNumThreads(1)
+    cap = cv2.VideoCapture(video_path)
+    try:
+        VideoSeeker.VideoSeeker(cap, video_path, cap.get(cv2.CAP_PROP_FPS)).seek(seed_frame)
+        geometry = FramePipeline.TrackingGeometry((1920, 1080), settings['tracking_scale'], settings['roi'])
+        frames = FramePipeline.read_frames(cap, geometry)
+        frame, track_frame = next(frames)
+
+        multi_tracker, create_tracker = create_multi_tracker(settings)
+        if create_tracker is not None:
+            if seed_boxes is None:
+                seed_boxes = marker_boxes(frame, settings)
+            if len(seed_boxes) == 0:
+                return np.zeros((0, 0, 4), dtype=np.float32)
+        for bbox in geometry.to_track(seed_boxes) if create_tracker is not None else []:
+            multi_tracker.add(create_tracker(), track_frame, bbox)
+
+        n_frames = stop - seed_frame - 1 if stop is not None else None
+        boxes = []
+        for frame, track_frame in frames:
+            if n_frames is not None and len(boxes) >= n_frames:
+                break
+            success, track_boxes = multi_tracker.update(track_frame)
+            boxes.append(geometry.to_frame(track_boxes))
+    finally:
+        cap.release()
+    n_tracks = len(seed_boxes) if create_tracker is not None else len(multi_tracker.marker_colors)
+    return np.array(boxes, dtype=np.float32).reshape(-1, n_tracks, 4)
+
+
+def match_overlap(previous, current, tolerance):
+    """
+    Matches the fingers of a chunk to those of the chunk before it over the frames both tracked
+    :param previous: (overlap, fingers, 4) boxes of the earlier chunk
+    :param current: (overlap, tracks, 4) boxes of the later chunk on the same frames
+    :param tolerance: largest distance in pixels between the box centers of a matched pair, measured over the second
+    half of the overlap so the later chunk's trackers have settled
+    :return: for every finger of previous, the index of its track in current, -1 if none is within tolerance
+    """
+    settled = max(len(previous) // 2, 1)
+    previous_centers = previous[-settled:, :, :2] + previous[-settled:, :, 2:] / 2
+    current_centers = current[-settled:, :, :2] + current[-settled:, :, 2:] / 2
+    # median distance between every finger and every track
+    distances = np.median(np.linalg.norm(previous_centers[:, :, None] - current_centers[:, None], axis=3), axis=0)
+
+    matches = np.full(previous.shape[1], -1)
+    # closest pairs first
+    for flat in np.argsort(distances, axis=None):
+        finger, track = np.unravel_index(flat, distances.shape)
+        if distances[finger, track] > tolerance:
+            break
+        if matches[finger] < 0 and track not in matches:
+            matches[finger] = track
+    return matches
+
+
+def stitch(previous, current, matches):
+    """
+    Joins the overlap of two chunks finger by finger, switching to the later chunk on the frame where the two tracks
+    are closest so the switch does not jump
+    :param previous: (overlap, fingers, 4) boxes of the earlier chunk
+    :param current: (overlap, tracks, 4) boxes of the later chunk
+    :param matches: track of every finger in current, from match_overlap
+    :return: (overlap, fingers, 4) stitched boxes
+    """
+    stitched = previous.copy()
+    for finger, track in enumerate(matches):
+        if track < 0:
+            continue
+        gaps = np.linalg.norm((previous[:, finger, :2] + previous[:, finger, 2:] / 2) -
+                              (current[:, track, :2] + current[:, track, 2:] / 2), axis=1)
+        if np.isnan(gaps).all():
+            continue
+        switch = int(np.nanargmin(gaps))
+        stitched[switch:, finger] = current[switch:, track]
+    return stitched
+
+
+def fill_unseen(boxes, last=None):
+    """
+    Gives markers missing from a frame their last box, as ColorMasking.ColorMarkerDetector does when it runs through
+    the whole video, since a chunk's detector has not seen the markers before the chunk started
+    :param boxes: (frames, fingers, 4) boxes, NaN where a marker was not seen yet
+    :param last: (fingers, 4) boxes of the frame before the first one, for markers not seen since
+    :return: the boxes, filled in place
+    """
+    if last is not None:
+        boxes[:] = fill_unseen(np.concatenate([last[None], boxes]))[1:]
+        return boxes
+    seen = ~np.isnan(boxes).any(axis=2)
+    last_seen = np.maximum.accumulate(np.where(seen, np.arange(len(boxes))[:, None], 0), axis=0)
+    filled = boxes[last_seen, np.arange(boxes.shape[1])]
+    boxes[:] = np.where(seen[:, :, None], boxes, filled)
+    return boxes
+
+
+def overlap_matches(previous, current, overlap, color, tolerance):
+    """
+    :param previous: boxes of the earlier chunk on the overlap frames
+    :param current: boxes of the later chunk from its first tracked frame, None if it has none
+    :param overlap: number of frames the chunks share
+    :param color: True in COLOR mode, where tracks are already in finger order
+    :param tolerance: see match_overlap
+    :return: track in current of every finger, None if a finger has none and the chunk has to be tracked again
+    """
+    if current is None or len(current) < overlap or current.shape[1] == 0:
+        return None
+    if color:
+        return np.arange(current.shape[1])
+    matches = match_overlap(previous, current[:overlap], tolerance)
+    return None if np.any(matches < 0) else matches
+
+
+def track_chunks(video_path, chunks, bboxes, settings, write_boxes, workers=None, tolerance=15.0):
+    """
+    Tracks one video in chunks, each in its own process, and stitches the chunks into one track. The first chunk
+    starts from the calibration boxes; every other chunk seeks to its first frame and starts from the fingertip markers
+    found there, so no process has to go through the video ahead of the chunks. The overlap with the previous chunk
+    decides which track is which finger. A chunk with a finger that matches nothing there is tracked again, started
+    from where the chunk before it has the fingers. These retracks are queued as soon as both chunks are done and run
+    alongside the remaining chunks; only a retrack that follows another one has to wait for it.
+    Stitched frames are handed to write_boxes as soon as no later chunk can change them, so only the chunks that are
+    done but not stitched yet are held in memory.
+    :param video_path: path of the video
+    :param chunks: list of (seed_frame, start, stop) from plan_chunks, the first seed frame is the calibration frame
+    :param bboxes: box of every finger on the calibration frame, in full resolution pixels
+    :param settings: dict of tracker_type, tracking_scale, roi, fast_tracker_type, anchor_interval,
+    anchor_confidence, marker_colors, marker_delta_h and marker_delta_s
+    :param write_boxes: called with the (frames, fingers, 4) float32 boxes, in full resolution pixels, of every run of
+    stitched frames in order, starting with the frame after the calibration frame
+    :param workers: number of chunks tracked at once, defaults to the number of cores
+    :param tolerance: pixels two chunks' tracks of a finger may be apart in the overlap, see match_overlap
+    :return: dict describing the run
+    """
+    workers = workers or os.cpu_count() or 1
+    first_frame = chunks[0][0]
+    color = settings['tracker_type'] == VideoTracker.VideoTracker.colorTrackerType
+    if not color:
+        # marker seeds get the calibration boxes' size
+        sizes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)[:, 2:]
+        settings = dict(settings, seed_size=tuple(np.median(sizes, axis=0)))
+    print('Tracking {} chunks with {} workers'.format(len(chunks), workers))
+
+    start = time.time()
+    # boxes of the last frame written, which markers not seen yet keep in COLOR mode
+    last = None
+
+    def emit(boxes):
+        nonlocal last
+        if color:
+            boxes = fill_unseen(boxes, last)
+        if len(boxes):
+            write_boxes(boxes)
+            last = boxes[-1]
+
+    # spawn gives each worker a clean interpreter instead of a fork of this one's OpenCV state
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as pool:
+        futures = [pool.submit(track_chunk, video_path, seed_frame, stop, bboxes if k == 0 else None, settings)
+                   for k, (seed_frame, chunk_start, stop) in enumerate(chunks)]
+        retracks = {}
+        queued = []
+        # chunks compared with the one before them so far
+        checked = 1
+
+        def queue_retracks():
+            # compare every finished chunk with the one before it, and queue the retracks right away
+            nonlocal checked
+            while checked < len(chunks) and futures[checked - 1].done() and futures[checked].done():
+                k = checked
+                previous, current = futures[k - 1].result(), futures[k].result()
+                seed_frame, chunk_start, stop = chunks[k]
+                previous_seed = chunks[k - 1][0]
+                overlap = chunk_start - seed_frame - 1
+                # frames seed_frame + 1 up to chunk_start are the last ones of the previous chunk
+                previous_overlap = previous[seed_frame - previous_seed:chunk_start - previous_seed - 1]
+                if len(previous_overlap) == overlap and seed_frame > previous_seed and \
+                        overlap_matches(previous_overlap, current, overlap, color, tolerance) is None:
+                    seed_boxes = previous[seed_frame - previous_seed - 1]
+                    retracks[k] = pool.submit(track_chunk, video_path, seed_frame, stop, seed_boxes, settings)
+                    queued.append(k)
+                checked += 1
+
+        def result(future):
+            # keep queueing retracks while waiting
+            while not future.done():
+                concurrent.futures.wait([future] + futures[checked - 1:checked + 1],
+                                        return_when=concurrent.futures.FIRST_COMPLETED)
+                queue_retracks()
+            return future.result()
+
+        # stitch in order, a chunk still without a match is tracked again from the stitched boxes
+        # tail holds the stitched boxes from frame first_frame + 1 + tail_start on that are not written yet
+        tail, tail_start = result(futures[0]), 0
+        retracked = []
+        for k in range(1, len(chunks)):
+            seed_frame, chunk_start, stop = chunks[k]
+            overlap_start = seed_frame - first_frame
+            overlap_stop = chunk_start - first_frame - 1
+            if overlap_stop > tail_start + len(tail):
+                print('Chunk {} ended early, at frame {}'.format(k - 1, first_frame + 1 + tail_start + len(tail)))
+                break
+
+            chunk_boxes = result(futures[k])
+            queue_retracks()
+            # only the next chunk's comparison needs this one's own boxes
+            futures[k - 1] = None
+            stitched = tail[overlap_start - tail_start:overlap_stop - tail_start]
+            matches = overlap_matches(stitched, chunk_boxes, overlap_stop - overlap_start, color, tolerance)
+            if matches is None and k in retracks:
+                retracked.append(k)
+                chunk_boxes = result(retracks.pop(k))
+                matches = overlap_matches(stitched, chunk_boxes, overlap_stop - overlap_start, color, tolerance)
+            if matches is None:
+                # start again from where the stitched track has the fingers
+                if k not in retracked:
+                    retracked.append(k)
+                seed_boxes = tail[overlap_start - 1 - tail_start] if overlap_start > 0 else \
+                    np.asarray(bboxes, np.float32)
+                chunk_boxes = result(pool.submit(track_chunk, video_path, seed_frame, stop, seed_boxes, settings))
+                matches = np.arange(chunk_boxes.shape[1])
+            if len(chunk_boxes) < overlap_stop - overlap_start:
+                print('Chunk {} ended early, at frame {}'.format(k, seed_frame + 1 + len(chunk_boxes)))
+                break
+
+            # everything up to this chunk's own frames is final now
+            emit(tail[:overlap_start - tail_start])
+            emit(stitch(stitched, chunk_boxes[:overlap_stop - overlap_start], matches))
+            tail, tail_start = chunk_boxes[overlap_stop - overlap_start:, matches], overlap_stop
+        emit(tail)
+        for future in retracks.values():
+            future.cancel()
+
+    run_info = {'chunks': len(chunks), 'chunk_ranges': [list(chunk) for chunk in chunks],
+                'retracked_chunks': retracked, 'queued_retracks': queued, 'workers': workers,
+                'seconds': time.time() - start}
+    print('Stitched {} chunks, {} tracked again from the previous chunk'.format(len(chunks), len(retracked)))
+    return run_info
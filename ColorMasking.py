@@ -3,12 +3,25 @@ import numpy as np
 import argparse
 import cv2 as cv
 
-# construct the argument parse and parse the arguments
-ap = argparse.ArgumentParser()
-ap.add_argument("-i", "--image", help="path to the image")
-args = vars(ap.parse_args())
+# (hue in degrees, saturation %, value %) of the fingertip markers, one per finger slot from left pinky to right pinky
+default_marker_colors = [(360, 72, 47),   # red
+                         (18, 71, 64),    # orange
+                         (50, 64, 64),    # yellow
+                         (94, 61, 89),    # green
+                         (196, 90, 90),   # blue
+                         (259, 36, 100),  # purple
+                         (318, 71, 43),   # purple two
+                         (332, 37, 100)]  # pink
 
-def set_masks(colors, delta):
+
+def set_masks(hsv, colors, delta):
+    """
+    Mask of the pixels close to any of a set of hues
+    :param hsv: image converted to HSV
+    :param colors: OpenCV hues (0-180)
+    :param delta: hue tolerance
+    :return: uint8 mask, 255 where a color matches
+    """
     bounds = [(np.array([color - delta, 100, 100]), np.array([color + delta, 255, 255])) for color in colors]
     masks = [cv.inRange(hsv, bound[0], bound[1]) for bound in bounds]
     mask = masks[0]
@@ -17,95 +30,347 @@ def set_masks(colors, delta):
     return mask
 
 
-# load the image
-image = cv.imread("images/blurNight.jpg")
-cv.namedWindow("Display Window", cv.WINDOW_AUTOSIZE)
-# Take each frame
-# Convert BGR to HSV
-hsv = cv.cvtColor(image, cv.COLOR_BGR2HSV)
-# define range of blue color in HSV
+############ Aryan's Code ######################
+def hsv_bounds(val, delta_h, delta_s):
+    """
+    OpenCV inRange bounds of a color given the way color pickers show it
+    :param val: (hue in degrees 0-360, saturation % , value %)
+    :param delta_h: hue tolerance, in OpenCV hue units (0-180)
+    :param delta_s: saturation and value tolerance, in OpenCV units (0-255)
+    :return: list of (lower, upper) bounds, two when the hue range wraps around red
+    """
+    hue = (val[0] * 0.5) % 180
+    sat, value = val[1] * 255.0 / 100, val[2] * 255.0 / 100
+    bot = np.array([hue - delta_h, sat - delta_s, value - delta_s])
+    top = np.array([hue + delta_h, sat + delta_s, value + delta_s])
+    if bot[0] < 0:
+        return [(np.array([bot[0] + 180, bot[1], bot[2]]), np.array([180, top[1], top[2]])),
+                (np.array([0, bot[1], bot[2]]), top)]
+    if top[0] > 180:
+        return [(bot, np.array([180, top[1], top[2]])),
+                (np.array([0, bot[1], bot[2]]), np.array([top[0] - 180, top[1], top[2]]))]
+    return [(bot, top)]
+
+
+def color_mask(hsv, val, delta_h, delta_s):
+    """
+    :param hsv: image converted to HSV
+    :param val: (hue in degrees 0-360, saturation % , value %) of the color
+    :param delta_h: hue tolerance, in OpenCV hue units (0-180)
+    :param delta_s: saturation and value tolerance, in OpenCV units (0-255)
+    :return: uint8 mask, 255 where the color matches
+    """
+    mask = None
+    for bot, top in hsv_bounds(val, delta_h, delta_s):
+        cur_mask = cv.inRange(hsv, bot, top)
+        mask = cur_mask if mask is None else mask | cur_mask
+    return mask
 
-#### Collin's Code #####
 
-colors = [46, 100, 166, 130, 28, 146]
-delta = 10
-colormask = set_masks(colors, delta)
-res1 = cv.bitwise_and(image, image, mask=colormask)
+def maskMaker(hsv, mask_values, delta_h, delta_s):
+    """
+    Mask of the pixels matching any of a set of colors
+    :param hsv: image converted to HSV
+    :param mask_values: list of (hue in degrees 0-360, saturation % , value %)
+    :param delta_h: hue tolerance, in OpenCV hue units (0-180)
+    :param delta_s: saturation and value tolerance, in OpenCV units (0-255)
+    :return: uint8 mask, 255 where a color matches
+    """
+    mask = np.zeros(hsv.shape[:2], dtype=np.uint8)
+    # one lookup pass per 8 colors instead of one inRange pass per color
+    for i in range(0, len(mask_values), HsvMaskEngine.maxColors):
+        engine = HsvMaskEngine(mask_values[i:i + HsvMaskEngine.maxColors], delta_h, delta_s)
+        mask |= cv.compare(engine.label_hsv(hsv), 0, cv.CMP_GT)
+    return mask
 
-#########################
 
+class HsvMaskEngine:
+    """
+    Labels the pixels of a frame with the marker colors they match in a single lookup table pass, however many
+    colors there are (up to 8). Each color's HSV range is compiled into per-channel tables of color bits, a pixel
+    matches a color when the bit is set in the tables of all three of its channels. Output buffers are reused across
+    frames of the same size.
+    """
+    maxColors = 8
 
-#### Original un-simplified #########
-delta = 2.5
+    def __init__(self, marker_colors, delta_h=10, delta_s=50):
+        """
+        :param marker_colors: list of (hue in degrees 0-360, saturation %, value %), at most 8
+        :param delta_h: hue tolerance, in OpenCV hue units (0-180)
+        :param delta_s: saturation and value tolerance, in OpenCV units (0-255)
+        """
+        if len(marker_colors) > self.maxColors:
+            raise ValueError('At most {} colors fit in one mask engine, got {}'.format(self.maxColors,
+                                                                                    len(marker_colors)))
+        self.n_colors = len(marker_colors)
+        values = np.arange(256)[:, None]
+        tables = np.zeros((256, 3), dtype=np.uint8)
+        for i, val in enumerate(marker_colors):
+            for bot, top in hsv_bounds(val, delta_h, delta_s):
+                # same bounds as cv.inRange, which rounds them to the nearest integer and includes both ends
+                inside = (values >= np.rint(bot)) & (values <= np.rint(top))
+                tables[inside] |= np.uint8(1 << i)
+        # cv.LUT applies channel c of a 3 channel table to channel c of the image
+        self.table = np.ascontiguousarray(tables.reshape(1, 256, 3))
 
-lower_green = np.array([46 - delta, 100, 100])
-upper_green = np.array([46 + delta, 255, 255])
+        # color bits -> index of the lowest color matched plus one, 0 for none
+        bits = np.arange(256)
+        self.index_table = np.zeros(256, dtype=np.uint8)
+        for i in reversed(range(self.maxColors)):
+            self.index_table[(bits >> i) & 1 == 1] = i + 1
 
-lower_blue = np.array([100 - delta, 100, 100])
-upper_blue = np.array([100 + delta, 255, 255])
+        self.shape = None
 
-lower_pink = np.array([166 - delta, 90, 200])
-upper_pink = np.array([166 + delta, 200, 255])
+    def _allocate(self, shape):
+        height, width = shape[:2]
+        self.shape = shape[:2]
+        self.hsv = np.empty((height, width, 3), dtype=np.uint8)
+        self.channel_bits = np.empty((height, width, 3), dtype=np.uint8)
+        self.bits = np.empty((height, width), dtype=np.uint8)
+        self.other_bits = np.empty((height, width), dtype=np.uint8)
+        self.index = np.empty((height, width), dtype=np.uint8)
+        self.mask_buffer = np.empty((height, width), dtype=np.uint8)
 
-lower_purple = np.array([130 - delta, 0, 0])
-upper_purple = np.array([130 + delta, 255, 255])
+    def label(self, frame):
+        """
+        :param frame: BGR frame
+        :return: uint8 image, bit i set where the pixel matches color i. Overwritten by the next call.
+        """
+        if self.shape != frame.shape[:2]:
+            self._allocate(frame.shape)
+        cv.cvtColor(frame, cv.COLOR_BGR2HSV, dst=self.hsv)
+        return self.label_hsv(self.hsv)
 
-lower_yellow = np.array([28 - delta, 0, 0])
-upper_yellow = np.array([28 + delta, 255, 255])
+    def label_hsv(self, hsv):
+        """
+        :param hsv: frame already converted to HSV
+        :return: uint8 image, bit i set where the pixel matches color i. Overwritten by the next call.
+        """
+        if self.shape != hsv.shape[:2]:
+            self._allocate(hsv.shape)
+        cv.LUT(hsv, self.table, dst=self.channel_bits)
+        cv.extractChannel(self.channel_bits, 0, dst=self.bits)
+        cv.extractChannel(self.channel_bits, 1, dst=self.other_bits)
+        cv.bitwise_and(self.bits, self.other_bits, dst=self.bits)
+        cv.extractChannel(self.channel_bits, 2, dst=self.other_bits)
+        cv.bitwise_and(self.bits, self.other_bits, dst=self.bits)
+        return self.bits
 
-lower_purple_two = np.array([146 - delta, 0, 0])
-upper_purple_two = np.array([146 + delta, 255, 255])
+    def color_index(self):
+        """
+        :return: uint8 image of the last labelled frame, i + 1 where the pixel matches color i (the lowest one if it
+        matches several) and 0 where it matches none. Overwritten by the next call.
+        """
+        cv.LUT(self.bits, self.index_table, dst=self.index)
+        return self.index
 
-####################################
+    def mask(self, i):
+        """
+        :param i: index of a color
+        :return: uint8 mask of the last labelled frame, nonzero where the pixel matches color i. Overwritten by the
+        next call.
+        """
+        cv.bitwise_and(self.bits, 1 << i, dst=self.mask_buffer)
+        return self.mask_buffer
 
 
-# Threshold the HSV image to get only blue colors
-# Threshold the HSV image to get only green colors
-mask_green = cv.inRange(hsv, lower_green, upper_green)
-# Threshold for blue
-mask_blue = cv.inRange(hsv, lower_blue, upper_blue)
-mask_pink = cv.inRange(hsv, lower_pink, upper_pink)
-mask_purple = cv.inRange(hsv, lower_purple, upper_purple)
-mask_yellow = cv.inRange(hsv, lower_yellow, upper_yellow)
+class ColorMarkerDetector:
+    """
+    Finds colored fingertip markers in every frame instead of tracking them. Each marker color is one finger slot,
+    so fingers are never swapped and a finger lost in one frame is found again as soon as its marker is visible.
+    Has the same update interface as FingerTracking.MultiFingerTracker.
+    """
+    def __init__(self, marker_colors=None, delta_h=10, delta_s=50, min_area=20):
+        """
+        :param marker_colors: list of at most 8 (hue in degrees 0-360, saturation %, value %), one per finger slot,
+        defaults to default_marker_colors
+        :param delta_h: hue tolerance, in OpenCV hue units (0-180)
+        :param delta_s: saturation and value tolerance, in OpenCV units (0-255)
+        :param min_area: smallest blob, in pixels of the frames given to update, taken as a marker
+        """
+        self.marker_colors = list(marker_colors if marker_colors is not None else default_marker_colors)
+        self.delta_h = delta_h
+        self.delta_s = delta_s
+        self.min_area = min_area
+        self.engine = HsvMaskEngine(self.marker_colors, delta_h, delta_s)
+        # centre of each color in OpenCV units, to give a pixel matching several colors to the nearest one
+        self.centers = np.array([((val[0] * 0.5) % 180, val[1] * 255.0 / 100, val[2] * 255.0 / 100)
+                                 for val in self.marker_colors])
+        # unknown until a marker is first seen
+        self.boxes = np.full((len(self.marker_colors), 4), np.nan)
 
+    def draw_colors(self):
+        """
+        :return: BGR color of each marker, for drawing its box
+        """
+        hsv = np.array([[[(val[0] * 0.5) % 180, val[1] * 255.0 / 100, val[2] * 255.0 / 100]
+                         for val in self.marker_colors]], dtype=np.uint8)
+        return [tuple(int(c) for c in bgr) for bgr in cv.cvtColor(hsv, cv.COLOR_HSV2BGR)[0]]
 
-############ Aryan's Code ######################
-def maskMaker(mask_values, delta_h, delta_s):
-    mask = False
-    for val in mask_values:
-        cur_top = np.array([(val[0]*0.5)+delta_h, (val[1]*255.0/100)+delta_s, (val[2]*255.0/100)+delta_s])
-        cur_bot = np.array([(val[0]*0.5)-delta_h, (val[1]*255.0/100)-delta_s, (val[2]*255.0/100)-delta_s])
-        cur_mask = cv.inRange(hsv, cur_bot, cur_top)
-        mask = mask | cur_mask
-    return mask
+    def locate(self, mask):
+        """
+        :param mask: uint8 mask of one marker color
+        :return: (x, y, w, h) box centered on the centroid of the largest blob, or None if no blob is big enough
+        """
+        n_labels, labels, stats, centroids = cv.connectedComponentsWithStats(mask, connectivity=8)
+        if n_labels < 2:
+            return None
+        # label 0 is the background
+        largest = 1 + int(np.argmax(stats[1:, cv.CC_STAT_AREA]))
+        if stats[largest, cv.CC_STAT_AREA] < self.min_area:
+            return None
+        w, h = stats[largest, cv.CC_STAT_WIDTH], stats[largest, cv.CC_STAT_HEIGHT]
+        cx, cy = centroids[largest]
+        return cx - w / 2, cy - h / 2, w, h
+
+    def nearest_colors(self, ys, xs, pixel_bits):
+        """
+        :param ys: (N,) rows of pixels of the last labelled frame
+        :param xs: (N,) columns of the same pixels
+        :param pixel_bits: (N,) color bits of the same pixels, at least one set
+        :return: (N,) index of the matched color whose centre is nearest each pixel, distances measured in
+        tolerances so hue and saturation/value count alike
+        """
+        # lowest color matched, the only one for most pixels
+        nearest = self.engine.index_table[pixel_bits].astype(np.intp) - 1
+        several = np.nonzero(pixel_bits & (pixel_bits - 1))[0]
+        if len(several) == 0:
+            return nearest
+        hsv = self.engine.hsv[ys[several], xs[several]]
+        diff = np.abs(hsv[:, None, :].astype(np.float64) - self.centers[None, :, :])
+        # hue wraps around at 180
+        diff[:, :, 0] = np.minimum(diff[:, :, 0], 180 - diff[:, :, 0])
+        distances = (diff[:, :, 0] / self.delta_h) ** 2 + \
+                    (diff[:, :, 1] ** 2 + diff[:, :, 2] ** 2) / float(self.delta_s) ** 2
+        matches = (pixel_bits[several, None] >> np.arange(len(self.marker_colors))) & 1 == 1
+        distances[~matches] = np.inf
+        nearest[several] = np.argmin(distances, axis=1)
+        return nearest
+
+    def update(self, frame):
+        """
+        Finds every marker in a new frame. A marker not found keeps its last box. The pixels of all colors are split
+        into blobs with one connected components pass, and only the pixels of those blobs are then grouped by the colors
+        they match, so the cost barely grows with the number of markers. Colors can overlap (orange pixels may also
+        match red), so each pixel counts only for the nearest color it matches and each blob belongs to the one color
+        most of its pixels are nearest to, a blob is never the marker of two fingers.
+        :param frame: next frame
+        :return: True if every marker was found, (N, 4) float64 array of boxes, NaN for markers never seen yet
+        """
+        self.engine.label(frame)
+        n_labels, labels = cv.connectedComponents(self.engine.bits, connectivity=8)
+        if n_labels < 2:
+            return False, self.boxes.copy()
+
+        # blob and color bits of every pixel matching any color
+        ys, xs = np.nonzero(labels)
+        blobs = labels[ys, xs]
+        pixel_bits = self.engine.bits[ys, xs]
+        nearest = self.nearest_colors(ys, xs, pixel_bits)
+
+        n_colors = len(self.marker_colors)
+        votes = np.bincount(blobs * n_colors + nearest, minlength=n_labels * n_colors).reshape(n_labels, n_colors)
+        areas = votes.sum(axis=1)
+        owners = np.argmax(votes, axis=1)
+        # label 0 is the background
+        areas[0] = 0
+
+        success = True
+        for i in range(n_colors):
+            owned = np.where(owners == i, areas, 0)
+            largest = int(np.argmax(owned))
+            if owned[largest] < self.min_area:
+                success = False
+                continue
+            members = blobs == largest
+            blob_xs, blob_ys = xs[members], ys[members]
+            w = int(blob_xs.max() - blob_xs.min()) + 1
+            h = int(blob_ys.max() - blob_ys.min()) + 1
+            self.boxes[i] = blob_xs.mean() - w / 2, blob_ys.mean() - h / 2, w, h
+        return success, self.boxes.copy()
+
+if __name__ == '__main__':
+    # construct the argument parse and parse the arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-i", "--image", help="path to the image")
+    args = vars(ap.parse_args())
+
+    # load the image
+    image = cv.imread("images/blurNight.jpg")
+    cv.namedWindow("Display Window", cv.WINDOW_AUTOSIZE)
+    # Take each frame
+    # Convert BGR to HSV
+    hsv = cv.cvtColor(image, cv.COLOR_BGR2HSV)
+    # define range of blue color in HSV
+
+    #### Collin's Code #####
+
+    colors = [46, 100, 166, 130, 28, 146]
+    delta = 10
+    colormask = set_masks(hsv, colors, delta)
+    res1 = cv.bitwise_and(image, image, mask=colormask)
+
+    #########################
+
+
+    #### Original un-simplified #########
+    delta = 2.5
+
+    lower_green = np.array([46 - delta, 100, 100])
+    upper_green = np.array([46 + delta, 255, 255])
+
+    lower_blue = np.array([100 - delta, 100, 100])
+    upper_blue = np.array([100 + delta, 255, 255])
+
+    lower_pink = np.array([166 - delta, 90, 200])
+    upper_pink = np.array([166 + delta, 200, 255])
+
+    lower_purple = np.array([130 - delta, 0, 0])
+    upper_purple = np.array([130 + delta, 255, 255])
+
+    lower_yellow = np.array([28 - delta, 0, 0])
+    upper_yellow = np.array([28 + delta, 255, 255])
+
+    lower_purple_two = np.array([146 - delta, 0, 0])
+    upper_purple_two = np.array([146 + delta, 255, 255])
+
+    ####################################
+
+
+    # Threshold the HSV image to get only blue colors
+    # Threshold the HSV image to get only green colors
+    mask_green = cv.inRange(hsv, lower_green, upper_green)
+    # Threshold for blue
+    mask_blue = cv.inRange(hsv, lower_blue, upper_blue)
+    mask_pink = cv.inRange(hsv, lower_pink, upper_pink)
+    mask_purple = cv.inRange(hsv, lower_purple, upper_purple)
+    mask_yellow = cv.inRange(hsv, lower_yellow, upper_yellow)
 
-'''
-green = (94, 61, 89)
-blue = (196, 90, 90)
-purple = (259, 36, 100)
-pink = (332, 37, 100)
-'''
-red = (360, 72, 47)
-orange = (18, 71, 64)
-purple_two = (318, 71, 43)
-yellow = (50, 64, 64)
-my_vals = [red, orange, purple_two, yellow]
-# Bitwise-AND mask and original image
-res = cv.bitwise_and(image, image, mask=(maskMaker(my_vals, 10, 50)))
-print(image.shape)
-cv.imwrite("original.jpg", image)
-cv.imwrite("mask.jpg", mask_blue)
-cv.imwrite("res.jpg", res)
-'''
-cv.imshow('Display Window', image)
-cv.waitKey(0)
-cv.imshow('mask', mask)
-cv.waitKey(0)
-cv.imshow('res', res)
-cv.waitKey(0)
-'''
-
-
-############################
+    '''
+    green = (94, 61, 89)
+    blue = (196, 90, 90)
+    purple = (259, 36, 100)
+    pink = (332, 37, 100)
+    '''
+    red = (360, 72, 47)
+    orange = (18, 71, 64)
+    purple_two = (318, 71, 43)
+    yellow = (50, 64, 64)
+    my_vals = [red, orange, purple_two, yellow]
+    # Bitwise-AND mask and original image
+    res = cv.bitwise_and(image, image, mask=(maskMaker(hsv, my_vals, 10, 50)))
+    print(image.shape)
+    cv.imwrite("original.jpg", image)
+    cv.imwrite("mask.jpg", mask_blue)
+    cv.imwrite("res.jpg", res)
+    '''
+    cv.imshow('Display Window', image)
+    cv.waitKey(0)
+    cv.imshow('mask', mask)
+    cv.waitKey(0)
+    cv.imshow('res', res)
+    cv.waitKey(0)
+    '''
 
 
+    ############################
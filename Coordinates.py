@@ -3,57 +3,180 @@ import numpy as np
 import cv2 as cv
 import ar_markers as ar
 
+import scan
 
-def getPaperCoordinates(coordinates, markers):
-    horizontalDist = 400
-    verticalDist = 600
+# marker id -> paper coordinates of the marker's center
+default_marker_corners = {2226: (0, 0),      # top left
+                          2265: (400, 0),    # top right
+                          2421: (400, 600),  # bottom right
+                          2023: (0, 600)}    # bottom left
 
+
+def marker_homography(centers, marker_corners=None):
+    """
+    Projective mapping from image to paper coordinates fitted to the marker centers
+    :param centers: dict of marker id -> (x, y) center in the image
+    :param marker_corners: dict of marker id -> (x, y) paper coordinates of its center, defaults to
+    default_marker_corners
+    :return: 3x3 homography, or None if fewer than 4 registered markers were found
+    """
+    marker_corners = marker_corners if marker_corners is not None else default_marker_corners
+    ids = [marker_id for marker_id in marker_corners if marker_id in centers]
+    if len(ids) < 4:
+        return None
+    image_points = np.array([centers[marker_id] for marker_id in ids], dtype=np.float32)
+    paper_points = np.array([marker_corners[marker_id] for marker_id in ids], dtype=np.float32)
+    if len(ids) == 4:
+        return cv.getPerspectiveTransform(image_points, paper_points)
+    homography, _ = cv.findHomography(image_points, paper_points)
+    return homography
+
+
+def getPaperCoordinates(coordinates, markers, marker_corners=None):
+    """
+    :param coordinates: (x, y) point in the image
+    :param markers: markers found by ar.detect_markers
+    :param marker_corners: dict of marker id -> (x, y) paper coordinates of its center, defaults to
+    default_marker_corners
+    :return: (x, y) integer paper coordinates of the point
+    """
+    homography = marker_homography({marker.id: marker.center for marker in markers}, marker_corners)
+    if homography is None:
+        raise Exception('Not all corner markers were found')
+    point = cv.perspectiveTransform(np.array([[coordinates]], dtype=np.float64), homography)[0, 0]
+    return (int(point[0]), int(point[1]))
+
+
+class MarkerLocalizer:
+    """
+    Finds the page's corner markers in every frame of a video. Markers are searched for around where they were last
+    seen, and the whole frame is only searched when one of them is missing there, at most every retry_interval frames.
+    While markers are missing the homography is fitted to the ones found, or the last one is kept if too few are left.
+    """
+    def __init__(self, marker_corners=None, roi_margin=1.0, full_search_interval=0, retry_interval=30):
+        """
+        :param marker_corners: dict of marker id -> (x, y) paper coordinates of its center, defaults to
+        default_marker_corners
+        :param roi_margin: the region searched around a marker is its last bounding box grown by this many times its
+        size on every side
+        :param full_search_interval: if above 0, the whole frame is searched at least every this many frames
+        :param retry_interval: frames to wait after a full search before searching the whole frame again for missing
+        markers, e.g. a marker covered by a hand
+        """
+        self.marker_corners = dict(marker_corners if marker_corners is not None else default_marker_corners)
+        self.roi_margin = roi_margin
+        self.full_search_interval = full_search_interval
+        self.retry_interval = retry_interval
+        # marker id -> (x, y, w, h) bounding box in the last frame it was found in
+        self.boxes = {}
+        self.centers = {}
+        self.homography = None
+        # None until the first full search
+        self.frames_since_full_search = None
+        self.full_searches = 0
+
+    def _detect(self, image, offset=(0, 0)):
+        """
+        :return: dict of marker id -> (center, bounding box) of the registered markers in image, in the coordinates of
+        the frame image was cropped from
+        """
+        found = {}
+        for marker in ar.detect_markers(image):
+            if marker.id not in self.marker_corners:
+                continue
+            x, y, w, h = cv.boundingRect(np.asarray(marker.contours, dtype=np.int32).reshape(-1, 2))
+            found[marker.id] = ((marker.center[0] + offset[0], marker.center[1] + offset[1]),
+                                (x + offset[0], y + offset[1], w, h))
+        return found
+
+    def _search_rois(self, frame):
+        """
+        :return: dict of marker id -> (center, bounding box) of the markers found near their last position
+        """
+        found = {}
+        height, width = frame.shape[:2]
+        for marker_id, (x, y, w, h) in self.boxes.items():
+            x0 = max(int(x - self.roi_margin * w), 0)
+            y0 = max(int(y - self.roi_margin * h), 0)
+            x1 = min(int(x + w + self.roi_margin * w) + 1, width)
+            y1 = min(int(y + h + self.roi_margin * h) + 1, height)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            roi_found = self._detect(np.ascontiguousarray(frame[y0:y1, x0:x1]), (x0, y0))
+            if marker_id in roi_found:
+                found[marker_id] = roi_found[marker_id]
+        return found
+
+    def locate(self, frame):
+        """
+        Finds the registered markers in a new frame
+        :param frame: BGR frame
+        :return: dict of marker id -> (x, y) center of every registered marker found
+        """
+        since = self.frames_since_full_search
+        if since is None or (self.full_search_interval > 0 and since >= self.full_search_interval):
+            found, search_all = {}, True
+        else:
+            found = self._search_rois(frame)
+            search_all = len(found) < len(self.marker_corners) and since >= self.retry_interval
+        if search_all:
+            found.update(self._detect(frame))
+            self.full_searches += 1
+            self.frames_since_full_search = 0
+        else:
+            self.frames_since_full_search += 1
+
+        # markers not found keep their last box, so they are searched for there again
+        for marker_id, (center, box) in found.items():
+            self.boxes[marker_id] = box
+        self.centers = {marker_id: center for marker_id, (center, box) in found.items()}
+        return self.centers
+
+    def update(self, frame):
+        """
+        Finds the markers in a new frame and fits the image to paper homography to them
+        :param frame: BGR frame
+        :return: 3x3 homography from image to paper coordinates, the last one found if too few markers were found
+        """
+        homography = marker_homography(self.locate(frame), self.marker_corners)
+        if homography is not None:
+            self.homography = homography
+        return self.homography
+
+    def paper_size(self):
+        """
+        :return: (width, height) spanned by the marker centers, in paper coordinates
+        """
+        corners = np.array(list(self.marker_corners.values()), dtype=np.float64)
+        return tuple(corners.max(axis=0) - corners.min(axis=0))
+
+    def transform_metadata(self, desired_dimensions):
+        """
+        :param desired_dimensions: size the marker centers span on the page, e.g. in inches
+        :return: scan.TransformMetadata of the last homography found, for scan.transform_points, or None
+        """
+        if self.homography is None:
+            return None
+        return scan.TransformMetadata(self.homography, self.paper_size(), desired_dimensions)
+
+
+if __name__ == '__main__':
+    test_image = cv.imread("images/Scanned_Collin.jpg")
+
+    markers = ar.detect_markers(test_image)
+    print(test_image.shape)
+    print(markers)
     for marker in markers:
-        if marker.id == 2226:
-            top_left = marker.center
-        if marker.id == 2265:
-            top_right = marker.center
-        if marker.id == 2023:
-            bottom_left = marker.center
-        if marker.id == 2421:
-            bottom_right = marker.center
-
-    print(top_left)
-    print(top_right)
-    print(bottom_left)
-    print(bottom_right)
-    a = top_right[0] - top_left[0]
-    b = bottom_right[0] - bottom_left[0]
-    c = bottom_left[1] - top_left[1]
-    d = bottom_right[1] - top_right[1]
-    print(a, b, c, d)
-    x1 = coordinates[0] / a * horizontalDist
-    x2 = coordinates[0] / b * horizontalDist
-    y1 = coordinates[1] / c * verticalDist
-    y2 = coordinates[1] / d * verticalDist
-    print(x1, x2, y1, y2)
-
-    return (int(np.mean([x1, x2])), int(np.mean([y1, y2])))
-
-
-test_image = cv.imread("images/Scanned_Collin.jpg")
-
-
-markers = ar.detect_markers(test_image)
-print(test_image.shape)
-print(markers)
-for marker in markers:
-    marker.highlite_marker(test_image)
-
-print()
-test_point = (300, 400)
-cv.circle(test_image, test_point, 10, (255, 0, 0))
-
-point = getPaperCoordinates(test_point, markers)
-print(point)
-cv.circle(test_image, point, 10, (0, 255, 0))
-
-cv.imshow('test_image', test_image)
-cv.waitKey(0)
-cv.destroyAllWindows()
+        marker.highlite_marker(test_image)
+
+    print()
+    test_point = (300, 400)
+    cv.circle(test_image, test_point, 10, (255, 0, 0))
+
+    point = getPaperCoordinates(test_point, markers)
+    print(point)
+    cv.circle(test_image, point, 10, (0, 255, 0))
 
+    cv.imshow('test_image', test_image)
+    cv.waitKey(0)
+    cv.destroyAllWindows()
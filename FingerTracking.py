@@ -0,0 +1,210 @@
+import time
+
+import cv2
+import numpy as np
+
+
+class MultiFingerTracker:
+    """
+    Stand-in for cv2.MultiTracker that keeps one OpenCV tracker per finger, so each finger can be timed on its own
+    """
+    def __init__(self, profiler=None):
+        """
+        :param profiler: TrackingStats.StageProfiler each finger's update time is recorded in, None to not time
+        """
+        self.trackers = []
+        self.boxes = []
+        self.profiler = profiler
+        self.stage_names = []
+        self.frame_num = 0
+
+    def add(self, tracker, frame, bbox):
+        """
+        Starts tracking one more finger
+        :param tracker: OpenCV tracker instance, e.g. from VideoTracker.create_tracker_by_name
+        :param frame: frame the box was chosen on
+        :param bbox: (x, y, w, h) box of the finger
+        :return: True
+        """
+        # newer OpenCV trackers only take integer rectangles
+        tracker.init(frame, tuple(int(round(v)) for v in bbox))
+        self.trackers.append(tracker)
+        self.boxes.append(tuple(float(v) for v in bbox))
+        self.stage_names.append('track_finger{}'.format(len(self.trackers)))
+        return True
+
+    def update(self, frame):
+        """
+        Updates every finger's tracker on a new frame. A finger whose tracker fails keeps its last box.
+        :param frame: next frame
+        :return: True if every tracker succeeded, (N, 4) float64 array of boxes
+        """
+        success = True
+        for i, tracker in enumerate(self.trackers):
+            start = time.perf_counter()
+            ok, box = tracker.update(frame)
+            if self.profiler is not None:
+                self.profiler.record(self.stage_names[i], self.frame_num, time.perf_counter() - start)
+            if ok:
+                self.boxes[i] = tuple(box)
+            else:
+                success = False
+        self.frame_num += 1
+        return success, np.array(self.boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def box_patch(frame, box):
+    """
+    :param frame: frame the box is on
+    :param box: (x, y, w, h) box
+    :return: grayscale pixels under the box, clipped to the frame, or None if nothing is left
+    """
+    x, y, w, h = (int(round(v)) for v in box)
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, frame.shape[1]), min(y + h, frame.shape[0])
+    if x1 - x0 < 2 or y1 - y0 < 2:
+        return None
+    patch = frame[y0:y1, x0:x1]
+    if patch.ndim == 3:
+        patch = cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY)
+    return patch
+
+
+def patch_similarity(frame, box, template):
+    """
+    Normalized cross-correlation between the pixels under a box and a template, used as a tracker confidence
+    :param frame: frame the box is on
+    :param box: (x, y, w, h) box
+    :param template: grayscale patch to compare against, e.g. from box_patch
+    :return: correlation in [-1, 1], 0 if the box is outside the frame
+    """
+    patch = box_patch(frame, box)
+    if patch is None or template is None:
+        return 0.0
+    patch = cv2.resize(patch, (template.shape[1], template.shape[0]), interpolation=cv2.INTER_AREA)
+    return float(cv2.matchTemplate(patch, template, cv2.TM_CCOEFF_NORMED)[0, 0])
+
+
+class HybridFingerTracker(MultiFingerTracker):
+    """
+    Tracks each finger with a fast tracker (e.g. KCF) every frame and re-anchors it with an accurate one
+    (e.g. CSRT) every few frames, or as soon as the fast tracker fails or its box stops looking like the finger
+    """
+    anchorReasons = ['interval', 'confidence', 'lost']
+
+    def __init__(self, create_fast_tracker, anchor_interval=15, min_confidence=0.5, profiler=None):
+        """
+        :param create_fast_tracker: callable returning a new fast tracker, a fresh one is started after every anchor
+        :param anchor_interval: re-anchor each finger at least every this many frames
+        :param min_confidence: re-anchor a finger as soon as the correlation between its box and its appearance at
+        the last anchor drops below this
+        After a re-anchor fails the finger waits 1, 2, 4, ... frames, at most anchor_interval, before trying again,
+        so a finger the accurate tracker cannot find does not cost a re-anchor every frame
+        :param profiler: TrackingStats.StageProfiler each finger's update time is recorded in, None to not time
+        """
+        super().__init__(profiler)
+        self.create_fast_tracker = create_fast_tracker
+        self.anchor_interval = anchor_interval
+        self.min_confidence = min_confidence
+        self.fast_trackers = []
+        self.templates = []
+        self.anchor_boxes = []
+        self.since_anchor = []
+        self.anchor_waits = []
+        self.anchor_counts = dict.fromkeys(self.anchorReasons, 0)
+        self.failed_anchors = 0
+
+    def add(self, tracker, frame, bbox):
+        """
+        Starts tracking one more finger
+        :param tracker: accurate tracker used to re-anchor this finger, e.g. VideoTracker.create_tracker_by_name('CSRT')
+        :param frame: frame the box was chosen on
+        :param bbox: (x, y, w, h) box of the finger
+        :return: True
+        """
+        super().add(tracker, frame, bbox)
+        self.fast_trackers.append(None)
+        self.templates.append(None)
+        self.anchor_boxes.append(self.boxes[-1])
+        self.since_anchor.append(0)
+        self.anchor_waits.append(0)
+        self._restart_fast(len(self.trackers) - 1, frame, self.boxes[-1])
+        return True
+
+    def _restart_fast(self, i, frame, box):
+        fast_tracker = self.create_fast_tracker()
+        fast_tracker.init(frame, tuple(int(round(v)) for v in box))
+        self.fast_trackers[i] = fast_tracker
+        self.templates[i] = box_patch(frame, box)
+        self.since_anchor[i] = 0
+        self.anchor_waits[i] = 0
+
+    def _anchor(self, i, frame, estimate):
+        """
+        Updates a finger's accurate tracker. It has not seen the frames since its last anchor and only searches
+        around where it last saw the finger, so the frame is shifted to put the fast tracker's estimate there.
+        :return: success, (x, y, w, h) box in frame pixels
+        """
+        dx = int(round(self.anchor_boxes[i][0] - estimate[0]))
+        dy = int(round(self.anchor_boxes[i][1] - estimate[1]))
+        if dx != 0 or dy != 0:
+            shift = np.float32([[1, 0, dx], [0, 1, dy]])
+            frame = cv2.warpAffine(frame, shift, (frame.shape[1], frame.shape[0]), borderMode=cv2.BORDER_REPLICATE)
+        ok, box = self.trackers[i].update(frame)
+        if ok:
+            # the tracker's own notion of where the finger is, in the shifted frame
+            self.anchor_boxes[i] = tuple(box)
+        return ok, (box[0] - dx, box[1] - dy, box[2], box[3])
+
+    def update(self, frame):
+        """
+        Updates every finger's fast tracker on a new frame, re-anchoring the fingers that are due. A finger whose
+        trackers both fail keeps its last box.
+        :param frame: next frame
+        :return: True if every finger was tracked, (N, 4) float64 array of boxes
+        """
+        success = True
+        for i, fast_tracker in enumerate(self.fast_trackers):
+            start = time.perf_counter()
+            ok, box = fast_tracker.update(frame)
+            self.since_anchor[i] += 1
+
+            if not ok:
+                reason = 'lost'
+            elif patch_similarity(frame, box, self.templates[i]) < self.min_confidence:
+                reason = 'confidence'
+            elif self.since_anchor[i] >= self.anchor_interval:
+                reason = 'interval'
+            else:
+                reason = None
+
+            if reason is not None and self.since_anchor[i] >= self.anchor_waits[i]:
+                self.anchor_counts[reason] += 1
+                anchor_ok, anchor_box = self._anchor(i, frame, box if ok else self.boxes[i])
+                if anchor_ok:
+                    box, ok = anchor_box, True
+                    self._restart_fast(i, frame, box)
+                else:
+                    self.failed_anchors += 1
+                    # back off before the next attempt
+                    self.since_anchor[i] = 0
+                    self.anchor_waits[i] = min(max(2 * self.anchor_waits[i], 1), self.anchor_interval)
+
+            if ok:
+                self.boxes[i] = tuple(box)
+            else:
+                success = False
+            if self.profiler is not None:
+                self.profiler.record(self.stage_names[i], self.frame_num, time.perf_counter() - start)
+        self.frame_num += 1
+        return success, np.array(self.boxes, dtype=np.float64).reshape(-1, 4)
+
+    def anchor_summary(self):
+        """
+        :return: dict with the number of re-anchors for each reason, failed re-anchors, and the fraction of finger
+        updates that re-anchored
+        """
+        n_updates = self.frame_num * len(self.trackers)
+        anchors = sum(self.anchor_counts.values())
+        return dict(self.anchor_counts, total=anchors, failed=self.failed_anchors,
+                    rate=anchors / n_updates if n_updates else 0.0)
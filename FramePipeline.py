@@ -0,0 +1,315 @@
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+def draw_boxes(frame, boxes, colors):
+    """
+    Draws tracked bounding boxes onto a frame
+    :param frame: frame to annotate, modified in place
+    :param boxes: iterable of (x, y, w, h) boxes, boxes with NaN are skipped
+    :param colors: color of each box
+    :return: the annotated frame
+    """
+    for i, newbox in enumerate(boxes):
+        if not np.all(np.isfinite(newbox)):
+            # a finger not found yet
+            continue
+        p1 = (int(newbox[0]), int(newbox[1]))
+        p2 = (int(newbox[0] + newbox[2]), int(newbox[1] + newbox[3]))
+        cv2.rectangle(frame, p1, p2, colors[i], 2, 1)
+    return frame
+
+
+class TrackingGeometry:
+    """
+    Maps between full resolution frames and the cropped, downscaled frames the tracker runs on
+    """
+    def __init__(self, frame_size=(1920, 1080), scale=1.0, roi=None):
+        """
+        :param frame_size: (width, height) of full resolution frames, the pixel space boxes are reported in
+        :param scale: factor frames are downscaled by before tracking, 1.0 tracks at full resolution
+        :param roi: (x, y, w, h) region of the full resolution frame the tracker is given, None for the whole frame
+        """
+        if not 0 < scale <= 1:
+            raise ValueError('Tracking scale must be in (0, 1], got {}'.format(scale))
+        self.frame_size = frame_size
+        self.scale = scale
+        self.roi = roi if roi is not None else (0, 0, frame_size[0], frame_size[1])
+        roi_width, roi_height = self.roi[2], self.roi[3]
+        self.cropped = self.roi != (0, 0, frame_size[0], frame_size[1])
+        self.track_size = (max(1, int(round(roi_width * scale))), max(1, int(round(roi_height * scale))))
+        # exact per axis factors after rounding the tracking size
+        self.box_scale = np.array([self.track_size[0] / roi_width, self.track_size[1] / roi_height] * 2)
+        self.box_offset = np.array([self.roi[0], self.roi[1], 0, 0], dtype=np.float64)
+
+    def prepare(self, frame):
+        """
+        :param frame: full resolution frame
+        :return: the frame the tracker runs on
+        """
+        if self.cropped:
+            x, y, w, h = self.roi
+            frame = frame[y:y + h, x:x + w]
+        if self.track_size == (frame.shape[1], frame.shape[0]):
+            # trackers need contiguous memory, which a crop is not
+            return np.ascontiguousarray(frame)
+        return cv2.resize(frame, self.track_size, interpolation=cv2.INTER_AREA)
+
+    def to_track(self, bboxes):
+        """
+        :param bboxes: (x, y, w, h) boxes in full resolution pixels
+        :return: list of the same boxes as tuples in tracking pixels
+        """
+        bboxes = (np.asarray(bboxes, dtype=np.float64).reshape(-1, 4) - self.box_offset) * self.box_scale
+        return [tuple(bbox) for bbox in bboxes.tolist()]
+
+    def to_frame(self, boxes):
+        """
+        :param boxes: (x, y, w, h) boxes in tracking pixels, as returned by a tracker update
+        :return: (N, 4) float64 array of the boxes in full resolution pixels
+        """
+        return np.asarray(boxes, dtype=np.float64).reshape(-1, 4) / self.box_scale + self.box_offset
+
+
+def read_frames(cap, geometry, profiler=None):
+    """
+    Serially decodes and resizes frames from a video capture
+    :param cap: OpenCV Cap object representing video stream
+    :param geometry: TrackingGeometry giving the full resolution and tracking frame sizes
+    :param profiler: TrackingStats.StageProfiler decode and resize times are recorded in, None to not time
+    :return: generator of (full resolution frame, tracking frame) pairs
+    """
+    frame_num = 0
+    while cap.isOpened():
+        start = time.perf_counter()
+        success, frame = cap.read()
+        if not success:
+            break
+        frame = cv2.resize(frame, geometry.frame_size)
+        decoded = time.perf_counter()
+        track_frame = geometry.prepare(frame)
+        if profiler is not None:
+            profiler.record('decode', frame_num, decoded - start)
+            profiler.record('resize', frame_num, time.perf_counter() - decoded)
+        frame_num += 1
+        yield frame, track_frame
+
+
+class FrameReader(threading.Thread):
+    """
+    Reader stage: decodes and resizes frames ahead of the tracker into a bounded queue
+    """
+    def __init__(self, cap, geometry, queue_size=32, profiler=None):
+        """
+        :param cap: OpenCV Cap object representing video stream
+        :param geometry: TrackingGeometry giving the full resolution and tracking frame sizes
+        :param queue_size: max number of decoded frames waiting for the tracker
+        :param profiler: TrackingStats.StageProfiler decode and resize times are recorded in, None to not time
+        """
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.geometry = geometry
+        self.profiler = profiler
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+        self.error = None
+
+    def run(self):
+        try:
+            for frames in read_frames(self.cap, self.geometry, self.profiler):
+                # block while the queue is full, but give up once the consumer stops
+                while not self.stopped.is_set():
+                    try:
+                        self.frames.put(frames, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if self.stopped.is_set():
+                    break
+        except Exception as err:
+            self.error = err
+        finally:
+            self._put_end()
+
+    def _put_end(self):
+        # the consumer may already be gone, so never block forever on the end marker
+        while True:
+            try:
+                self.frames.put(None, timeout=0.1)
+                return
+            except queue.Full:
+                if self.stopped.is_set():
+                    return
+
+    def __iter__(self):
+        # yields (full resolution frame, tracking frame) pairs like read_frames
+        while True:
+            frames = self.frames.get()
+            if frames is None:
+                break
+            yield frames
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        """
+        Stops decoding and waits for the reader thread to finish
+        """
+        self.stopped.set()
+        self.join()
+
+
+class LatestFrameReader(threading.Thread):
+    """
+    Reader stage for live sources: holds only the newest frame instead of a queue, so a tracker that falls behind
+    skips the frames it missed rather than working through a backlog
+    """
+    def __init__(self, cap, replay_fps=None):
+        """
+        :param cap: OpenCV Cap object of a camera, a stream or, for replay, a video file
+        :param replay_fps: if set, cap is a recording delivered at this frame rate, as a camera would deliver it.
+        Frames whose time has passed while the reader was behind are skipped, as a camera would have dropped them
+        """
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.replay_fps = replay_fps
+        self.condition = threading.Condition()
+        # (index, capture time as time.perf_counter(), frame) of the newest frame
+        self.latest = None
+        self.taken = -1
+        self.captured = 0
+        self.skipped = 0
+        self.ended = False
+        self.stopped = threading.Event()
+        self.error = None
+
+    def run(self):
+        start = time.perf_counter()
+        index = 0
+        try:
+            while not self.stopped.is_set():
+                if self.replay_fps:
+                    # skip ahead to the frame a camera would be showing now
+                    behind = int((time.perf_counter() - start) * self.replay_fps) - index
+                    for i in range(behind):
+                        if not self.cap.grab():
+                            break
+                        index += 1
+                        with self.condition:
+                            self.captured += 1
+                            self.skipped += 1
+                    due = start + index / self.replay_fps
+                    if self.stopped.wait(max(due - time.perf_counter(), 0)):
+                        break
+                success, frame = self.cap.read()
+                if not success:
+                    break
+                captured = due if self.replay_fps else time.perf_counter()
+                with self.condition:
+                    if self.latest is not None and self.latest[0] > self.taken:
+                        self.skipped += 1
+                    self.latest = (index, captured, frame)
+                    self.captured += 1
+                    self.condition.notify()
+                index += 1
+        except Exception as err:
+            self.error = err
+        finally:
+            with self.condition:
+                self.ended = True
+                self.condition.notify()
+
+    def read(self, timeout=None):
+        """
+        Waits for a frame newer than the last one read
+        :param timeout: seconds to wait, None to wait until there is a frame or the source ends
+        :return: (frame index, capture time as time.perf_counter(), frame) of the newest frame, None if the source
+        ended or the timeout passed
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.ended or (self.latest is not None and self.latest[0] > self.taken),
+                                    timeout)
+            if self.latest is None or self.latest[0] <= self.taken:
+                if self.error is not None:
+                    raise self.error
+                return None
+            self.taken = self.latest[0]
+            return self.latest
+
+    def reset_counts(self):
+        """
+        Forgets the frames captured so far, e.g. those that went by during calibration
+        """
+        with self.condition:
+            # a frame waiting to be read counts as captured now
+            self.captured = int(self.latest is not None and self.latest[0] > self.taken)
+            self.skipped = 0
+
+    def stop(self):
+        """
+        Stops capturing and waits for the reader thread to finish
+        """
+        self.stopped.set()
+        self.join()
+
+
+class FrameWriter(threading.Thread):
+    """
+    Writer stage: annotates tracked frames and encodes them with a cv2.VideoWriter off the tracking thread
+    """
+    def __init__(self, video_out, colors, queue_size=32, profiler=None):
+        """
+        :param video_out: opened cv2.VideoWriter
+        :param colors: color of each bounding box
+        :param queue_size: max number of tracked frames waiting to be encoded
+        :param profiler: TrackingStats.StageProfiler draw and encode times are recorded in, None to not time
+        """
+        super().__init__(daemon=True)
+        self.video_out = video_out
+        self.colors = colors
+        self.profiler = profiler
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.error = None
+
+    def run(self):
+        frame_num = 0
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+            if self.error is not None:
+                # keep draining so the tracking thread never blocks on a dead writer
+                continue
+            frame, boxes = item
+            try:
+                start = time.perf_counter()
+                draw_boxes(frame, boxes, self.colors)
+                drawn = time.perf_counter()
+                self.video_out.write(frame)
+                if self.profiler is not None:
+                    self.profiler.record('draw', frame_num, drawn - start)
+                    self.profiler.record('encode', frame_num, time.perf_counter() - drawn)
+            except Exception as err:
+                self.error = err
+            frame_num += 1
+
+    def write(self, frame, boxes):
+        """
+        Queues a frame and its tracked boxes for annotation and encoding
+        :param frame: full resolution frame the boxes were tracked on, must not be modified afterwards
+        :param boxes: tracked (x, y, w, h) boxes in full resolution pixels
+        """
+        self.frames.put((frame, boxes))
+
+    def close(self):
+        """
+        Flushes all queued frames and waits for the writer thread to finish
+        """
+        self.frames.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,209 @@
+# USAGE
+# python LiveTracker.py --source 0 --page ./braille_files/page.brf --budget 0.1
+# python LiveTracker.py --source ./test_images/test_1.mp4 --replay --page ./braille_files/page.brf --headless
+
+import argparse
+import json
+import time
+from random import randint
+
+import cv2
+import numpy as np
+
+import scan
+import CellRaster
+import FramePipeline
+import TrackingStats
+import VideoTracker
+
+
+def open_source(source):
+    """
+    :param source: camera index, as an int or a string of digits, or a stream URL or video path
+    :return: OpenCV Cap object of the source
+    """
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise Exception('Failed to open video source {}'.format(source))
+    return cap
+
+
+class LiveTracker(VideoTracker.VideoTracker):
+    """
+    Tracks fingers on a camera or stream as frames arrive. The tracker always works on the newest frame: frames that
+    arrive while it is busy are skipped, and a frame already older than the latency budget when the tracker gets to it
+    is dropped in favour of the next one. Results are written as in VideoTracker, with frames numbered as the source
+    delivered them so dropped frames show up as gaps.
+    """
+    def __init__(self, source, page_path, tracking=None, output=None, replay=False, latency_budget=0.1, bboxes=None,
+                 auto_calibrate=True, black_background=True, cell_raster=False, show_frame=False, headless=False,
+                 max_seconds=None, report_path=None):
+        """
+        init live tracker
+        :param source: camera index, stream URL, or path of a recording when replay is set
+        :param page_path: Path of input Braille page being read
+        :param tracking: VideoTracker.TrackingSettings, defaults if None. HYBRID and COLOR keep up with live frame rates
+        best, crop_to_page and pipelined do not apply
+        :param output: VideoTracker.OutputSettings, defaults with results flushed every 30 frames if None, so they can
+        be followed during the session. No video is written, and the stages of the loop are not profiled
+        :param replay: If True, source is a recording played back at its own frame rate, standing in for a camera
+        :param latency_budget: seconds a frame may take from capture to its results being written. Frames already
+        older than this when the tracker gets to them are dropped, unless the frame before was dropped too, so a
+        source that is always late still gets every other frame tracked
+        :param bboxes: bounding boxes of the fingers on the first frame, in 1920x1080 pixels. Defaults to the
+        predefined boxes with auto_calibrate, or boxes drawn on the first frame
+        :param auto_calibrate: If True and bboxes is not given, uses the predefined bounding boxes
+        :param black_background: If True, page calibration casts the background to black before finding the page
+        :param cell_raster: If True, letters are looked up in a raster of the cell under every camera pixel
+        :param show_frame: If True, the tracked boxes are shown on the newest frame, quit with ESC
+        :param headless: If True, makes no OpenCV HighGUI calls, the page must then be found automatically
+        :param max_seconds: stop after this many seconds, None to run until the source ends or ESC / Ctrl+C
+        :param report_path: If set, the latency and drop summary is written here as JSON
+        """
+        tracking = tracking if tracking is not None else VideoTracker.TrackingSettings()
+        output = output if output is not None else VideoTracker.OutputSettings(flush_every=30)
+        if latency_budget <= 0:
+            raise ValueError('The latency budget must be positive, got {}'.format(latency_budget))
+        self.setup_tracking(page_path, tracking, output, show_frame, headless)
+        self.latency_budget = latency_budget
+        self.max_seconds = max_seconds
+
+        self.cap = open_source(source)
+        self.fps = int(self.cap.get(cv2.CAP_PROP_FPS))
+        self.reader = FramePipeline.LatestFrameReader(self.cap, self.cap.get(cv2.CAP_PROP_FPS) if replay else None)
+        self.reader.start()
+        try:
+            # calibrate on the first frame
+            frame = self.read_frame()
+            m, im_dims = scan.transform_image(frame, black_background=black_background, show=not headless)
+            if m is None:
+                if headless:
+                    raise Exception('Failed to find the page automatically')
+                m, im_dims = scan.transform_image(frame, automatic=False)
+            self.transformation_metadata = scan.TransformMetadata(m, im_dims, (11.5625, 11))
+            self.tracking_geometry = FramePipeline.TrackingGeometry((1920, 1080), tracking.tracking_scale)
+            self.cell_raster = None
+            if cell_raster:
+                self.cell_raster = CellRaster.CellRaster(self.transformation_metadata, (1920, 1080))
+
+            if self.marker_detector is not None:
+                bboxes, colors = [], self.marker_detector.draw_colors()
+            elif bboxes is not None:
+                colors = [(randint(0, 255), randint(0, 255), randint(0, 255)) for bbox in bboxes]
+            elif auto_calibrate:
+                bboxes, frame, colors = self.automatic_calibration()
+            elif headless:
+                raise Exception('Manual calibration needs a display, give bboxes or use auto_calibrate')
+            else:
+                bboxes, frame, colors = self.manual_calibration()
+            multi_tracker = self.init_multitracker(bboxes, tracking.tracker_type, frame)
+
+            self.report = self.process_live(multi_tracker, colors, show_frame)
+        finally:
+            self.reader.stop()
+            self.cap.release()
+
+        print('Processed {0} of {1} frames in {2:.1f}s ({3:.1f} fps), {4:.1%} dropped ({5} skipped while busy, '
+              '{6} stale)'.format(self.report['frames_processed'], self.report['frames_captured'],
+                                  self.report['seconds'], self.report['fps'], self.report['drop_rate'],
+                                  self.report['frames_skipped'], self.report['frames_stale']))
+        print('Latency mean {0:.1f} ms, p50 {1:.1f} ms, p99 {2:.1f} ms, {3} frames over the {4:.0f} ms budget'.format(
+            self.report['mean_ms'], self.report['p50_ms'], self.report['p99_ms'], self.report['over_budget'],
+            self.report['budget_ms']))
+        if report_path is not None:
+            with open(report_path, 'w') as fh:
+                json.dump(dict(self.report, tracker_type=tracking.tracker_type,
+                               tracking_scale=tracking.tracking_scale, replay=replay), fh, indent=2)
+
+    def read_frame(self, second=None):
+        """
+        Reads the newest frame of the source, used for calibration
+        :param second: ignored, a live source can only give its newest frame
+        :return: the frame, resized to 1920x1080
+        """
+        item = self.reader.read()
+        if item is None:
+            raise Exception('Failed to read video')
+        return cv2.resize(item[2], (1920, 1080))
+
+    def process_live(self, multi_tracker, colors, show_frame=False):
+        """
+        Tracks frames as they arrive until the source ends, max_seconds pass, ESC is pressed or Ctrl+C
+        :param multi_tracker: tracker from init_multitracker
+        :param colors: Colors of each bounding box
+        :param show_frame: If True, the newest tracked frame is displayed
+        :return: latency and drop summary, see TrackingStats.LatencyMonitor.summary
+        """
+        outputs = self.open_outputs()
+        monitor = TrackingStats.LatencyMonitor(self.latency_budget, self.progress_interval)
+        # frames that went by during calibration do not count as dropped
+        self.reader.reset_counts()
+        start = time.perf_counter()
+        dropped_last = False
+        try:
+            while self.max_seconds is None or time.perf_counter() - start < self.max_seconds:
+                item = self.reader.read(timeout=1.0)
+                if item is None:
+                    if self.reader.ended:
+                        break
+                    continue
+                frame_num, captured, frame = item
+                if time.perf_counter() - captured > self.latency_budget and not dropped_last:
+                    monitor.drop_stale()
+                    dropped_last = True
+                    continue
+                dropped_last = False
+
+                # straight from the source size to the tracking size, boxes still come back in 1920x1080 pixels
+                success, track_boxes = multi_tracker.update(self.tracking_geometry.prepare(frame))
+                boxes = self.tracking_geometry.to_frame(track_boxes)
+                pixel_centers = boxes[:, :2] + boxes[:, 2:] / 2
+                page_centers = scan.transform_points(pixel_centers, self.transformation_metadata)
+                if self.cell_raster is not None:
+                    codes, rows, columns = self.cell_raster.positions2Chars(self.braille_page, pixel_centers[:, 0],
+                                                                            pixel_centers[:, 1])
+                else:
+                    codes, rows, columns = self.braille_page.positions2Chars(page_centers[:, 0], page_centers[:, 1])
+                for output in outputs:
+                    output.write_frame(frame_num, page_centers[:, 0], page_centers[:, 1], codes, rows, columns)
+                monitor.record(time.perf_counter() - captured)
+                self.frames_processed += 1
+                monitor.update(self.reader.captured, self.reader.skipped)
+
+                # show frame, quit on ESC button
+                if show_frame:
+                    source_scale = np.array([frame.shape[1] / 1920, frame.shape[0] / 1080] * 2)
+                    cv2.imshow('MultiTracker', FramePipeline.draw_boxes(frame, boxes * source_scale, colors))
+                    if cv2.waitKey(1) & 0xFF == 27:
+                        break
+        except KeyboardInterrupt:
+            print('Stopped by user')
+        finally:
+            for output in outputs:
+                output.close()
+        return monitor.summary(self.reader.captured, self.reader.skipped)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Track fingers reading Braille on a live camera or stream')
+    ap.add_argument('-s', '--source', required=True, help='camera index, stream URL, or recording with --replay')
+    ap.add_argument('-p', '--page', required=True, help='Braille page being read')
+    ap.add_argument('--replay', action='store_true', help='play the source recording back at its own frame rate')
+    ap.add_argument('-b', '--budget', type=float, default=0.1, help='latency budget per frame in seconds')
+    ap.add_argument('-t', '--tracker', default='HYBRID', help='tracker type, e.g. HYBRID, COLOR or CSRT')
+    ap.add_argument('--scale', type=float, default=0.5, help='factor frames are downscaled by before tracking')
+    ap.add_argument('-o', '--output', default='BrailleOutput.txt', help='tab delimited output file')
+    ap.add_argument('--dwell', default=None, help='also write dwell events to this file')
+    ap.add_argument('--report', default=None, help='write the latency summary to this JSON file')
+    ap.add_argument('--seconds', type=float, default=None, help='stop after this many seconds')
+    ap.add_argument('--headless', action='store_true', help='no windows, the page must be found automatically')
+    args = vars(ap.parse_args())
+
+    LiveTracker(args['source'], args['page'],
+                VideoTracker.TrackingSettings(tracker_type=args['tracker'], tracking_scale=args['scale']),
+                VideoTracker.OutputSettings(data_output_path=args['output'], dwell_output_path=args['dwell'],
+                                            flush_every=30),
+                replay=args['replay'], latency_budget=args['budget'], show_frame=not args['headless'],
+                headless=args['headless'], max_seconds=args['seconds'], report_path=args['report'])
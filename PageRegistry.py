@@ -0,0 +1,142 @@
+import json
+import os
+from collections import OrderedDict
+
+import cv2
+
+import BraillePage
+
+
+class PageRegistry:
+    """
+    Maps the payloads of the QR codes printed on Braille sheets to the BRF file and page they belong to, keeping the
+    most recently used pages parsed in memory
+    """
+    def __init__(self, pages=None, cache_size=4):
+        """
+        :param pages: dict of QR payload -> (path of .brf file, 0-based page number)
+        :param cache_size: max number of parsed pages kept in memory
+        """
+        self.pages = {}
+        for payload, (brf_path, page_number) in (pages or {}).items():
+            self.register(payload, brf_path, page_number)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        # .brf path -> BraillePage.BrfBook, so each file is only scanned for its pages once
+        self.books = {}
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, registry_path, cache_size=4):
+        """
+        Reads a registry from a JSON file of the form {"<QR payload>": {"brf": "<path>", "page": <page number>}}.
+        Relative BRF paths are relative to the registry file.
+        :param registry_path: path of the JSON file
+        :param cache_size: max number of parsed pages kept in memory
+        :return: PageRegistry
+        """
+        with open(registry_path, 'r') as fh:
+            entries = json.load(fh)
+        base_dir = os.path.dirname(os.path.abspath(registry_path))
+        return cls({payload: (os.path.join(base_dir, entry['brf']), entry.get('page', 0))
+                    for payload, entry in entries.items()}, cache_size)
+
+    def register(self, payload, brf_path, page_number=0):
+        """
+        :param payload: text encoded in the page's QR code
+        :param brf_path: path of the .brf file the page is in
+        :param page_number: 0-based page of the file
+        """
+        self.pages[payload] = (brf_path, page_number)
+
+    def __contains__(self, payload):
+        return payload in self.pages
+
+    def page(self, payload):
+        """
+        :param payload: text encoded in a page's QR code
+        :return: the parsed BraillePage.BraillePage, from the cache if it was used recently
+        """
+        key = self.pages[payload]
+        page = self.cache.get(key)
+        if page is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return page
+
+        self.misses += 1
+        brf_path, page_number = key
+        book = self.books.get(brf_path)
+        if book is None:
+            book = self.books[brf_path] = BraillePage.BrfBook(brf_path, BraillePage.BraillePage.numRows,
+                                                               BraillePage.BraillePage.numColumns)
+        page = BraillePage.BraillePage(brf_path, page_number, book)
+        self.cache[key] = page
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return page
+
+    def close(self):
+        """
+        Closes the BRF files opened so far. Pages already parsed stay usable, and files are opened again if pages not
+        in the cache are asked for after closing.
+        """
+        for book in self.books.values():
+            book.close()
+        self.books = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PageDetector:
+    """
+    Decodes the QR code on the sheet every few frames to notice when the reader moves on to another page
+    """
+    def __init__(self, registry, interval=30):
+        """
+        :param registry: PageRegistry the QR payloads are looked up in
+        :param interval: frames between QR decodes
+        """
+        self.registry = registry
+        self.interval = interval
+        self.decoder = cv2.QRCodeDetector()
+        self.payload = None
+        self.frames_to_decode = 0
+        self.unknown_payloads = set()
+
+    def decode(self, frame):
+        """
+        :param frame: BGR frame
+        :return: payload of the registered QR code in the frame, or None if there is none
+        """
+        payload, points, _ = self.decoder.detectAndDecode(frame)
+        if not payload:
+            return None
+        if payload not in self.registry:
+            if payload not in self.unknown_payloads:
+                print('QR code {} is not in the page registry'.format(payload))
+                self.unknown_payloads.add(payload)
+            return None
+        return payload
+
+    def update(self, frame):
+        """
+        Decodes the QR code if it is due on this frame
+        :param frame: BGR frame
+        :return: the new BraillePage.BraillePage if the page changed on this frame, otherwise None
+        """
+        self.frames_to_decode -= 1
+        if self.frames_to_decode > 0:
+            return None
+        self.frames_to_decode = self.interval
+
+        payload = self.decode(frame)
+        if payload is None or payload == self.payload:
+            return None
+        self.payload = payload
+        return self.registry.page(payload)
@@ -0,0 +1,142 @@
+import cv2
+import numpy as np
+
+import scan
+
+
+class PageTracker:
+    """
+    Follows the page from frame to frame so the page transform stays right when the page or camera moves. Features on
+    the page are tracked with pyramidal Lucas-Kanade optical flow and the homography from the calibration frame to the
+    current frame updates the transform. The full contour search of scan.transform_image only runs again when the
+    tracked estimate can no longer be trusted.
+    """
+    def __init__(self, transform_metadata, frame, scale=0.5, max_features=200, min_features=30, max_error=2.0,
+                 max_shift=40.0, retry_interval=30, black_background=True):
+        """
+        :param transform_metadata: scan.TransformMetadata of the page in frame
+        :param frame: frame the transform is valid for
+        :param scale: factor frames are downscaled by before tracking features
+        :param max_features: number of page features tracked
+        :param min_features: the page is searched for again when fewer than this many features agree on the
+        homography. Features are topped up whenever fewer than half of max_features survive
+        :param max_error: mean reprojection error, in full resolution pixels, of the homography above which the page
+        is searched for again
+        :param max_shift: the page is searched for again once a corner has moved this many full resolution pixels
+        since the last full search, to catch slow drift
+        :param retry_interval: frames to wait after a full search that did not find the page before searching again
+        :param black_background: passed to scan.transform_image for full searches
+        """
+        self.scale = scale
+        self.max_features = max_features
+        self.min_features = min_features
+        self.max_error = max_error
+        self.max_shift = max_shift
+        self.retry_interval = retry_interval
+        self.black_background = black_background
+        self.frames_to_retry = 0
+        self.lk_params = dict(winSize=(21, 21), maxLevel=3,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01))
+        self.recalibrations = 0
+        self.failed_recalibrations = 0
+        self.reset(transform_metadata, frame)
+
+    def reset(self, transform_metadata, frame):
+        """
+        Makes frame the new reference the page is tracked from
+        :param transform_metadata: page transform valid for frame
+        :param frame: full resolution frame
+        """
+        self.transform_metadata = transform_metadata
+        self.reference_matrix = np.asarray(transform_metadata.transformation_matrix, dtype=np.float64)
+        self.reference_corners = scan.page_corners(transform_metadata)
+        # homography from the reference frame to the current one
+        self.motion = np.eye(3)
+        self.prev_gray = self._gray(frame)
+        self.reference_points = np.empty((0, 1, 2), dtype=np.float32)
+        self.points = np.empty((0, 1, 2), dtype=np.float32)
+        self._add_features()
+
+    def _gray(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        if self.scale != 1:
+            gray = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return gray
+
+    def _add_features(self):
+        """
+        Tops up the tracked features with new ones on the page in the current frame, away from the existing ones
+        """
+        needed = self.max_features - len(self.points)
+        if needed <= 0:
+            return
+        corners = cv2.perspectiveTransform(self.reference_corners.reshape(-1, 1, 2), self.motion) * self.scale
+        mask = np.zeros(self.prev_gray.shape, dtype=np.uint8)
+        cv2.fillConvexPoly(mask, np.round(corners).astype(np.int32).reshape(-1, 2), 255)
+        for x, y in self.points.reshape(-1, 2):
+            cv2.circle(mask, (int(x), int(y)), 10, 0, -1)
+
+        new_points = cv2.goodFeaturesToTrack(self.prev_gray, needed, 0.01, 10, mask=mask)
+        if new_points is None:
+            return
+        new_points = new_points.astype(np.float32)
+        # where the new features were in the reference frame
+        new_reference = cv2.perspectiveTransform(new_points.astype(np.float64) / self.scale,
+                                                 np.linalg.inv(self.motion)).astype(np.float32)
+        self.points = np.concatenate([self.points, new_points])
+        self.reference_points = np.concatenate([self.reference_points, new_reference])
+
+    def update(self, frame):
+        """
+        Follows the page into a new frame
+        :param frame: next full resolution frame
+        :return: scan.TransformMetadata of the page in this frame
+        """
+        gray = self._gray(frame)
+        if len(self.points) > 0:
+            points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, self.points, None, **self.lk_params)
+            tracked = status.reshape(-1) == 1
+            self.points, self.reference_points = points[tracked], self.reference_points[tracked]
+        self.prev_gray = gray
+
+        lost = True
+        if len(self.points) >= self.min_features:
+            current = self.points.astype(np.float64) / self.scale
+            # fingers moving over the page are outliers
+            motion, inliers = cv2.findHomography(self.reference_points, current, cv2.RANSAC, 3.0)
+            if motion is not None and inliers.sum() >= self.min_features:
+                inliers = inliers.reshape(-1) == 1
+                projected = cv2.perspectiveTransform(self.reference_points[inliers].astype(np.float64), motion)
+                error = np.linalg.norm(projected - current[inliers], axis=2).mean()
+                self.points, self.reference_points = self.points[inliers], self.reference_points[inliers]
+                self.motion = motion
+                lost = error > self.max_error
+
+        corners = cv2.perspectiveTransform(self.reference_corners.reshape(-1, 1, 2), self.motion).reshape(4, 2)
+        drifted = np.linalg.norm(corners - self.reference_corners, axis=1).max() > self.max_shift
+        self.frames_to_retry -= 1
+        if (lost or drifted) and self.frames_to_retry <= 0:
+            if self._recalibrate(frame):
+                return self.transform_metadata
+            self.frames_to_retry = self.retry_interval
+
+        if len(self.points) < self.max_features // 2:
+            self._add_features()
+        # current frame -> reference frame -> page
+        self.transform_metadata = scan.TransformMetadata(self.reference_matrix @ np.linalg.inv(self.motion),
+                                                         self.transform_metadata.im_dims,
+                                                         self.transform_metadata.desired_dimensions)
+        return self.transform_metadata
+
+    def _recalibrate(self, frame):
+        """
+        Searches the frame for the page outline and restarts tracking from it
+        :return: True if the page was found
+        """
+        self.recalibrations += 1
+        m, im_dims = scan.transform_image(frame, black_background=self.black_background, show=False)
+        if m is None:
+            self.failed_recalibrations += 1
+            return False
+        self.reset(scan.TransformMetadata(m, im_dims, self.transform_metadata.desired_dimensions), frame)
+        return True
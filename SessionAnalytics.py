@@ -0,0 +1,435 @@
+# USAGE
+# python SessionAnalytics.py --sessions-dir ./batch_output --fps 30 --output ./study_summary.json
+
+import argparse
+import ast
+import glob
+import json
+import os
+import re
+
+import numpy as np
+
+import BraillePage
+import TrackingOutput
+
+# formats of tracking outputs, in the order they are preferred when a session directory holds several
+sessionFormats = ['dwell', 'npy', 'tsv']
+
+# (char, column, row) letter entries of the tab delimited output
+letter_pattern = re.compile(r"^\((.*), (-?\d+), (-?\d+)\)$")
+
+blank_codes = (0, BraillePage.BraillePage.outOfMarginCode)
+
+
+def event_columns():
+    """
+    :return: list of (name, dtype) of the columns of a dwell event table. Positions are in inches on the page and
+    start/end are frame numbers, end included.
+    """
+    return [('session', np.uint32), ('finger', np.uint8), ('code', np.uint8), ('row', np.int8), ('col', np.int8),
+            ('start', np.uint32), ('end', np.uint32), ('frames', np.uint32), ('x', np.float32), ('y', np.float32)]
+
+
+def empty_events():
+    return {name: np.zeros(0, dtype) for name, dtype in event_columns()}
+
+
+def concat_events(tables):
+    """
+    :param tables: list of event tables
+    :return: one event table with the rows of all of them
+    """
+    tables = [table for table in tables if len(table['start'])]
+    if not tables:
+        return empty_events()
+    return {name: np.concatenate([table[name] for table in tables]).astype(dtype, copy=False)
+            for name, dtype in event_columns()}
+
+
+def select_events(events, mask):
+    """
+    :param events: event table
+    :param mask: boolean array or indices of the rows to keep
+    :return: event table of the selected rows
+    """
+    return {name: column[mask] for name, column in events.items()}
+
+
+def session_format(output_path):
+    """
+    Tells the tracking output formats apart by their header
+    :param output_path: path of a tracking output file
+    :return: 'dwell' for DwellEventWriter files, 'npy' for NpyTrackWriter files, 'tsv' for TsvOutputWriter files, or
+    None for anything else
+    """
+    with open(output_path, 'rb') as fh:
+        head = fh.read(len(TrackingOutput.npy_magic))
+    if head == TrackingOutput.npy_magic:
+        return 'npy'
+    with open(output_path, 'r', errors='replace') as fh:
+        header = fh.readline()
+    if header == TrackingOutput.dwell_header():
+        return 'dwell'
+    if header.startswith('Frame\tX1\tY1'):
+        return 'tsv'
+    return None
+
+
+def find_sessions(sessions_dir):
+    """
+    Finds the tracking output of every session under a directory, e.g. the output directory of BatchTracker. A
+    directory holding outputs in several formats counts as one session, read from its most compact output.
+    :param sessions_dir: root directory searched recursively
+    :return: sorted list of output paths, one per session directory
+    """
+    found = {}
+    for path in sorted(glob.glob(os.path.join(sessions_dir, '**', '*'), recursive=True)):
+        if not path.lower().endswith(('.npy', '.txt', '.tsv')) or not os.path.isfile(path):
+            continue
+        output_format = session_format(path)
+        if output_format is None:
+            continue
+        session_dir = os.path.dirname(path)
+        current = found.get(session_dir)
+        if current is None or sessionFormats.index(output_format) < sessionFormats.index(current[0]):
+            found[session_dir] = (output_format, path)
+    return sorted(path for output_format, path in found.values())
+
+
+def read_tsv_tracks(tsv_path, chunk_frames=10000):
+    """
+    Reads a tab delimited output file a chunk at a time
+    :param tsv_path: path of a file written by TsvOutputWriter
+    :param chunk_frames: number of frames per chunk
+    :return: generator of TrackingOutput.track_dtype record arrays
+    """
+    with open(tsv_path, 'r') as fh:
+        header = fh.readline().rstrip('\n').split('\t')
+        n_fingers = (len(header) - 1) // 3
+        dtype = TrackingOutput.track_dtype(n_fingers)
+        lines = []
+        for line in fh:
+            lines.append(line)
+            if len(lines) == chunk_frames:
+                yield _parse_tsv_lines(lines, dtype, n_fingers)
+                lines = []
+        if lines:
+            yield _parse_tsv_lines(lines, dtype, n_fingers)
+
+
+def _parse_tsv_lines(lines, dtype, n_fingers):
+    records = np.zeros(len(lines), dtype)
+    fields = [line.rstrip('\n').split('\t') for line in lines]
+    records['frame'] = [int(row[0]) for row in fields]
+    positions = np.array([row[1:1 + 2 * n_fingers] for row in fields], dtype=np.float64).reshape(-1, n_fingers, 2)
+    # fingers that were not tracked are written as 0 with a 0 letter
+    tracked = np.array([[letter != '0' for letter in row[1 + 2 * n_fingers:]] for row in fields], dtype=bool)
+    records['x'] = np.where(tracked, positions[:, :, 0], np.nan)
+    records['y'] = np.where(tracked, positions[:, :, 1], np.nan)
+    records['row'] = BraillePage.BraillePage.outOfMargin
+    records['col'] = BraillePage.BraillePage.outOfMargin
+
+    for i, row in enumerate(fields):
+        for finger, letter in enumerate(row[1 + 2 * n_fingers:]):
+            match = letter_pattern.match(letter)
+            if match is None:
+                continue
+            char = ast.literal_eval(match.group(1))
+            records['char'][i, finger] = ord(char) if char else 0
+            records['col'][i, finger] = int(match.group(2))
+            records['row'][i, finger] = int(match.group(3))
+    return records
+
+
+def track_events(tracks, session=0):
+    """
+    Collapses per-frame track records into dwell events, the same events DwellEventWriter writes
+    :param tracks: TrackingOutput.track_dtype records, in frame order
+    :param session: session index stored in the events
+    :return: event table, sorted by finger and start frame
+    """
+    n_frames = len(tracks)
+    n_fingers = tracks.dtype['x'].shape[0]
+    # finger-major order, so each finger's frames are contiguous
+    frame = np.tile(tracks['frame'].astype(np.int64), n_fingers)
+    finger = np.repeat(np.arange(n_fingers, dtype=np.int64), n_frames)
+    x = np.ascontiguousarray(tracks['x'].T).ravel().astype(np.float64)
+    y = np.ascontiguousarray(tracks['y'].T).ravel().astype(np.float64)
+    code = np.ascontiguousarray(tracks['char'].T).ravel()
+    row = np.ascontiguousarray(tracks['row'].T).ravel()
+    col = np.ascontiguousarray(tracks['col'].T).ravel()
+
+    tracked = ~(np.isnan(x) | np.isnan(y))
+    frame, finger, x, y, code, row, col = (a[tracked] for a in (frame, finger, x, y, code, row, col))
+    if len(frame) == 0:
+        return empty_events()
+
+    # an event ends where the finger, its cell or the run of consecutive frames changes
+    new_event = np.ones(len(frame), dtype=bool)
+    new_event[1:] = ((finger[1:] != finger[:-1]) | (code[1:] != code[:-1]) | (row[1:] != row[:-1]) |
+                     (col[1:] != col[:-1]) | (frame[1:] != frame[:-1] + 1))
+    starts = np.flatnonzero(new_event)
+    ends = np.append(starts[1:], len(frame)) - 1
+    frames = ends - starts + 1
+    return {'session': np.full(len(starts), session, np.uint32),
+            'finger': (finger[starts] + 1).astype(np.uint8),
+            'code': code[starts].astype(np.uint8),
+            'row': row[starts].astype(np.int8),
+            'col': col[starts].astype(np.int8),
+            'start': frame[starts].astype(np.uint32),
+            'end': frame[ends].astype(np.uint32),
+            'frames': frames.astype(np.uint32),
+            'x': (np.add.reduceat(x, starts) / frames).astype(np.float32),
+            'y': (np.add.reduceat(y, starts) / frames).astype(np.float32)}
+
+
+def merge_events(events):
+    """
+    Joins events of the same finger on the same cell in consecutive frames, e.g. events split where a session was read
+    in chunks
+    :param events: event table of one session
+    :return: event table, sorted by finger and start frame
+    """
+    order = np.lexsort((events['start'], events['finger']))
+    events = select_events(events, order)
+    n_events = len(events['start'])
+    if n_events < 2:
+        return events
+
+    join = np.zeros(n_events, dtype=bool)
+    join[1:] = ((events['finger'][1:] == events['finger'][:-1]) & (events['code'][1:] == events['code'][:-1]) &
+                (events['row'][1:] == events['row'][:-1]) & (events['col'][1:] == events['col'][:-1]) &
+                (events['start'][1:].astype(np.int64) == events['end'][:-1].astype(np.int64) + 1))
+    if not join.any():
+        return events
+
+    firsts = np.flatnonzero(~join)
+    lasts = np.append(firsts[1:], n_events) - 1
+    frames = np.add.reduceat(events['frames'].astype(np.int64), firsts)
+    merged = select_events(events, firsts)
+    merged['end'] = events['end'][lasts]
+    merged['frames'] = frames.astype(np.uint32)
+    for axis in ('x', 'y'):
+        # mean of the joined events weighted by their length, ignoring events without positions
+        values = events[axis].astype(np.float64)
+        known = ~np.isnan(values)
+        weights = np.where(known, events['frames'], 0)
+        total = np.add.reduceat(np.where(known, values, 0) * weights, firsts)
+        weight = np.add.reduceat(weights, firsts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            merged[axis] = np.where(weight > 0, total / weight, np.nan).astype(np.float32)
+    return merged
+
+
+class SessionAnalytics:
+    """
+    Cross-session statistics over many tracking outputs. Every session is reduced to dwell events, one row per finger
+    resting on a cell, which are orders of magnitude fewer than frames and are kept in one columnar table of NumPy
+    arrays (see event_columns). Sessions are only read when a query needs them, a chunk of frames at a time, and the
+    aggregations run over groups of sessions so whole-study queries never hold more than one group in memory.
+    """
+    def __init__(self, output_paths, fps=30, chunk_frames=100000, chunk_sessions=256):
+        """
+        :param output_paths: tracking outputs, one per session, in any format of sessionFormats
+        :param fps: frame rate the sessions were recorded at, or a list of one frame rate per session
+        :param chunk_frames: number of frames read at a time from per-frame outputs
+        :param chunk_sessions: number of sessions whose events are aggregated at a time
+        """
+        self.output_paths = list(output_paths)
+        self.fps = np.broadcast_to(np.asarray(fps, dtype=np.float64), (len(self.output_paths),))
+        self.chunk_frames = chunk_frames
+        self.chunk_sessions = chunk_sessions
+        self.table = None
+
+    @classmethod
+    def from_directory(cls, sessions_dir, fps=30, **kwargs):
+        """
+        :param sessions_dir: root directory of the session outputs, see find_sessions
+        :param fps: frame rate the sessions were recorded at
+        :return: SessionAnalytics over every session found
+        """
+        return cls(find_sessions(sessions_dir), fps, **kwargs)
+
+    def __len__(self):
+        return len(self.output_paths)
+
+    def session_events(self, session):
+        """
+        Reads one session's dwell events
+        :param session: index of the session in output_paths
+        :return: event table, sorted by finger and start frame
+        """
+        output_path = self.output_paths[session]
+        output_format = session_format(output_path)
+        if output_format == 'dwell':
+            if os.path.getsize(output_path) <= len(TrackingOutput.dwell_header()):
+                return empty_events()
+            dwell = TrackingOutput.load_dwell_events(output_path)
+            events = {name: dwell[name].astype(dtype) for name, dtype in event_columns() if name != 'session'}
+            events['session'] = np.full(len(dwell), session, np.uint32)
+            return merge_events(events)
+        if output_format == 'npy':
+            tracks = TrackingOutput.load_tracks(output_path)
+            chunks = (np.array(tracks[start:start + self.chunk_frames])
+                      for start in range(0, len(tracks), self.chunk_frames))
+        elif output_format == 'tsv':
+            chunks = read_tsv_tracks(output_path, self.chunk_frames)
+        else:
+            raise ValueError('{} is not a tracking output'.format(output_path))
+        return merge_events(concat_events([track_events(chunk, session) for chunk in chunks]))
+
+    def chunks(self):
+        """
+        :return: generator of event tables, each holding up to chunk_sessions sessions
+        """
+        if self.table is not None:
+            yield self.table
+            return
+        for first in range(0, len(self), self.chunk_sessions):
+            sessions = range(first, min(first + self.chunk_sessions, len(self)))
+            yield concat_events([self.session_events(session) for session in sessions])
+
+    def events(self):
+        """
+        Reads every session into one event table, kept for later queries
+        :return: event table of all sessions
+        """
+        if self.table is None:
+            self.table = concat_events(list(self.chunks()))
+        return self.table
+
+    def cell_heatmap(self, finger=None, seconds=True):
+        """
+        Time spent on every cell of the page, summed over sessions. Summing over axis 1 gives the time per row.
+        :param finger: 1-based finger to count, or None for all fingers
+        :param seconds: True for seconds, False for frames
+        :return: (numRows, numColumns) array
+        """
+        page = BraillePage.BraillePage
+        heatmap = np.zeros(page.numRows * page.numColumns)
+        for events in self.chunks():
+            keep = (events['row'] >= 0) & (events['row'] < page.numRows) & (events['col'] >= 0) & \
+                   (events['col'] < page.numColumns)
+            if finger is not None:
+                keep &= events['finger'] == finger
+            weights = events['frames'][keep].astype(np.float64)
+            if seconds:
+                weights = weights / self.fps[events['session'][keep]]
+            cells = events['row'][keep].astype(np.intp) * page.numColumns + events['col'][keep]
+            heatmap += np.bincount(cells, weights=weights, minlength=len(heatmap))
+        return heatmap.reshape(page.numRows, page.numColumns)
+
+    def dwell_histogram(self, bins=None, n_fingers=8, on_page=True):
+        """
+        Histogram of how long each finger rests on a cell
+        :param bins: increasing bin edges in seconds, defaults to edges from 1/30 s to 10 s
+        :param n_fingers: number of fingers counted
+        :param on_page: only count events on a cell of the page
+        :return: (n_fingers, len(bins) - 1) counts and the bin edges. Dwells outside the edges are not counted.
+        """
+        bins = np.asarray(bins if bins is not None else [0, 1 / 30, 0.1, 0.25, 0.5, 1, 2, 5, 10], dtype=np.float64)
+        n_bins = len(bins) - 1
+        counts = np.zeros(n_fingers * n_bins, dtype=np.int64)
+        for events in self.chunks():
+            seconds = events['frames'] / self.fps[events['session']]
+            bin_index = np.searchsorted(bins, seconds, side='right') - 1
+            keep = (bin_index >= 0) & (bin_index < n_bins) & (events['finger'] >= 1) & (events['finger'] <= n_fingers)
+            if on_page:
+                keep &= events['row'] >= 0
+            slots = (events['finger'][keep].astype(np.intp) - 1) * n_bins + bin_index[keep]
+            counts += np.bincount(slots, minlength=len(counts))
+        return counts.reshape(n_fingers, n_bins), bins
+
+    def reading_speed(self, same_word_seconds=2.0, min_regression=2):
+        """
+        Words per minute and regressions of every session. A word is read when a finger moves from a blank cell onto
+        the next cell of the same row and it is not blank; fingers starting the same word within same_word_seconds of
+        each other read it once. A regression is a finger moving back at least min_regression cells along a row, or
+        up to an earlier row.
+        :param same_word_seconds: window in which word starts on the same cell count once
+        :param min_regression: cells a finger moves back along a row for it to count as a regression, so tracking
+        jitter between neighbouring cells does not
+        :return: dict of per-session arrays: session, minutes, words, wpm, regressions
+        """
+        results = {name: [] for name in ('session', 'minutes', 'words', 'wpm', 'regressions')}
+        for events in self.chunks():
+            events = select_events(events, np.lexsort((events['start'], events['finger'], events['session'])))
+            on_page = events['row'] >= 0
+            blank = np.isin(events['code'], blank_codes)
+            same_finger = np.zeros(len(events['start']), dtype=bool)
+            same_finger[1:] = ((events['session'][1:] == events['session'][:-1]) &
+                               (events['finger'][1:] == events['finger'][:-1]))
+            prev_row = np.roll(events['row'].astype(np.int64), 1)
+            prev_col = np.roll(events['col'].astype(np.int64), 1)
+            row = events['row'].astype(np.int64)
+            col = events['col'].astype(np.int64)
+
+            word_start = (same_finger & on_page & ~blank & np.roll(blank, 1) & (row == prev_row) &
+                          (col == prev_col + 1))
+            # the previous event is the finger's last one on the page, so moves across the margin still count
+            regression = same_finger & on_page & np.roll(on_page, 1) & (
+                ((row == prev_row) & (col <= prev_col - min_regression)) | (row < prev_row))
+
+            # keep one start per word, however many fingers reach it
+            starts = select_events(events, word_start)
+            order = np.lexsort((starts['start'], starts['col'], starts['row'], starts['session']))
+            starts = select_events(starts, order)
+            window = same_word_seconds * self.fps[starts['session']]
+            repeat = np.zeros(len(order), dtype=bool)
+            repeat[1:] = ((starts['session'][1:] == starts['session'][:-1]) & (starts['row'][1:] == starts['row'][:-1]) &
+                          (starts['col'][1:] == starts['col'][:-1]) &
+                          (starts['start'][1:].astype(np.int64) - starts['start'][:-1] < window[1:]))
+
+            sessions, session_index = np.unique(events['session'], return_inverse=True)
+            first = np.full(len(sessions), np.iinfo(np.int64).max)
+            last = np.zeros(len(sessions), dtype=np.int64)
+            np.minimum.at(first, session_index, events['start'].astype(np.int64))
+            np.maximum.at(last, session_index, events['end'].astype(np.int64))
+            minutes = (last - first + 1) / self.fps[sessions] / 60
+            words = np.bincount(np.searchsorted(sessions, starts['session'][~repeat]), minlength=len(sessions))
+            regressions = np.bincount(session_index[regression], minlength=len(sessions))
+
+            results['session'].append(sessions)
+            results['minutes'].append(minutes)
+            results['words'].append(words)
+            results['wpm'].append(words / minutes)
+            results['regressions'].append(regressions)
+        return {name: np.concatenate(values) if values else np.zeros(0) for name, values in results.items()}
+
+    def summary(self):
+        """
+        :return: JSON-ready dict of study totals and per-session reading speed
+        """
+        speed = self.reading_speed()
+        counts, bins = self.dwell_histogram()
+        return {
+            'sessions': [{'output': self.output_paths[session], 'minutes': float(minutes), 'words': int(words),
+                          'wpm': float(wpm), 'regressions': int(regressions)}
+                         for session, minutes, words, wpm, regressions in
+                         zip(speed['session'], speed['minutes'], speed['words'], speed['wpm'], speed['regressions'])],
+            'total_minutes': float(speed['minutes'].sum()),
+            'total_words': int(speed['words'].sum()),
+            'mean_wpm': float(speed['words'].sum() / speed['minutes'].sum()) if speed['minutes'].sum() > 0 else 0.0,
+            'dwell_bins': bins.tolist(),
+            'dwell_counts': counts.tolist(),
+        }
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Statistics over many tracked Braille reading sessions')
+    ap.add_argument('-d', '--sessions-dir', required=True, help='root directory of the session outputs')
+    ap.add_argument('--fps', type=float, default=30, help='frame rate the sessions were recorded at')
+    ap.add_argument('-o', '--output', default='./study_summary.json', help='JSON summary to write')
+    ap.add_argument('--heatmap', default=None, help='also save the per-cell seconds heatmap to this .npy file')
+    args = vars(ap.parse_args())
+
+    analytics = SessionAnalytics.from_directory(args['sessions_dir'], args['fps'])
+    print('Found {} sessions'.format(len(analytics)))
+    study = analytics.summary()
+    with open(args['output'], 'w') as fh:
+        json.dump(study, fh, indent=2)
+    print('{} words in {:.1f} minutes, {:.1f} words per minute'.format(
+        study['total_words'], study['total_minutes'], study['mean_wpm']))
+    if args['heatmap']:
+        np.save(args['heatmap'], analytics.cell_heatmap())
@@ -0,0 +1,333 @@
+# USAGE
+# python TrackerBenchmark.py --label my_change
+# python TrackerBenchmark.py --label my_change --trackers CSRT KCF --compare benchmark_results/baseline.json
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import time
+
+import cv2
+import numpy as np
+
+import ColorMasking
+import FingerTracking
+import FramePipeline
+import VideoTracker
+
+# (width, height, frames) of the synthetic videos every tracker is run on
+default_videos = [(1280, 720, 300), (1920, 1080, 300), (1920, 1080, 1800)]
+quick_videos = [(960, 540, 90)]
+
+# HYBRID settings, matching VideoTracker's defaults
+default_hybrid_options = {'fast_tracker_type': 'KCF', 'anchor_interval': 15, 'anchor_confidence': 0.5}
+
+# BGR colors of the synthetic fingertip markers
+finger_colors = [(0, 0, 255), (0, 128, 255), (0, 255, 255), (0, 255, 0),
+                 (255, 255, 0), (255, 0, 0), (255, 0, 255), (128, 0, 128)]
+
+
+def finger_paths(n_frames, size, n_fingers=8, seed=0):
+    """
+    Ground truth fingertip centers of a synthetic reading session: fingers sweep left to right along a line of the
+    page together, drop to the next line and wobble a little
+    :param n_frames: number of frames
+    :param size: (width, height) of the video
+    :param n_fingers: number of fingers
+    :param seed: random seed of the wobble
+    :return: (n_frames, n_fingers, 2) float64 array of pixel centers
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    t = np.arange(n_frames)
+
+    # one line is read every 4 seconds at 30 fps, lines are spread over the middle of the page
+    line_frames = 120
+    sweep = (t % line_frames) / line_frames
+    line = (t // line_frames) % 6
+
+    hand_x = width * (0.25 + 0.3 * sweep)
+    hand_y = height * (0.3 + 0.08 * line)
+    spacing = width * 0.05
+
+    centers = np.empty((n_frames, n_fingers, 2))
+    for finger in range(n_fingers):
+        phase = rng.uniform(0, 2 * np.pi)
+        centers[:, finger, 0] = hand_x + (finger - (n_fingers - 1) / 2) * spacing + 4 * np.sin(t / 7 + phase)
+        centers[:, finger, 1] = hand_y + 0.1 * height * abs(finger - (n_fingers - 1) / 2) / n_fingers \
+            + 3 * np.cos(t / 9 + phase)
+    return centers
+
+
+def make_synthetic_video(video_path, size=(1920, 1080), n_frames=300, n_fingers=8, fps=30, seed=0):
+    """
+    Writes a synthetic session video: a dotted page on a dark background with colored fingertip blobs moving over it
+    :param video_path: path of the .mp4 to write
+    :param size: (width, height) of the video
+    :param n_frames: number of frames
+    :param n_fingers: number of fingers
+    :param fps: frame rate
+    :param seed: random seed
+    :return: ground truth (n_frames, n_fingers, 2) centers and the blob radius in pixels
+    """
+    width, height = size
+    centers = finger_paths(n_frames, size, n_fingers, seed)
+    radius = max(4, int(round(height * 0.02)))
+
+    # page with rows of braille-like dots, so the background has texture for the trackers
+    background = np.full((height, width, 3), 40, np.uint8)
+    x0, y0, x1, y1 = int(width * 0.15), int(height * 0.1), int(width * 0.85), int(height * 0.95)
+    background[y0:y1, x0:x1] = 225
+    dot_step = max(3, height // 90)
+    rng = np.random.default_rng(seed)
+    for y in range(y0 + dot_step, y1 - dot_step, dot_step * 2):
+        for x in range(x0 + dot_step, x1 - dot_step, dot_step):
+            if rng.random() < 0.5:
+                cv2.circle(background, (x, y), max(1, dot_step // 4), (150, 150, 150), -1)
+
+    video_out = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size, True)
+    for frame_centers in centers:
+        frame = background.copy()
+        for finger, (x, y) in enumerate(frame_centers):
+            color = finger_colors[finger % len(finger_colors)]
+            cv2.circle(frame, (int(round(x)), int(round(y))), radius, color, -1, cv2.LINE_AA)
+            # a darker rim so the blob has some structure
+            cv2.circle(frame, (int(round(x)), int(round(y))), radius, tuple(c // 2 for c in color), 2, cv2.LINE_AA)
+        video_out.write(frame)
+    video_out.release()
+    return centers, radius
+
+
+def prepare_videos(video_dir, videos):
+    """
+    Generates the synthetic videos and their ground truth, reusing ones generated before
+    :param video_dir: directory videos are written to
+    :param videos: list of (width, height, frames)
+    :return: list of dicts with video path, ground truth path, size, frames and blob radius
+    """
+    os.makedirs(video_dir, exist_ok=True)
+    prepared = []
+    for width, height, n_frames in videos:
+        name = 'synthetic_{}x{}_{}'.format(width, height, n_frames)
+        video_path = os.path.join(video_dir, name + '.mp4')
+        truth_path = os.path.join(video_dir, name + '_truth.npz')
+        if not (os.path.exists(video_path) and os.path.exists(truth_path)):
+            print('Generating {}'.format(video_path))
+            centers, radius = make_synthetic_video(video_path, (width, height), n_frames)
+            np.savez(truth_path, centers=centers, radius=radius)
+        prepared.append({'name': name, 'video': video_path, 'truth': truth_path,
+                         'size': [width, height], 'frames': n_frames})
+    return prepared
+
+
+def marker_colors(n_fingers=8):
+    """
+    :return: the synthetic fingertip colors as (hue in degrees, saturation %, value %) for ColorMarkerDetector
+    """
+    bgr = np.array([[finger_colors[i % len(finger_colors)] for i in range(n_fingers)]], dtype=np.uint8)
+    hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)[0].astype(np.float64)
+    return [(h * 2, s * 100 / 255, v * 100 / 255) for h, s, v in hsv]
+
+
+def create_multi_tracker(tracker_type, hybrid_options):
+    """
+    :param tracker_type: entry of VideoTracker.VideoTracker.trackerTypes, HYBRID or COLOR
+    :param hybrid_options: dict of fast_tracker_type, anchor_interval and anchor_confidence for HYBRID
+    :return: empty finger tracker and a callable creating the tracker added for each finger, None for COLOR
+    """
+    create = VideoTracker.VideoTracker.create_tracker_by_name
+    if tracker_type == VideoTracker.VideoTracker.colorTrackerType:
+        return ColorMasking.ColorMarkerDetector(marker_colors(), min_area=5), None
+    if tracker_type == VideoTracker.VideoTracker.hybridTrackerType:
+        multi_tracker = FingerTracking.HybridFingerTracker(lambda: create(hybrid_options['fast_tracker_type']),
+                                                           hybrid_options['anchor_interval'],
+                                                           hybrid_options['anchor_confidence'])
+        return multi_tracker, lambda: create('CSRT')
+    return FingerTracking.MultiFingerTracker(), lambda: create(tracker_type)
+
+
+def run_tracker(video, tracker_type, tracking_scale=1.0, hybrid_options=None):
+    """
+    Tracks every finger of one synthetic video with one tracker type, meant to run in its own process so peak
+    memory and crashes belong to this run only
+    :param video: dict from prepare_videos
+    :param tracker_type: entry of VideoTracker.VideoTracker.trackerTypes, HYBRID or COLOR
+    :param tracking_scale: factor frames are downscaled by before tracking
+    :param hybrid_options: dict of fast_tracker_type, anchor_interval and anchor_confidence for HYBRID
+    :return: dict of frames/sec, peak memory and center errors, plus re-anchor counts for HYBRID
+    """
+    result = {'video': video['name'], 'tracker': tracker_type, 'tracking_scale': tracking_scale}
+    truth = np.load(video['truth'])
+    centers, radius = truth['centers'], float(truth['radius'])
+    size = tuple(video['size'])
+
+    cap = cv2.VideoCapture(video['video'])
+    geometry = FramePipeline.TrackingGeometry(size, tracking_scale)
+    frames = FramePipeline.read_frames(cap, geometry)
+
+    try:
+        frame, track_frame = next(frames)
+        half = radius * 1.5
+        bboxes = [(x - half, y - half, 2 * half, 2 * half) for x, y in centers[0]]
+        multi_tracker, create_tracker = create_multi_tracker(tracker_type, hybrid_options or default_hybrid_options)
+        for bbox in geometry.to_track(bboxes) if create_tracker is not None else []:
+            tracker = create_tracker()
+            if tracker is None:
+                raise ValueError('Unknown tracker {}'.format(tracker_type))
+            multi_tracker.add(tracker, track_frame, bbox)
+    except Exception as err:
+        result['error'] = '{}: {}'.format(type(err).__name__, err)
+        return result
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    errors = np.zeros((len(centers) - 1, centers.shape[1]))
+    tracking_seconds = 0.0
+    n_frames = 0
+    start = time.perf_counter()
+    for frame_num, (frame, track_frame) in enumerate(frames, start=1):
+        update_start = time.perf_counter()
+        success, track_boxes = multi_tracker.update(track_frame)
+        tracking_seconds += time.perf_counter() - update_start
+
+        boxes = geometry.to_frame(track_boxes)
+        tracked_centers = boxes[:, :2] + boxes[:, 2:] / 2
+        errors[frame_num - 1] = np.linalg.norm(tracked_centers - centers[frame_num], axis=1)
+        n_frames += 1
+    total_seconds = time.perf_counter() - start
+    errors = errors[:n_frames]
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_unit = 1 if platform.system() == 'Darwin' else 1024
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result.update({
+        'frames': n_frames,
+        'tracking_fps': n_frames / tracking_seconds if tracking_seconds > 0 else 0.0,
+        'end_to_end_fps': n_frames / total_seconds if total_seconds > 0 else 0.0,
+        'peak_rss_mb': peak_rss * rss_unit / 2 ** 20,
+        'tracking_rss_mb': (peak_rss - rss_before) * rss_unit / 2 ** 20,
+        'mean_error_px': float(errors.mean()) if n_frames else None,
+        'p50_error_px': float(np.percentile(errors, 50)) if n_frames else None,
+        'p99_error_px': float(np.percentile(errors, 99)) if n_frames else None,
+        # a finger counts as lost when its box center is off by more than the blob's diameter
+        'lost_fraction': float((errors > 2 * radius).mean()) if n_frames else None,
+    })
+    if isinstance(multi_tracker, FingerTracking.HybridFingerTracker):
+        result['anchors'] = multi_tracker.anchor_summary()
+    return result
+
+
+def run_benchmark(tracker_types, videos, tracking_scales=(1.0,), hybrid_options=None):
+    """
+    Runs every tracker type on every video, each run in a fresh process
+    :param tracker_types: tracker names to run
+    :param videos: list of dicts from prepare_videos
+    :param tracking_scales: tracking scales to run each tracker at
+    :param hybrid_options: dict of fast_tracker_type, anchor_interval and anchor_confidence for HYBRID
+    :return: list of result dicts
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for video in videos:
+        for tracker_type in tracker_types:
+            for tracking_scale in tracking_scales:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    try:
+                        result = pool.submit(run_tracker, video, tracker_type, tracking_scale,
+                                             hybrid_options).result()
+                    except Exception as err:
+                        # e.g. the tracker crashed the worker process
+                        result = {'video': video['name'], 'tracker': tracker_type, 'tracking_scale': tracking_scale,
+                                  'error': '{}: {}'.format(type(err).__name__, err)}
+                print_result(result)
+                results.append(result)
+    return results
+
+
+def print_result(result):
+    """
+    Prints a one line summary of a benchmark run
+    """
+    label = '{:>28} {:>10} x{:<5}'.format(result['video'], result['tracker'], result['tracking_scale'])
+    if 'error' in result:
+        print('{} FAILED {}'.format(label, result['error']))
+    else:
+        print('{} {:7.1f} fps  {:6.1f} MB  error mean {:6.1f}px p99 {:6.1f}px  lost {:5.1%}'.format(
+            label, result['tracking_fps'], result['tracking_rss_mb'], result['mean_error_px'],
+            result['p99_error_px'], result['lost_fraction']))
+        if 'anchors' in result:
+            print('{} re-anchored {} times ({:.1%} of finger updates)'.format(
+                ' ' * len(label), result['anchors']['total'], result['anchors']['rate']))
+
+
+def save_results(results, output_dir, label):
+    """
+    Saves benchmark results with the environment they were measured in
+    :return: path of the saved JSON file
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, label + '.json')
+    with open(path, 'w') as fh:
+        json.dump({
+            'label': label,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'results': results,
+        }, fh, indent=2)
+    return path
+
+
+def compare_results(results, baseline_path):
+    """
+    Prints the change in frames/sec and mean error of every run also present in a saved baseline
+    :param results: list of result dicts of this run
+    :param baseline_path: path of an earlier save_results file
+    """
+    with open(baseline_path, 'r') as fh:
+        baseline = json.load(fh)
+    previous = {(r['video'], r['tracker'], r['tracking_scale']): r for r in baseline['results'] if 'error' not in r}
+
+    print('Compared to {} ({})'.format(baseline['label'], baseline['time']))
+    for result in results:
+        old = previous.get((result['video'], result['tracker'], result['tracking_scale']))
+        if old is None or 'error' in result:
+            continue
+        print('{:>28} {:>10} x{:<5} fps {:+7.1%}  mean error {:+6.1f}px'.format(
+            result['video'], result['tracker'], result['tracking_scale'],
+            result['tracking_fps'] / old['tracking_fps'] - 1 if old['tracking_fps'] else 0.0,
+            result['mean_error_px'] - old['mean_error_px']))
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Benchmark every tracker type on synthetic reading sessions')
+    ap.add_argument('-l', '--label', default=time.strftime('%Y%m%d_%H%M%S'), help='name the results are saved under')
+    ap.add_argument('-t', '--trackers', nargs='+',
+                    default=VideoTracker.VideoTracker.trackerTypes + [VideoTracker.VideoTracker.hybridTrackerType,
+                                                                      VideoTracker.VideoTracker.colorTrackerType],
+                    help='tracker types to run, defaults to all')
+    ap.add_argument('--fast-tracker', default=default_hybrid_options['fast_tracker_type'],
+                    help='tracker run every frame in HYBRID mode')
+    ap.add_argument('--anchor-interval', type=int, default=default_hybrid_options['anchor_interval'],
+                    help='frames between CSRT re-anchors in HYBRID mode')
+    ap.add_argument('--anchor-confidence', type=float, default=default_hybrid_options['anchor_confidence'],
+                    help='correlation below which HYBRID mode re-anchors early')
+    ap.add_argument('-s', '--scales', nargs='+', type=float, default=[1.0], help='tracking scales to run at')
+    ap.add_argument('-q', '--quick', action='store_true', help='one short low resolution video only')
+    ap.add_argument('-c', '--compare', help='earlier results file to compare against')
+    ap.add_argument('--video-dir', default='./cache/benchmark_videos', help='where synthetic videos are kept')
+    ap.add_argument('--output-dir', default='./benchmark_results', help='where results are saved')
+    args = vars(ap.parse_args())
+
+    benchmark_videos = prepare_videos(args['video_dir'], quick_videos if args['quick'] else default_videos)
+    benchmark_results = run_benchmark(args['trackers'], benchmark_videos, args['scales'],
+                                      {'fast_tracker_type': args['fast_tracker'],
+                                       'anchor_interval': args['anchor_interval'],
+                                       'anchor_confidence': args['anchor_confidence']})
+    print('Results saved to {}'.format(save_results(benchmark_results, args['output_dir'], args['label'])))
+    if args['compare']:
+        compare_results(benchmark_results, args['compare'])
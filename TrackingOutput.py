@@ -0,0 +1,386 @@
+import os
+import struct
+
+import numpy as np
+
+import BraillePage
+
+def tsv_header(n_fingers=8):
+    """
+    :param n_fingers: number of tracked fingers
+    :return: header line of the tab delimited output file, e.g. Frame, X1, Y1, ..., X8, Y8, L1, ..., L8
+    """
+    coords = ['X{0}\tY{0}'.format(i + 1) for i in range(n_fingers)]
+    letters = ['L{0}'.format(i + 1) for i in range(n_fingers)]
+    return 'Frame\t' + '\t'.join(coords + letters) + '\n'
+
+
+class TsvOutputWriter:
+    """
+    Streams tracking results to the tab delimited BrailleOutput.txt format as frames are produced
+    """
+    def __init__(self, output_path, n_fingers=8, flush_every=100):
+        """
+        :param output_path: path of the output file, overwritten if it exists
+        :param n_fingers: number of tracked fingers
+        :param flush_every: number of frames buffered before they are written out, so memory stays flat and the
+        file can be read while tracking is still running
+        """
+        self.output_path = output_path
+        self.n_fingers = n_fingers
+        self.flush_every = flush_every
+        self.buffer = []
+        self.n_frames = 0
+        self.outfile = open(output_path, 'w+')
+        self.outfile.write(tsv_header(n_fingers))
+        self.outfile.flush()
+
+    def write_frame(self, frame_num, x_centers, y_centers, codes, rows, columns):
+        """
+        Appends one frame of results given as parallel arrays, one entry per tracked box
+        :param frame_num: index of the frame
+        :param x_centers: center of each box on the page, x coord
+        :param y_centers: center of each box on the page, y coord
+        :param codes: character code under each box, as from BraillePage.positions2Chars
+        :param rows: row of each character
+        :param columns: column of each character
+        """
+        x_centers_per_frame = [0] * self.n_fingers
+        y_centers_per_frame = [0] * self.n_fingers
+        letters_per_frame = [0] * self.n_fingers
+        for i, (x, y, code, row, column) in enumerate(zip(x_centers, y_centers, codes, rows, columns)):
+            x_centers_per_frame[i], y_centers_per_frame[i] = float(x), float(y)
+            # same (char, column, row) order as BraillePage.position2Char
+            letters_per_frame[i] = (BraillePage.BraillePage.code2Char(code), int(column), int(row))
+        self.write_row(frame_num, x_centers_per_frame, y_centers_per_frame, letters_per_frame)
+
+    def write_row(self, frame_num, x_centers, y_centers, letters):
+        """
+        Appends one frame of already formatted results
+        :param frame_num: index of the frame
+        :param x_centers: center of each box, x coord
+        :param y_centers: center of each box, y coord
+        :param letters: the letter on the Braille page corresponding to each x and y coord
+        """
+        # formatting a single line containing coords X1, Y1 through X8, Y8
+        frame_str = str(frame_num) + '\t' + "\t".join(["{0}\t{1}".format(x, y) for x, y in zip(x_centers, y_centers)])
+
+        # adding the associated letters to frame_str
+        frame_str += '\t' + "\t".join(["{0}".format(letter) for letter in letters])
+
+        self.buffer.append(frame_str + '\n')
+        self.n_frames += 1
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes buffered frames through to the file
+        """
+        if self.buffer:
+            self.outfile.write(''.join(self.buffer))
+            self.buffer = []
+        self.outfile.flush()
+
+    def close(self):
+        """
+        Flushes remaining frames and closes the file
+        """
+        if not self.outfile.closed:
+            self.flush()
+            self.outfile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+def dwell_header():
+    """
+    :return: header line of the tab delimited dwell event file
+    """
+    return 'Finger\tCode\tChar\tRow\tColumn\tStartFrame\tEndFrame\tFrames\tMeanX\tMeanY\n'
+
+
+class DwellEventWriter:
+    """
+    Streams the letters under each finger as dwell events instead of one row per frame: a finger resting on one cell
+    for many frames becomes a single event with its first and last frame and mean position
+    """
+    def __init__(self, output_path, n_fingers=8, flush_every=100):
+        """
+        :param output_path: path of the output file, overwritten if it exists
+        :param n_fingers: number of tracked fingers
+        :param flush_every: number of events buffered before they are written out
+        """
+        self.output_path = output_path
+        self.n_fingers = n_fingers
+        self.flush_every = flush_every
+        self.buffer = []
+        self.n_events = 0
+        # the open event of every finger, start -1 when a finger has none
+        self.codes = np.zeros(n_fingers, np.int16)
+        self.rows = np.zeros(n_fingers, np.int16)
+        self.columns = np.zeros(n_fingers, np.int16)
+        self.start = np.full(n_fingers, -1, np.int64)
+        self.end = np.full(n_fingers, -1, np.int64)
+        self.sum_x = np.zeros(n_fingers)
+        self.sum_y = np.zeros(n_fingers)
+        self.n_positions = np.zeros(n_fingers, np.int64)
+        self.outfile = open(output_path, 'w+')
+        self.outfile.write(dwell_header())
+        self.outfile.flush()
+
+    def write_frame(self, frame_num, x_centers, y_centers, codes, rows, columns):
+        """
+        Adds one frame of results given as parallel arrays, one entry per tracked box. Events of fingers that moved to
+        another cell are emitted.
+        :param frame_num: index of the frame, frames must come in order
+        :param x_centers: center of each box on the page, x coord
+        :param y_centers: center of each box on the page, y coord
+        :param codes: character code under each box, as from BraillePage.positions2Chars
+        :param rows: row of each character
+        :param columns: column of each character
+        """
+        n_boxes = len(x_centers)
+        codes = np.asarray(codes)
+        rows = np.asarray(rows)
+        columns = np.asarray(columns)
+        # a finger's event ends when its cell changes or it was not tracked on the previous frame
+        moved = ((self.codes[:n_boxes] != codes) | (self.rows[:n_boxes] != rows) |
+                 (self.columns[:n_boxes] != columns) | (self.end[:n_boxes] != frame_num - 1))
+        for finger in np.flatnonzero(moved | (self.start[:n_boxes] < 0)).tolist():
+            self._end_event(finger)
+            self.codes[finger], self.rows[finger], self.columns[finger] = codes[finger], rows[finger], columns[finger]
+            self.start[finger] = frame_num
+        # fingers not tracked on this frame end their events
+        for finger in np.flatnonzero(self.start[n_boxes:] >= 0).tolist():
+            self._end_event(n_boxes + finger)
+
+        self.end[:n_boxes] = frame_num
+        x_centers = np.asarray(x_centers, dtype=np.float64)
+        y_centers = np.asarray(y_centers, dtype=np.float64)
+        tracked = ~(np.isnan(x_centers) | np.isnan(y_centers))
+        self.sum_x[:n_boxes] += np.where(tracked, x_centers, 0)
+        self.sum_y[:n_boxes] += np.where(tracked, y_centers, 0)
+        self.n_positions[:n_boxes] += tracked
+
+    def _end_event(self, finger):
+        """
+        Emits the open event of a finger, if it has one
+        """
+        if self.start[finger] < 0:
+            return
+        n_positions = self.n_positions[finger]
+        mean_x = self.sum_x[finger] / n_positions if n_positions else float('nan')
+        mean_y = self.sum_y[finger] / n_positions if n_positions else float('nan')
+        self.buffer.append('{0}\t{1}\t{2!r}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}\n'.format(
+            finger + 1, int(self.codes[finger]), BraillePage.BraillePage.code2Char(self.codes[finger]),
+            int(self.rows[finger]), int(self.columns[finger]), int(self.start[finger]), int(self.end[finger]),
+            int(self.end[finger] - self.start[finger] + 1), mean_x, mean_y))
+        self.start[finger] = -1
+        self.sum_x[finger] = self.sum_y[finger] = 0
+        self.n_positions[finger] = 0
+        self.n_events += 1
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes buffered events through to the file
+        """
+        if self.buffer:
+            self.outfile.write(''.join(self.buffer))
+            self.buffer = []
+        self.outfile.flush()
+
+    def close(self):
+        """
+        Emits the events still open, flushes and closes the file
+        """
+        if not self.outfile.closed:
+            for finger in range(self.n_fingers):
+                self._end_event(finger)
+            self.flush()
+            self.outfile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+def load_dwell_events(dwell_path):
+    """
+    Reads a dwell event file
+    :param dwell_path: path of a file written by DwellEventWriter
+    :return: structured array with finger, code, row, col, start, end, frames, x and y fields
+    """
+    dtype = np.dtype([('finger', 'u1'), ('code', 'u1'), ('row', 'i1'), ('col', 'i1'), ('start', '<u4'),
+                      ('end', '<u4'), ('frames', '<u4'), ('x', '<f4'), ('y', '<f4')])
+    events = np.loadtxt(dwell_path, delimiter='\t', skiprows=1, usecols=(0, 1, 3, 4, 5, 6, 7, 8, 9), ndmin=1,
+                        dtype=[(name, '<f8') for name in dtype.names])
+    return events.astype(dtype)
+
+
+def track_dtype(n_fingers=8):
+    """
+    Fixed record layout of the binary track format, one record per frame
+    :param n_fingers: number of tracked fingers
+    :return: numpy structured dtype with frame index, page x/y per finger as float32 and character code, row and
+    column per finger as small ints (row/column -1 off the page, x/y NaN for fingers that were not tracked)
+    """
+    return np.dtype([('frame', '<u4'),
+                     ('x', '<f4', (n_fingers,)),
+                     ('y', '<f4', (n_fingers,)),
+                     ('char', 'u1', (n_fingers,)),
+                     ('row', 'i1', (n_fingers,)),
+                     ('col', 'i1', (n_fingers,))])
+
+
+npy_magic = b'\x93NUMPY\x01\x00'
+
+
+def npy_header(dtype, n_records):
+    """
+    Builds a version 1.0 .npy header whose length does not depend on n_records, so it can be rewritten in place
+    once the final record count is known
+    :param dtype: record dtype
+    :param n_records: number of records in the file
+    :return: header bytes
+    """
+    header = "{{'descr': {0!r}, 'fortran_order': False, 'shape': ({1},), }}".format(
+        np.lib.format.dtype_to_descr(dtype), n_records)
+    # reserve room for a 20 digit record count
+    header += ' ' * (20 - len(str(n_records)))
+    # pad so the data starts on a 64 byte boundary, as numpy does
+    header += ' ' * (-(len(npy_magic) + 2 + len(header) + 1) % 64) + '\n'
+    return npy_magic + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class NpyTrackWriter:
+    """
+    Streams tracking results to a compact binary .npy file of track_dtype records
+    """
+    def __init__(self, output_path, n_fingers=8, flush_every=100):
+        """
+        :param output_path: path of the output .npy file, overwritten if it exists
+        :param n_fingers: number of tracked fingers
+        :param flush_every: number of frames buffered before they are written out
+        """
+        self.output_path = output_path
+        self.dtype = track_dtype(n_fingers)
+        self.buffer = np.zeros(flush_every, self.dtype)
+        self.n_buffered = 0
+        self.n_frames = 0
+        self.outfile = open(output_path, 'wb')
+        self.outfile.write(npy_header(self.dtype, 0))
+        self.outfile.flush()
+
+    def write_frame(self, frame_num, x_centers, y_centers, codes, rows, columns):
+        """
+        Appends one frame of results given as parallel arrays, one entry per tracked box
+        :param frame_num: index of the frame
+        :param x_centers: center of each box on the page, x coord
+        :param y_centers: center of each box on the page, y coord
+        :param codes: character code under each box, as from BraillePage.positions2Chars
+        :param rows: row of each character
+        :param columns: column of each character
+        """
+        n_boxes = len(x_centers)
+        record = self.buffer[self.n_buffered]
+        record['frame'] = frame_num
+        record['x'][:n_boxes] = x_centers
+        record['x'][n_boxes:] = np.nan
+        record['y'][:n_boxes] = y_centers
+        record['y'][n_boxes:] = np.nan
+        record['char'][:n_boxes] = codes
+        record['char'][n_boxes:] = 0
+        record['row'][:n_boxes] = rows
+        record['row'][n_boxes:] = BraillePage.BraillePage.outOfMargin
+        record['col'][:n_boxes] = columns
+        record['col'][n_boxes:] = BraillePage.BraillePage.outOfMargin
+
+        self.n_buffered += 1
+        self.n_frames += 1
+        if self.n_buffered == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        """
+        Writes buffered frames through to the file
+        """
+        if self.n_buffered:
+            self.outfile.write(self.buffer[:self.n_buffered].tobytes())
+            self.n_buffered = 0
+        self.outfile.flush()
+
+    def close(self):
+        """
+        Flushes remaining frames, records the final frame count in the header and closes the file
+        """
+        if not self.outfile.closed:
+            self.flush()
+            self.outfile.seek(0)
+            self.outfile.write(npy_header(self.dtype, self.n_frames))
+            self.outfile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+def load_tracks(track_path):
+    """
+    Memory-maps a binary track file, so frame ranges can be sliced without reading the whole session
+    Works on files that are still being written, using every complete record on disk.
+    :param track_path: path of a file written by NpyTrackWriter
+    :return: read-only structured array of track_dtype records
+    """
+    with open(track_path, 'rb') as fh:
+        np.lib.format.read_magic(fh)
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fh)
+        offset = fh.tell()
+
+    n_records = (os.path.getsize(track_path) - offset) // dtype.itemsize
+    if n_records == 0:
+        return np.zeros(0, dtype)
+    return np.memmap(track_path, dtype=dtype, mode='r', offset=offset, shape=(n_records,))
+
+
+def frame_range(tracks, start, stop):
+    """
+    :param tracks: track records, e.g. from load_tracks
+    :param start: first frame index to include
+    :param stop: frame index to stop before
+    :return: the records of frames start <= frame < stop, as a view
+    """
+    first, last = np.searchsorted(tracks['frame'], [start, stop])
+    return tracks[first:last]
+
+
+def export_tsv(track_path, output_path, chunk_frames=10000):
+    """
+    Exports a binary track file to the tab delimited BrailleOutput.txt format
+    :param track_path: path of a file written by NpyTrackWriter
+    :param output_path: path of the tab delimited file to write
+    :param chunk_frames: number of frames converted at a time
+    """
+    tracks = load_tracks(track_path)
+    n_fingers = tracks.dtype['x'].shape[0]
+    with TsvOutputWriter(output_path, n_fingers, flush_every=chunk_frames) as writer:
+        for start in range(0, len(tracks), chunk_frames):
+            chunk = np.array(tracks[start:start + chunk_frames])
+            # fingers after the last tracked one are left out, as the tracker never produced them. A finger lost in
+            # the middle stays, NaN, so the fingers after it keep their columns
+            tracked = ~np.isnan(chunk['x'])
+            last_tracked = n_fingers - np.argmax(tracked[:, ::-1], axis=1)
+            chunk_boxes = np.where(tracked.any(axis=1), last_tracked, 0)
+            for record, n_boxes in zip(chunk, chunk_boxes.tolist()):
+                writer.write_frame(int(record['frame']), record['x'][:n_boxes], record['y'][:n_boxes],
+                                   record['char'][:n_boxes], record['row'][:n_boxes], record['col'][:n_boxes])
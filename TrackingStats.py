@@ -0,0 +1,216 @@
+import array
+import contextlib
+import json
+import threading
+import time
+
+import numpy as np
+
+
+class ProgressReporter:
+    """
+    Throttled progress reporting: prints at most once per interval instead of once per frame
+    """
+    def __init__(self, total_frames=0, interval=5.0):
+        """
+        :param total_frames: number of frames expected, 0 or less if unknown
+        :param interval: minimum seconds between progress lines, None to never print
+        """
+        self.total_frames = total_frames
+        self.interval = interval
+        self.start = time.monotonic()
+        self.last_report = self.start
+
+    def update(self, n_frames):
+        """
+        Reports progress if the interval has passed since the last report
+        :param n_frames: number of frames processed so far
+        """
+        if self.interval is None:
+            return
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report(n_frames, now)
+
+    def report(self, n_frames, now=None):
+        """
+        Prints frames processed so far and the average frame rate
+        :param n_frames: number of frames processed so far
+        :param now: current time.monotonic(), looked up if not given
+        """
+        elapsed = (now if now is not None else time.monotonic()) - self.start
+        fps = n_frames / elapsed if elapsed > 0 else 0.0
+        if self.total_frames > 0:
+            print('Processed {0}/{1} frames ({2:.0%}), {3:.1f} fps'.format(
+                n_frames, self.total_frames, n_frames / self.total_frames, fps))
+        else:
+            print('Processed {0} frames, {1:.1f} fps'.format(n_frames, fps))
+
+
+class StageProfiler:
+    """
+    Records wall time of each stage of the tracking loop per frame and summarizes it at the end of a run
+
+    Stages are free-form names, the tracking loop uses decode, resize, track (plus track_finger1, track_finger2, ...
+    for each finger's tracker), qr (when switching pages), page (when following the page), transform, lookup, output, draw and encode.
+    """
+    def __init__(self, enabled=True, hooks=()):
+        """
+        :param enabled: If False, nothing is recorded and stage timing is a no-op
+        :param hooks: callables hook(stage, frame_num, seconds) called for every recorded stage, to attach other
+        profilers
+        """
+        self.enabled = enabled
+        self.hooks = list(hooks)
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """
+        :param hook: callable hook(stage, frame_num, seconds) called for every recorded stage
+        """
+        self.hooks.append(hook)
+
+    def record(self, stage, frame_num, seconds):
+        """
+        Records the wall time one stage took on one frame, safe to call from reader and writer threads
+        :param stage: name of the stage
+        :param frame_num: frame the stage ran on
+        :param seconds: wall time taken
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            samples = self.samples.get(stage)
+            if samples is None:
+                samples = self.samples[stage] = array.array('f')
+            samples.append(seconds)
+        for hook in self.hooks:
+            hook(stage, frame_num, seconds)
+
+    def stage(self, stage, frame_num):
+        """
+        :return: context manager timing the code it wraps as one stage of one frame
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timed(stage, frame_num)
+
+    @contextlib.contextmanager
+    def _timed(self, stage, frame_num):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, frame_num, time.perf_counter() - start)
+
+    def summary(self, n_frames, seconds):
+        """
+        :param n_frames: number of frames processed
+        :param seconds: wall time of the whole run
+        :return: dict with total seconds, effective fps and count/total/mean/p50/p99 of every stage
+        """
+        stages = {}
+        with self.lock:
+            for stage, samples in self.samples.items():
+                times = np.frombuffer(samples, dtype=np.float32).astype(np.float64) * 1000
+                stages[stage] = {
+                    'count': len(times),
+                    'total_seconds': float(times.sum() / 1000),
+                    'mean_ms': float(times.mean()) if len(times) else 0.0,
+                    'p50_ms': float(np.percentile(times, 50)) if len(times) else 0.0,
+                    'p99_ms': float(np.percentile(times, 99)) if len(times) else 0.0,
+                }
+        return {
+            'frames': n_frames,
+            'seconds': seconds,
+            'fps': n_frames / seconds if seconds > 0 else 0.0,
+            'stages': stages,
+        }
+
+    def write_report(self, report_path, n_frames, seconds, **run_info):
+        """
+        Writes the summary as JSON
+        :param report_path: path of the JSON file
+        :param n_frames: number of frames processed
+        :param seconds: wall time of the whole run
+        :param run_info: extra settings of the run to store alongside the timings, e.g. tracker type
+        :return: the summary dict
+        """
+        report = dict(run_info, **self.summary(n_frames, seconds))
+        with open(report_path, 'w') as fh:
+            json.dump(report, fh, indent=2)
+        return report
+
+
+class LatencyMonitor:
+    """
+    End-to-end latency, from capture to results written, and dropped frames of a live run, with throttled status
+    lines so researchers see how tracking keeps up during a session
+    """
+    def __init__(self, budget, interval=5.0):
+        """
+        :param budget: seconds a frame may take from capture to results written
+        :param interval: minimum seconds between status lines, None to never print
+        """
+        self.budget = budget
+        self.interval = interval
+        self.latencies = array.array('f')
+        self.stale = 0
+        self.start = time.monotonic()
+        self.last_report = self.start
+
+    def record(self, latency):
+        """
+        :param latency: seconds from capture of a processed frame to its results being written
+        """
+        self.latencies.append(latency)
+
+    def drop_stale(self):
+        """
+        Counts a frame dropped because it was already older than the budget when the tracker got to it
+        """
+        self.stale += 1
+
+    def update(self, captured, skipped):
+        """
+        Prints a status line if the interval has passed since the last one
+        :param captured: frames the source delivered so far
+        :param skipped: frames replaced by newer ones before the tracker got to them
+        """
+        if self.interval is None:
+            return
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            recent = np.frombuffer(self.latencies, dtype=np.float32)[-100:] * 1000
+            elapsed = now - self.start
+            print('Live: {0} frames, {1:.1f} fps, latency p50 {2:.0f} ms, {3:.0%} dropped'.format(
+                len(self.latencies), len(self.latencies) / elapsed if elapsed > 0 else 0.0,
+                float(np.median(recent)) if len(recent) else 0.0,
+                (skipped + self.stale) / captured if captured > 0 else 0.0))
+
+    def summary(self, captured, skipped):
+        """
+        :param captured: frames the source delivered
+        :param skipped: frames replaced by newer ones before the tracker got to them
+        :return: dict of frame counts, drop rate and mean/p50/p99/max latency
+        """
+        latencies = np.frombuffer(self.latencies, dtype=np.float32).astype(np.float64) * 1000
+        seconds = time.monotonic() - self.start
+        return {
+            'budget_ms': self.budget * 1000,
+            'seconds': seconds,
+            'frames_captured': captured,
+            'frames_processed': len(latencies),
+            'frames_skipped': skipped,
+            'frames_stale': self.stale,
+            'drop_rate': (skipped + self.stale) / captured if captured > 0 else 0.0,
+            'fps': len(latencies) / seconds if seconds > 0 else 0.0,
+            'over_budget': int((latencies > self.budget * 1000).sum()),
+            'mean_ms': float(latencies.mean()) if len(latencies) else 0.0,
+            'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+            'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+            'max_ms': float(latencies.max()) if len(latencies) else 0.0,
+        }
@@ -0,0 +1,144 @@
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+
+import cv2
+
+# keyframe indexes already loaded in this process, keyed by video_key
+index_cache = {}
+
+
+def video_key(video_path):
+    """
+    :param video_path: path of a video file
+    :return: string identifying this version of the file, changes if the file is replaced or modified
+    """
+    stat = os.stat(video_path)
+    return '{}:{}:{}'.format(os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns)
+
+
+def build_keyframe_index(video_path, fps):
+    """
+    Lists the frame numbers of keyframes using ffprobe, which only reads packet headers and decodes nothing
+    :param video_path: path of a video file
+    :param fps: frame rate of the video, used to turn packet timestamps into frame numbers
+    :return: sorted list of keyframe numbers, or None if ffprobe is not available or fails
+    """
+    if shutil.which('ffprobe') is None or fps <= 0:
+        return None
+
+    base_cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-of', 'csv=p=0']
+    stream = subprocess.run(base_cmd + ['-show_entries', 'stream=start_time', video_path],
+                            capture_output=True, text=True)
+    packets = subprocess.run(base_cmd + ['-show_entries', 'packet=pts_time,flags', video_path],
+                             capture_output=True, text=True)
+    if stream.returncode != 0 or packets.returncode != 0:
+        return None
+
+    try:
+        start_time = float(stream.stdout.strip().split(',')[0])
+    except ValueError:
+        start_time = 0.0
+
+    keyframes = set()
+    for line in packets.stdout.splitlines():
+        fields = line.split(',')
+        if len(fields) < 2 or 'K' not in fields[1]:
+            continue
+        try:
+            keyframes.add(int(round((float(fields[0]) - start_time) * fps)))
+        except ValueError:
+            # packets without a timestamp can't be seeked to
+            continue
+    return sorted(keyframes) or None
+
+
+def load_keyframe_index(video_path, fps, cache_dir='./cache/keyframes'):
+    """
+    Gets the keyframe index of a video from memory, then the on-disk cache, building and caching it otherwise
+    :param video_path: path of a video file
+    :param fps: frame rate of the video
+    :param cache_dir: directory keyframe indexes are cached in, None to only cache in memory
+    :return: sorted list of keyframe numbers, or None if no index could be built
+    """
+    key = video_key(video_path)
+    if key in index_cache:
+        return index_cache[key]
+
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r') as fh:
+                keyframes = json.load(fh)['keyframes']
+            index_cache[key] = keyframes
+            return keyframes
+
+    keyframes = build_keyframe_index(video_path, fps)
+    index_cache[key] = keyframes
+    if keyframes is not None and cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, 'w') as fh:
+            json.dump({'video': key, 'fps': fps, 'keyframes': keyframes}, fh)
+    return keyframes
+
+
+class VideoSeeker:
+    """
+    Frame-accurate seeking on an OpenCV video capture: jumps to the nearest keyframe before the target and decodes
+    forward from there, instead of decoding the video from the current position
+    """
+    def __init__(self, cap, video_path, fps, cache_dir='./cache/keyframes', max_forward_decode=300):
+        """
+        :param cap: OpenCV Cap object of the video
+        :param video_path: path of the video, used to build or look up its keyframe index
+        :param fps: frame rate of the video
+        :param cache_dir: directory keyframe indexes are cached in, None to only cache in memory
+        :param max_forward_decode: without a keyframe index, targets at most this many frames ahead of the current
+        position are reached by decoding forward rather than by asking the backend to seek
+        """
+        self.cap = cap
+        self.max_forward_decode = max_forward_decode
+        self.keyframes = load_keyframe_index(video_path, fps, cache_dir)
+
+    def position(self):
+        """
+        :return: number of the frame the next read returns
+        """
+        return int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+
+    def seek(self, frame_number):
+        """
+        Positions the capture so the next read returns the given frame
+        :param frame_number: 0-based frame number
+        """
+        frame_number = max(int(frame_number), 0)
+        current = self.position()
+
+        if self.keyframes:
+            keyframe = self.keyframes[max(bisect.bisect_right(self.keyframes, frame_number) - 1, 0)]
+            keyframe = min(keyframe, frame_number)
+            # decoding on from the current position is never more work than from the keyframe before the target
+            if not keyframe <= current <= frame_number:
+                current = self._set_position(keyframe)
+        elif not 0 <= frame_number - current <= self.max_forward_decode:
+            # the backend seeks to a keyframe and decodes forward itself, trust it only if it lands on the frame
+            current = self._set_position(frame_number)
+
+        for i in range(frame_number - current):
+            if not self.cap.grab():
+                break
+
+    def _set_position(self, frame_number):
+        """
+        Asks the backend to seek, falling back to the start of the video if it does not land on the frame
+        :return: the position the capture ended up at
+        """
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        if self.position() == frame_number:
+            return frame_number
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        return self.position()
@@ -1,30 +1,225 @@
+import os
+import time
+from dataclasses import dataclass, fields
+from typing import Any
+
 import cv2
+import numpy as np
 from random import randint
 
 import scan
 import BraillePage
+import CalibrationCache
+import CellRaster
+import ChunkTracker
+import ColorMasking
+import FingerTracking
+import FramePipeline
+import PageRegistry
+import PageTracker
+import TrackingOutput
+import TrackingStats
+import VideoSeeker
+
+
+@dataclass
+class TrackingSettings:
+    """
+    How the fingers are tracked
+    :param tracker_type: type of OpenCV tracker to use, CSRT seems to work the best so far and is default. HYBRID
+    runs fast_tracker_type every frame and re-anchors each finger with CSRT. COLOR detects colored fingertip
+    markers in every frame instead, and needs no bounding box calibration
+    :param tracking_scale: Factor frames are downscaled by before tracking, e.g. 0.5 tracks at 960x540. Boxes are
+    mapped back to full resolution before coordinates and letters are computed
+    :param crop_to_page: If True, the tracker only sees the page's bounding rectangle found at calibration (grown
+    to hold the calibration boxes) instead of the whole frame
+    :param crop_margin: Pixels added around the page when crop_to_page is set
+    :param pipelined: If True, decoding and video encoding run in their own threads alongside the tracker
+    :param fast_tracker_type: tracker run every frame in HYBRID mode, e.g. KCF. MOSSE is faster on its own but
+    loses the fingers so often that re-anchoring them makes HYBRID slower
+    :param anchor_interval: in HYBRID mode, each finger is re-anchored with CSRT at least every this many frames
+    :param anchor_confidence: in HYBRID mode, a finger is also re-anchored as soon as the correlation between its
+    box and its appearance at the last anchor drops below this
+    :param marker_colors: in COLOR mode, (hue in degrees, saturation %, value %) of the marker on each finger,
+    defaults to ColorMasking.default_marker_colors
+    :param marker_delta_h: in COLOR mode, hue tolerance of the markers in OpenCV units (0-180)
+    :param marker_delta_s: in COLOR mode, saturation and value tolerance of the markers in OpenCV units (0-255)
+    """
+    tracker_type: str = 'CSRT'
+    tracking_scale: float = 1.0
+    crop_to_page: bool = False
+    crop_margin: int = 100
+    pipelined: bool = False
+    fast_tracker_type: str = 'KCF'
+    anchor_interval: int = 15
+    anchor_confidence: float = 0.5
+    marker_colors: Any = None
+    marker_delta_h: int = 10
+    marker_delta_s: int = 50
+
+
+@dataclass
+class CalibrationSettings:
+    """
+    How the page and the fingers are found before tracking starts
+    :param auto_calibrate: If True, will use pre-defined bounding boxes instead of manual
+    :param start_time: Time stamp (in seconds) of the calibration frame tracking starts from. Defaults to 0 for
+    auto_calibrate and COLOR, and for manual calibration to the frame boxes were drawn on in an earlier run, or 5
+    :param black_background: If True, page calibration casts the background to black before finding the page
+    :param show_calibration: If True, the detected page corners and warped page are displayed for checking
+    :param calibration_cache_dir: Directory the page transform and hand-drawn bounding boxes of each video are
+    cached in, keyed by the video's content, so later runs on the same video skip calibration. Cached boxes are
+    only used for manual calibration on the same frame. None disables the cache
+    :param recalibrate: If True, calibrates again even if the video has a cached calibration
+    :param track_page: If True, the page is followed from frame to frame (see PageTracker) and the page transform
+    updated on every frame, so letters stay right if the page or camera moves
+    :param page_registry: PageRegistry.PageRegistry, or path of its JSON file, mapping the QR codes printed on the
+    sheets to their pages. If set, the QR code is decoded every qr_interval frames and letters are looked up on
+    whichever page is in view
+    :param qr_interval: frames between QR decodes when page_registry is set
+    :param cell_raster: If True, letters are looked up in a raster of the cell under every camera pixel, built once
+    after calibration (see CellRaster), instead of computing the cell from page coordinates every frame
+    :param cell_edges_path: JSON file of cell edges measured on a calibration sheet (see
+    CellRaster.load_cell_edges) the raster is built from, uniform cells if None. Implies cell_raster
+    """
+    auto_calibrate: bool = False
+    start_time: Any = None
+    black_background: bool = True
+    show_calibration: bool = True
+    calibration_cache_dir: Any = './cache/calibration'
+    recalibrate: bool = False
+    track_page: bool = False
+    page_registry: Any = None
+    qr_interval: int = 30
+    cell_raster: bool = False
+    cell_edges_path: Any = None
+
+
+@dataclass
+class OutputSettings:
+    """
+    What is written while tracking
+    :param data_output_path: Path of the tab delimited coordinate and letter output file
+    :param output_format: 'tsv' for the tab delimited data_output_path, 'npy' for the binary track format written
+    next to it with a .npy extension (see TrackingOutput.load_tracks), or 'both'
+    :param flush_every: Number of frames of results buffered before they are appended to data_output_path
+    :param dwell_output_path: If set, the letters under each finger are also written here as dwell events, one
+    line per stay of a finger on a cell (see TrackingOutput.DwellEventWriter)
+    :param output_path: Path of output video, will create if does not exist
+    :param write_video: If True, the annotated video is written to output_path. Defaults to show_frame
+    :param progress_interval: Minimum seconds between progress lines while tracking, None for no progress lines
+    :param profile_path: If set, the wall time of every stage of the tracking loop (and of each finger's tracker)
+    is recorded per frame and a JSON summary with mean/p50/p99 per stage and effective fps is written here
+    :param profile_hooks: Callables hook(stage, frame_num, seconds) called with every stage timing, turns
+    profiling on even without profile_path
+    """
+    data_output_path: str = 'BrailleOutput.txt'
+    output_format: str = 'tsv'
+    flush_every: int = 100
+    dwell_output_path: Any = None
+    output_path: str = './test_output/output.mp4'
+    write_video: Any = None
+    progress_interval: Any = 5.0
+    profile_path: Any = None
+    profile_hooks: Any = ()
+
+
+@dataclass
+class ChunkSettings:
+    """
+    Splitting the video into chunks tracked in parallel
+    :param chunk_workers: If above 0, the video is split into chunks of chunk_seconds that are tracked by this many
+    processes at once and stitched together (see ChunkTracker.track_chunks), instead of tracked frame by frame.
+    Only the data outputs are written, and the page transform stays fixed. Chunks after the first start from the
+    fingertip markers of marker_colors; where not every marker is visible the chunk is tracked with the one before
+    it, and a video without markers is tracked in one pass as if chunk_workers were 0
+    :param chunk_seconds: length of the chunks when chunk_workers is set
+    :param chunk_overlap: seconds each chunk shares with the one before it, where the two are stitched
+    """
+    chunk_workers: int = 0
+    chunk_seconds: float = 300
+    chunk_overlap: float = 2.0
+
+
+# VideoTracker argument each settings group is passed as
+settings_groups = {'tracking': TrackingSettings, 'calibration': CalibrationSettings, 'output': OutputSettings,
+                   'chunking': ChunkSettings}
+
+
+def setting_names():
+    """
+    :return: names of every setting of every settings group
+    """
+    return [field.name for group in settings_groups.values() for field in fields(group)]
+
+
+def group_settings(settings):
+    """
+    Sorts flat settings, e.g. from a batch manifest, into the settings groups VideoTracker takes
+    :param settings: dict of setting name to value, each a field of one of the settings groups
+    :return: dict of VideoTracker argument to settings group, for VideoTracker(video, page, **group_settings(...))
+    """
+    unknown = sorted(set(settings) - set(setting_names()))
+    if unknown:
+        raise ValueError('Unknown settings {}'.format(unknown))
+    return {argument: group(**{field.name: settings[field.name] for field in fields(group) if field.name in settings})
+            for argument, group in settings_groups.items()}
 
 
 class VideoTracker:
     """Video Tracker Class"""
     trackerTypes = ['BOOSTING', 'MIL', 'KCF', 'TLD', 'MEDIANFLOW', 'GOTURN', 'MOSSE', 'CSRT']
-
-    def __init__(self, video_path, page_path, tracker_type="CSRT", auto_calibrate=False, output_path='./test_output/output.mp4',
-                 show_frame=False):
+    outputFormats = ['tsv', 'npy', 'both']
+    # fast tracker every frame, re-anchored by CSRT, see FingerTracking.HybridFingerTracker
+    hybridTrackerType = 'HYBRID'
+    # no trackers, fingertip markers are found by color every frame, see ColorMasking.ColorMarkerDetector
+    colorTrackerType = 'COLOR'
+
+    def __init__(self, video_path, page_path, tracking=None, calibration=None, output=None, chunking=None,
+                 show_frame=False, headless=False):
         """
         init video tracker
         :param video_path: Path of input video
-        :param page_path: Path of input Braille page being read
-        :param tracker_type: type of OpenCV tracker to use, CSRT seems to work the best so far and is default
-        :param auto_calibrate: If True, will use pre-defined bounding boxes instead of manual
-        :param output_path: Path of output video, will create if does not exist
+        :param page_path: Path of input Braille page being read, None to find the page from its QR code in
+        calibration.page_registry
+        :param tracking: TrackingSettings, defaults if None
+        :param calibration: CalibrationSettings, defaults if None
+        :param output: OutputSettings, defaults if None
+        :param chunking: ChunkSettings, defaults if None
         :param show_frame: If true, tracker displays the frame at each iteration
+        :param headless: If True, makes no OpenCV HighGUI calls at all (no windows, no waitKey), for servers without a
+        display. Calibration must then be automatic or cached
         """
+        tracking = tracking if tracking is not None else TrackingSettings()
+        calibration = calibration if calibration is not None else CalibrationSettings()
+        output = output if output is not None else OutputSettings()
+        chunking = chunking if chunking is not None else ChunkSettings()
+        start_time, page_registry = calibration.start_time, calibration.page_registry
+        show_calibration, write_video = calibration.show_calibration, output.write_video
+        if (calibration.cell_raster or calibration.cell_edges_path is not None) and calibration.track_page:
+            raise ValueError('cell_raster needs a fixed page transform and cannot be combined with track_page')
+        if write_video is None:
+            write_video = show_frame
+        if chunking.chunk_workers and (show_frame or write_video or calibration.track_page or
+                                       page_registry is not None):
+            raise ValueError('Chunked tracking only writes data outputs on a fixed page, and cannot be combined with '
+                             'show_frame, write_video, track_page or page_registry')
+        if headless:
+            show_calibration = False
+        self.setup_tracking(page_path, tracking, output, show_frame, headless)
+
         # Create a video capture object to read videos
         self.cap = cv2.VideoCapture(video_path)
 
-        # load in page of Braille
-        self.braille_page = BraillePage.BraillePage(page_path) 
+        # find the page being read from its QR code
+        self.page_detector = None
+        self.page_switches = []
+        if page_registry is not None:
+            if isinstance(page_registry, str):
+                page_registry = PageRegistry.PageRegistry.load(page_registry)
+            self.page_detector = PageRegistry.PageDetector(page_registry, calibration.qr_interval)
+        elif page_path is None:
+            raise ValueError('Either page_path or page_registry must be given')
 
         # video info
         self.vid_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -32,81 +227,277 @@ class VideoTracker:
         self.fps = int(self.cap.get(cv2.CAP_PROP_FPS))
         self.n_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
-        # Output info
-        self.output_path = output_path
+        # jumps to calibration frames through the nearest keyframe instead of decoding up to them
+        self.seeker = VideoSeeker.VideoSeeker(self.cap, video_path, self.cap.get(cv2.CAP_PROP_FPS))
+
+        self.chunk_workers = chunking.chunk_workers
+        self.chunk_seconds = chunking.chunk_seconds
+        self.chunk_overlap = chunking.chunk_overlap
+
+        # reuse the calibration from an earlier run on this video if there is one. Only boxes drawn by hand are
+        # cached, predefined boxes and color markers need no calibration
+        manual = not calibration.auto_calibrate and self.marker_detector is None
+        cached = None
+        if calibration.calibration_cache_dir is not None and not calibration.recalibrate:
+            cached = CalibrationCache.load_calibration(video_path, calibration.calibration_cache_dir)
+        has_cached_boxes = manual and cached is not None and cached.bboxes is not None
+        if start_time is None:
+            start_time = cached.second if has_cached_boxes else (5 if manual else 0)
 
         # Get page transform
-        self.transformation_metadata = scan.get_transform_video(video_path, (11.5625, 11))
+        if cached is not None:
+            print('Using cached page transform for {}'.format(video_path))
+            self.transformation_metadata = cached.transform_metadata
+        else:
+            # found on frames resized like the tracked ones, so the transform maps the same pixels
+            self.transformation_metadata = scan.get_transform_video(video_path, (11.5625, 11),
+                                                                    calibration.black_background,
+                                                                    show=show_calibration, allow_manual=not headless,
+                                                                    frame_size=(1920, 1080))
 
         # Calibration of boxes
-        if auto_calibrate:
+        drawn = False
+        if self.marker_detector is not None:
+            # markers are found by color every frame
+            bboxes, frame, colors = [], self.read_frame(start_time), self.marker_detector.draw_colors()
+        elif calibration.auto_calibrate:
             # use predefined bounding boxes
-            bboxes, frame, colors = self.automatic_calibration()
+            bboxes, frame, colors = self.automatic_calibration(start_time)
+        elif has_cached_boxes and cached.second == start_time:
+            # boxes drawn on this same frame before
+            print('Using the bounding boxes drawn on this video before at {}s instead of drawing them again, '
+                  'recalibrate to draw new ones: {}'.format(start_time, cached.bboxes))
+            bboxes, frame, colors = cached.bboxes, self.read_frame(start_time), cached.colors
+        elif headless:
+            raise Exception('Manual calibration needs a display, use auto_calibrate or calibrate this video once '
+                            'with a display to cache its bounding boxes')
         else:
             # manually draw bounding boxes
-            bboxes, frame, colors = self.manual_calibration()
+            bboxes, frame, colors = self.manual_calibration(start_time)
+            drawn = True
+
+        if calibration.calibration_cache_dir is not None and (cached is None or drawn):
+            CalibrationCache.save_calibration(video_path, self.transformation_metadata, bboxes if drawn else None,
+                                              colors, start_time, calibration.calibration_cache_dir)
+
+        # the tracker runs on cropped, downscaled frames, everything else in 1920x1080 pixels
+        roi = None
+        if tracking.crop_to_page:
+            roi = scan.page_roi(self.transformation_metadata, (1920, 1080), tracking.crop_margin, bboxes)
+            print('Tracking page region {} ({:.0%} of the frame)'.format(roi, roi[2] * roi[3] / (1920 * 1080)))
+        self.tracking_geometry = FramePipeline.TrackingGeometry((1920, 1080), tracking.tracking_scale, roi)
+
+        if self.page_detector is not None:
+            page = self.page_detector.update(frame)
+            if page is not None:
+                self.braille_page = page
+                self.page_switches.append((0, self.page_detector.payload))
+                print('Reading page {}'.format(self.page_detector.payload))
+            elif self.braille_page is None:
+                page_registry.close()
+                raise Exception('No registered QR code found on the calibration frame, give page_path instead')
+
+        # pixel to cell lookup image for this calibration
+        self.cell_raster = None
+        if calibration.cell_raster or calibration.cell_edges_path is not None:
+            row_edges, column_edges = None, None
+            if calibration.cell_edges_path is not None:
+                row_edges, column_edges = CellRaster.load_cell_edges(calibration.cell_edges_path)
+            self.cell_raster = CellRaster.CellRaster(self.transformation_metadata, (1920, 1080), row_edges,
+                                                     column_edges)
+
+        self.page_tracker = None
+        if calibration.track_page:
+            # the page is tracked from the calibration frame, so its reference transform has to be found on that frame
+            m, im_dims = scan.transform_image(frame, black_background=calibration.black_background, show=False)
+            if m is not None:
+                reference = scan.TransformMetadata(m, im_dims, self.transformation_metadata.desired_dimensions)
+            else:
+                print('Page not found on the calibration frame, tracking the page from the video transform')
+                reference = self.transformation_metadata
+            self.page_tracker = PageTracker.PageTracker(reference, frame, black_background=calibration.black_background)
+
+        # chunks are only tracked apart where they can start from the fingertip markers, otherwise in one pass here
+        chunks = None
+        if chunking.chunk_workers:
+            chunks = ChunkTracker.plan_chunks(video_path, int(start_time * self.fps), len(bboxes),
+                                              self.chunk_settings(tracking.tracker_type, tracking.tracking_scale),
+                                              max(int(self.chunk_seconds * self.fps), 1),
+                                              max(int(self.chunk_overlap * self.fps), 2))
+            if len(chunks) < 2:
+                print('No chunk of the video can start on its own, tracking it in one pass')
+                chunks = None
 
         # initialize multitracker object based on bounding boxes and selected tracker type
-        multi_tracker = self.init_multitracker(bboxes, tracker_type, frame)
+        multi_tracker = None
+        if chunks is None:
+            multi_tracker = self.init_multitracker(bboxes, tracking.tracker_type, frame)
 
-        # video saving format
-        output_format = cv2.VideoWriter_fourcc(*'mp4v')
+        video_out = None
+        if write_video:
+            # video saving format
+            video_format = cv2.VideoWriter_fourcc(*'mp4v')
 
-        # open and set properties
-        video_out = cv2.VideoWriter()
-        video_out.open(self.output_path, output_format, self.fps, (self.vid_width, self.vid_height), True)
+            # open and set properties
+            video_out = cv2.VideoWriter()
+            video_out.open(self.output_path, video_format, self.fps, (self.vid_width, self.vid_height), True)
 
         # run tracker and save video
-        print(self.process_tracker(self.cap, multi_tracker, colors, video_out, show_frame))
+        start = time.time()
+        run_info = {}
+        try:
+            if chunks is not None:
+                run_info['chunks'] = self.process_chunks(video_path, chunks, bboxes, tracking.tracker_type,
+                                                         tracking.tracking_scale)
+            else:
+                self.process_tracker(self.cap, multi_tracker, colors, video_out, show_frame, tracking.pipelined)
+        finally:
+            if video_out is not None:
+                video_out.release()
+        elapsed = time.time() - start
+        print('Tracked {0} frames at {1}x{2} (tracking scale {3}) in {4:.1f}s: {5:.1f} fps'.format(
+            self.frames_processed, self.tracking_geometry.track_size[0], self.tracking_geometry.track_size[1],
+            tracking.tracking_scale, elapsed, self.frames_processed / elapsed if elapsed > 0 else 0.0))
+        if self.page_detector is not None:
+            run_info['page_switches'] = self.page_switches
+        if self.page_tracker is not None:
+            run_info['page_recalibrations'] = self.page_tracker.recalibrations
+            print('Searched for the page again {0} times, {1} failed'.format(self.page_tracker.recalibrations,
+                                                                          self.page_tracker.failed_recalibrations))
+        if tracking.tracker_type == self.hybridTrackerType and multi_tracker is not None:
+            run_info['anchors'] = multi_tracker.anchor_summary()
+            print('Re-anchored {0} times ({1:.1%} of finger updates): {2} on interval, {3} on low confidence, '
+                  '{4} on lost tracks, {5} failed'.format(
+                      run_info['anchors']['total'], run_info['anchors']['rate'], run_info['anchors']['interval'],
+                      run_info['anchors']['confidence'], run_info['anchors']['lost'], run_info['anchors']['failed']))
+
+        if output.profile_path is not None:
+            report = self.profiler.write_report(output.profile_path, self.frames_processed, elapsed, video=video_path,
+                                                tracker_type=tracking.tracker_type,
+                                                tracking_scale=tracking.tracking_scale,
+                                                track_size=self.tracking_geometry.track_size,
+                                                pipelined=tracking.pipelined, **run_info)
+            for stage, stats in report['stages'].items():
+                print('{0:>14}: mean {1:.2f} ms, p50 {2:.2f} ms, p99 {3:.2f} ms'.format(
+                    stage, stats['mean_ms'], stats['p50_ms'], stats['p99_ms']))
+
+    def setup_tracking(self, page_path, tracking, output, show_frame, headless):
+        """
+        Checks the settings and sets up the page, tracker options and outputs, shared by every kind of tracker
+        :param page_path: Path of input Braille page being read, None if it is found from a QR code later
+        :param tracking: TrackingSettings
+        :param output: OutputSettings
+        :param show_frame: If true, tracker displays the frame at each iteration
+        :param headless: If True, makes no OpenCV HighGUI calls at all
+        """
+        if output.output_format not in self.outputFormats:
+            raise ValueError('Unknown output format {}, available formats are {}'.format(output.output_format,
+                                                                                         self.outputFormats))
+        if tracking.tracker_type not in self.trackerTypes + [self.hybridTrackerType, self.colorTrackerType]:
+            raise ValueError('Unknown tracker type {}, available types are {}'.format(
+                tracking.tracker_type, self.trackerTypes + [self.hybridTrackerType, self.colorTrackerType]))
+        if tracking.tracker_type == self.hybridTrackerType and tracking.fast_tracker_type not in self.trackerTypes:
+            raise ValueError('Unknown fast tracker type {}, available types are {}'.format(
+                tracking.fast_tracker_type, self.trackerTypes))
+        if headless and show_frame:
+            raise ValueError('show_frame needs a display and cannot be used in headless mode')
+        self.progress_interval = output.progress_interval
+        self.profiler = TrackingStats.StageProfiler(output.profile_path is not None or len(output.profile_hooks) > 0,
+                                                    output.profile_hooks)
+        self.fast_tracker_type = tracking.fast_tracker_type
+        self.anchor_interval = tracking.anchor_interval
+        self.anchor_confidence = tracking.anchor_confidence
+        self.marker_colors = tracking.marker_colors
+        self.marker_delta_h = tracking.marker_delta_h
+        self.marker_delta_s = tracking.marker_delta_s
+        self.marker_detector = None
+        if tracking.tracker_type == self.colorTrackerType:
+            self.marker_detector = ColorMasking.ColorMarkerDetector(tracking.marker_colors, tracking.marker_delta_h,
+                                                                    tracking.marker_delta_s)
+
+        # load in page of Braille
+        self.braille_page = BraillePage.BraillePage(page_path) if page_path is not None else None
+
+        # Output info
+        self.output_path = output.output_path
+        self.data_output_path = output.data_output_path
+        self.track_output_path = os.path.splitext(output.data_output_path)[0] + '.npy'
+        self.dwell_output_path = output.dwell_output_path
+        self.output_format = output.output_format
+        self.flush_every = output.flush_every
+        self.frames_processed = 0
 
     def init_multitracker(self, bboxes, tracker_type, frame):
         """
         Init an Opencv tracker instance, given a set of bounding boxes (e.g. one for each finger), and type
-        :param bboxes: Bounding boxes
+        :param bboxes: Bounding boxes, in full resolution pixels
         :param tracker_type: E.g. CSRT
         :param frame: First frame, used for init
-        :return: multitracker instance
+        :return: multitracker instance, tracking in self.tracking_geometry's downscaled frames
         """
-        # Create MultiTracker object
-        multi_tracker = cv2.MultiTracker_create()
+        # Create MultiTracker object, one tracker per finger so each can be profiled
+        profiler = self.profiler if self.profiler.enabled else None
+        if tracker_type == self.colorTrackerType:
+            # nothing to initialize, the detector finds every finger in every frame
+            return self.marker_detector
+        if tracker_type == self.hybridTrackerType:
+            multi_tracker = FingerTracking.HybridFingerTracker(
+                lambda: self.create_tracker_by_name(self.fast_tracker_type), self.anchor_interval,
+                self.anchor_confidence, profiler)
+            # CSRT only re-anchors the fast trackers
+            tracker_type = 'CSRT'
+        else:
+            multi_tracker = FingerTracking.MultiFingerTracker(profiler)
 
         # Initialize MultiTracker
-        for bbox in bboxes:
-            multi_tracker.add(self.create_tracker_by_name(tracker_type), frame, bbox)
+        track_frame = self.tracking_geometry.prepare(frame)
+        for bbox in self.tracking_geometry.to_track(bboxes):
+            multi_tracker.add(self.create_tracker_by_name(tracker_type), track_frame, bbox)
         return multi_tracker
 
-    def create_tracker_by_name(self, tracker_type):
+    @classmethod
+    def create_tracker_by_name(cls, tracker_type):
         """
         Given input string, init the correct tracker
         :param tracker_type: e.g. 'CSRT'
         :return:
         """
         # Create a tracker based on tracker name
-        if tracker_type == self.trackerTypes[0]:
-            tracker = cv2.TrackerBoosting_create()
-        elif tracker_type == self.trackerTypes[1]:
-            tracker = cv2.TrackerMIL_create()
-        elif tracker_type == self.trackerTypes[2]:
-            tracker = cv2.TrackerKCF_create()
-        elif tracker_type == self.trackerTypes[3]:
-            tracker = cv2.TrackerTLD_create()
-        elif tracker_type == self.trackerTypes[4]:
-            tracker = cv2.TrackerMedianFlow_create()
-        elif tracker_type == self.trackerTypes[5]:
-            tracker = cv2.TrackerGOTURN_create()
-        elif tracker_type == self.trackerTypes[6]:
-            tracker = cv2.TrackerMOSSE_create()
-        elif tracker_type == self.trackerTypes[7]:
-            tracker = cv2.TrackerCSRT_create()
+        if tracker_type == cls.trackerTypes[0]:
+            tracker = cls.create_opencv_tracker('TrackerBoosting_create')
+        elif tracker_type == cls.trackerTypes[1]:
+            tracker = cls.create_opencv_tracker('TrackerMIL_create')
+        elif tracker_type == cls.trackerTypes[2]:
+            tracker = cls.create_opencv_tracker('TrackerKCF_create')
+        elif tracker_type == cls.trackerTypes[3]:
+            tracker = cls.create_opencv_tracker('TrackerTLD_create')
+        elif tracker_type == cls.trackerTypes[4]:
+            tracker = cls.create_opencv_tracker('TrackerMedianFlow_create')
+        elif tracker_type == cls.trackerTypes[5]:
+            tracker = cls.create_opencv_tracker('TrackerGOTURN_create')
+        elif tracker_type == cls.trackerTypes[6]:
+            tracker = cls.create_opencv_tracker('TrackerMOSSE_create')
+        elif tracker_type == cls.trackerTypes[7]:
+            tracker = cls.create_opencv_tracker('TrackerCSRT_create')
         else:
             tracker = None
             print('Incorrect tracker name')
             print('Available trackers are:')
-            for t in self.trackerTypes:
+            for t in cls.trackerTypes:
                 print(t)
 
         return tracker
 
+    @staticmethod
+    def create_opencv_tracker(factory_name):
+        """
+        :param factory_name: name of an OpenCV tracker factory, e.g. 'TrackerMOSSE_create'
+        :return: new tracker, from cv2.legacy if this OpenCV version moved it there (4.5.1 and later)
+        """
+        if not hasattr(cv2, factory_name) and hasattr(cv2, 'legacy') and hasattr(cv2.legacy, factory_name):
+            return getattr(cv2.legacy, factory_name)()
+        return getattr(cv2, factory_name)()
+
     def read_frame(self, second):
         """
         Reads frame at given time stamp of video
@@ -114,13 +505,8 @@ class VideoTracker:
         :return: the frame at the input time stamp
         """
         # Read frame
-        if second == 0:
-            success, frame = self.cap.read()
-        else:
-            frame_count = int(second * self.fps)
-            for i in range(frame_count):
-                self.cap.grab()
-            success, frame = self.cap.retrieve()
+        self.seeker.seek(int(second * self.fps))
+        success, frame = self.cap.read()
 
         try:
             frame = cv2.resize(frame, (1920, 1080))
@@ -138,12 +524,13 @@ class VideoTracker:
 
         return frame
 
-    def manual_calibration(self):
+    def manual_calibration(self, second=5):
         """
         Manually draw bounding boxes
+        :param second: time stamp (in seconds) of the frame boxes are drawn on
         :return: bounding boxes, first frame, color of each box
         """
-        frame = self.read_frame(5)
+        frame = self.read_frame(second)
 
         # Select boxes
         bboxes = []
@@ -170,9 +557,10 @@ class VideoTracker:
         print('Selected bounding boxes {}'.format(bboxes))
         return bboxes, frame, colors
 
-    def automatic_calibration(self):
+    def automatic_calibration(self, second=0):
         """
         Draw bounding boxes from predefined coordinates
+        :param second: time stamp (in seconds) of the frame the boxes are placed on
         :return: bounding boxes, first frame, color of each box
         """
         defined_calibration_pts = [(371, 887, 77, 68),
@@ -183,7 +571,7 @@ class VideoTracker:
                                    (1100, 981, 98, 66),
                                    (1248, 983, 101, 63),
                                    (1359, 881, 94, 60)]
-        frame = self.read_frame(0)
+        frame = self.read_frame(second)
 
         # Select boxes
         bboxes = []
@@ -196,127 +584,181 @@ class VideoTracker:
 
         return bboxes, frame, colors
 
-    def generate_output_file(self, x_centers, y_centers, letters):
+    def open_outputs(self):
         """
-        Generates tab delimited output file
-        :param x_centers: list of center of each box, x coord
-        :param y_centers: list of center of each box, y coord
-        :param letters: list of the letter on the Braille page corresponding to the input x and y coords
-        :return:
+        Opens the result writers selected by output_format
+        :return: list of writers, each taking one frame of results at a time through write_frame
         """
-        with open('BrailleOutput.txt', 'w+') as outfile:
-            outfile.write('Frame\tX1'
-                          '\tY1'
-                          '\tX2'
-                          '\tY2'
-                          '\tX3'
-                          '\tY3'
-                          '\tX4'
-                          '\tY4'
-                          '\tX5'
-                          '\tY5'
-                          '\tX6'
-                          '\tY6'
-                          '\tX7'
-                          '\tY7'
-                          '\tX8'
-                          '\tY8'
-                          '\tL1'
-                          '\tL2'
-                          '\tL3'
-                          '\tL4'
-                          '\tL5'
-                          '\tL6'
-                          '\tL7'
-                          '\tL8\n')
-
-            for i in range(len(x_centers)):
-                # formatting a single line containing coords X1, Y1 through X8, Y8
-                frame_str = str(i) + '\t' + "\t".join(["{0}\t{1}".format(x, y) for x, y in zip(x_centers[i], y_centers[i])])
-
-                # adding the associated letters to frame_str
-                letter_str = '\t' + "\t".join(["{0}".format(letter) for letter in letters[i]])
-                frame_str += letter_str
-
-                # for box in range(8):
-                #     if box != 7:
-                #         row_data += str(x_centers[i][box]) + '\t' + str(y_centers[i][box]) + '\t'
-                #     else:
-                #         row_data += str(x_centers[8][box]) + '\t' + str(y_centers[8][box])
-                outfile.write(frame_str + '\n')
-        return x_centers, y_centers, letters
-
-    def process_tracker(self, cap, multi_tracker, colors, video_out, show_frame=False):
+        outputs = []
+        if self.output_format in ('tsv', 'both'):
+            outputs.append(TrackingOutput.TsvOutputWriter(self.data_output_path, flush_every=self.flush_every))
+            print('Writing results to {}'.format(self.data_output_path))
+        if self.output_format in ('npy', 'both'):
+            outputs.append(TrackingOutput.NpyTrackWriter(self.track_output_path, flush_every=self.flush_every))
+            print('Writing tracks to {}'.format(self.track_output_path))
+        if self.dwell_output_path is not None:
+            outputs.append(TrackingOutput.DwellEventWriter(self.dwell_output_path, flush_every=self.flush_every))
+            print('Writing dwell events to {}'.format(self.dwell_output_path))
+        return outputs
+
+    def chunk_settings(self, tracker_type, tracking_scale):
+        """
+        :param tracker_type: E.g. CSRT
+        :param tracking_scale: factor frames are downscaled by before tracking
+        :return: settings the chunks are tracked with, see ChunkTracker.track_chunks
+        """
+        return {'tracker_type': tracker_type, 'tracking_scale': tracking_scale, 'roi': self.tracking_geometry.roi,
+                'fast_tracker_type': self.fast_tracker_type, 'anchor_interval': self.anchor_interval,
+                'anchor_confidence': self.anchor_confidence, 'marker_colors': self.marker_colors,
+                'marker_delta_h': self.marker_delta_h, 'marker_delta_s': self.marker_delta_s}
+
+    def process_chunks(self, video_path, chunks, bboxes, tracker_type, tracking_scale):
+        """
+        Tracks the video in chunks on several processes (see ChunkTracker.track_chunks), looking up and writing the
+        results of the frames of every chunk as it is stitched. Frames are numbered as in process_tracker.
+        :param video_path: path of the video
+        :param chunks: chunks from ChunkTracker.plan_chunks, starting on the calibration frame
+        :param bboxes: bounding boxes on the calibration frame, in full resolution pixels
+        :param tracker_type: E.g. CSRT
+        :param tracking_scale: factor frames are downscaled by before tracking
+        :return: dict describing the chunked run
+        """
+        outputs = self.open_outputs()
+        self.frames_processed = 0
+        try:
+            settings = self.chunk_settings(tracker_type, tracking_scale)
+            return ChunkTracker.track_chunks(video_path, chunks, bboxes, settings,
+                                             lambda boxes: self.write_boxes(outputs, boxes), self.chunk_workers)
+        finally:
+            for output in outputs:
+                output.close()
+
+    def write_boxes(self, outputs, boxes):
+        """
+        Looks up and writes the results of consecutive frames tracked elsewhere
+        :param outputs: writers from open_outputs
+        :param boxes: (frames, fingers, 4) boxes of the frames after the last one written, in full resolution pixels
+        """
+        for start in range(0, len(boxes), self.flush_every):
+            # every frame of a batch is transformed and looked up with one call
+            batch = boxes[start:start + self.flush_every].astype(np.float64)
+            pixel_centers = batch[:, :, :2] + batch[:, :, 2:] / 2
+            page_centers = scan.transform_points(pixel_centers, self.transformation_metadata)
+            if self.cell_raster is not None:
+                codes, rows, columns = self.cell_raster.positions2Chars(self.braille_page, pixel_centers[:, :, 0],
+                                                                        pixel_centers[:, :, 1])
+            else:
+                codes, rows, columns = self.braille_page.positions2Chars(page_centers[:, :, 0], page_centers[:, :, 1])
+            for i in range(len(batch)):
+                for output in outputs:
+                    output.write_frame(self.frames_processed, page_centers[i, :, 0], page_centers[i, :, 1], codes[i],
+                                       rows[i], columns[i])
+                self.frames_processed += 1
+
+    def process_tracker(self, cap, multi_tracker, colors, video_out, show_frame=False, pipelined=False):
         """
         Given captured video & tracker object, track objects and output video + coordinates
         :param cap: OpenCV Cap object representing video stream
         :param multi_tracker: OpenCV tracker object
         :param colors: Colors of each bounding box
-        :param video_out: Output video path
+        :param video_out: opened cv2.VideoWriter the annotated video is written to, None to not write a video
         :param show_frame: If True, program updates the frame during processing
-        :return:
+        :param pipelined: If True, a reader thread decodes and resizes frames ahead into a bounded queue and a
+        writer thread annotates and encodes the output video, so only tracking runs on this thread
+        :return: number of frames processed
         """
-        # Initialize Coordinate List and Associated Letter List
-        x_centers = []
-        y_centers = []
-        letters = []
+        # results are streamed to the output files as they are produced
+        outputs = self.open_outputs()
         frame_num = 0
+        progress = TrackingStats.ProgressReporter(self.n_frames - int(cap.get(cv2.CAP_PROP_POS_FRAMES)),
+                                                  self.progress_interval)
+        profiler = self.profiler
+        timing = profiler if profiler.enabled else None
+
+        # set up the decode and encode stages
+        writer = None
+        if pipelined:
+            frames = FramePipeline.FrameReader(cap, self.tracking_geometry, profiler=timing)
+            frames.start()
+            if video_out is not None:
+                writer = FramePipeline.FrameWriter(video_out, colors, profiler=timing)
+                writer.start()
+        else:
+            frames = FramePipeline.read_frames(cap, self.tracking_geometry, timing)
 
-        # Process video and track objects
-        while cap.isOpened():
-            print("Processing frame: {0}".format(frame_num))
-
-            success, frame = cap.read()
-            if not success:
-                break
-
-            try:
-                if not success:
-                    break
-                frame = cv2.resize(frame, (1920, 1080))
-            except Exception("Frame read failure"):
-                break
-
-            # get updated location of objects in subsequent frames
-            success, boxes = multi_tracker.update(frame)
-
-            x_centers_per_frame = [0] * 8
-            y_centers_per_frame = [0] * 8
-            letters_per_frame = [0] * 8
-
-            # draw tracked objects
-            for i, newbox in enumerate(boxes):
-                p1 = (int(newbox[0]), int(newbox[1]))
-                p2 = (int(newbox[0] + newbox[2]), int(newbox[1] + newbox[3]))
-                cv2.rectangle(frame, p1, p2, colors[i], 2, 1)
-
-                x_center_pixel = boxes[i][0] + boxes[i][2] / 2
-                y_center_pixel = boxes[i][1] + boxes[i][3] / 2
-
-                x_centers_per_frame[i], y_centers_per_frame[i] = scan.transform_point((x_center_pixel, y_center_pixel), self.transformation_metadata)
-                letters_per_frame[i] = self.braille_page.position2Char(x_centers_per_frame[i], y_centers_per_frame[i])
-                #x_centers_per_frame[i] = x_center_pixel
-                #y_centers_per_frame[i] = y_center_pixel
-
-            # add coordinates from this frame to overall coordinate list
-            x_centers.append(x_centers_per_frame)
-            y_centers.append(y_centers_per_frame)
-            letters.append(letters_per_frame)
-            frame_num += 1
-            #print(x_centers, y_centers)
-
-            # show frame
-            if show_frame:
-                cv2.imshow('MultiTracker', frame)
-                video_out.write(frame)
-
-            # quit on ESC button
-            if cv2.waitKey(1) & 0xFF == 27:  # Esc pressed
-                break
-
-        x_centers, y_centers, letters = self.generate_output_file(x_centers, y_centers, letters)
-        return x_centers, y_centers, letters
-
+        try:
+            # Process video and track objects
+            for frame, track_frame in frames:
+                # get updated location of objects in subsequent frames, mapped back to full resolution
+                with profiler.stage('track', frame_num):
+                    success, track_boxes = multi_tracker.update(track_frame)
+                boxes = self.tracking_geometry.to_frame(track_boxes)
+
+                # switch pages when the QR code in view changes
+                if self.page_detector is not None:
+                    with profiler.stage('qr', frame_num):
+                        page = self.page_detector.update(frame)
+                    if page is not None:
+                        self.braille_page = page
+                        self.page_switches.append((frame_num, self.page_detector.payload))
+                        print('Frame {0}: reading page {1}'.format(frame_num, self.page_detector.payload))
+
+                # follow the page if it moved
+                if self.page_tracker is not None:
+                    with profiler.stage('page', frame_num):
+                        self.transformation_metadata = self.page_tracker.update(frame)
+
+                # transform every box center into page coordinates with one call
+                with profiler.stage('transform', frame_num):
+                    pixel_centers = boxes[:, :2] + boxes[:, 2:] / 2
+                    page_centers = scan.transform_points(pixel_centers, self.transformation_metadata)
+
+                with profiler.stage('lookup', frame_num):
+                    if self.cell_raster is not None:
+                        codes, rows, columns = self.cell_raster.positions2Chars(self.braille_page, pixel_centers[:, 0],
+                                                                                pixel_centers[:, 1])
+                    else:
+                        codes, rows, columns = self.braille_page.positions2Chars(page_centers[:, 0],
+                                                                                 page_centers[:, 1])
+
+                # append coordinates and letters from this frame to the output files
+                with profiler.stage('output', frame_num):
+                    for output in outputs:
+                        output.write_frame(frame_num, page_centers[:, 0], page_centers[:, 1], codes, rows, columns)
+
+                # draw tracked objects and write the output video
+                if writer is not None:
+                    # the writer stage annotates its own frame, so preview a copy
+                    annotated = FramePipeline.draw_boxes(frame.copy(), boxes, colors) if show_frame else None
+                    writer.write(frame, boxes)
+                elif video_out is not None or show_frame:
+                    with profiler.stage('draw', frame_num):
+                        annotated = FramePipeline.draw_boxes(frame, boxes, colors)
+                    if video_out is not None:
+                        with profiler.stage('encode', frame_num):
+                            video_out.write(annotated)
+                frame_num += 1
+                progress.update(frame_num)
+
+                # show frame, quit on ESC button
+                if show_frame:
+                    cv2.imshow('MultiTracker', annotated)
+                    if cv2.waitKey(1) & 0xFF == 27:  # Esc pressed
+                        break
+        finally:
+            if pipelined:
+                frames.stop()
+            if writer is not None:
+                writer.close()
+            for output in outputs:
+                output.close()
+            # the BRF files of the pages read, the parsed pages stay cached
+            if self.page_detector is not None:
+                self.page_detector.registry.close()
+        self.frames_processed = frame_num
+        return frame_num
 
 if __name__ == '__main__':
-    tracker = VideoTracker("./test_images/test_1.mp4", './braille_files/B_2019 project FingerTracker.brf', auto_calibrate=False, show_frame=True, tracker_type="CSRT")
+    tracker = VideoTracker("./test_images/test_1.mp4", './braille_files/B_2019 project FingerTracker.brf',
+                           TrackingSettings(tracker_type="CSRT"), CalibrationSettings(auto_calibrate=False),
+                           show_frame=True)
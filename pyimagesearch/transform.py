@@ -32,7 +32,6 @@ def four_point_transform(image, pts):
     # individually
     rect = order_points(pts)
     (tl, tr, br, bl) = rect
-    print(tl)
 
     # compute the width of the new image, which will be the
     # maximum distance between bottom-right and bottom-left
@@ -60,7 +59,6 @@ def four_point_transform(image, pts):
         [0, maxHeight - 1]], dtype="float32")
 
     # compute the perspective transform matrix and then apply it
-    print("width: {} height: {}".format(maxWidth, maxHeight))
     M = cv2.getPerspectiveTransform(rect, dst)
     warped = cv2.warpPerspective(image, M, (maxWidth, maxHeight))
     dims = (maxWidth, maxHeight)
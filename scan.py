@@ -3,6 +3,7 @@
 
 # import the necessary packages
 from dataclasses import dataclass
+from functools import cached_property
 from typing import Any
 
 from pyimagesearch.transform import four_point_transform
@@ -11,6 +12,8 @@ import cv2
 import imutils
 import numpy as np
 
+import VideoSeeker
+
 screenCnt = []
 
 def click(event, x, y, flag, image):
@@ -20,16 +23,20 @@ def click(event, x, y, flag, image):
         screenCnt.append(coords)
 
 # NOTE: no idea what paper_dims is for
-def transform_image(image, paper_dims=(825, 1100), output_image="scannedImage.jpg", black_background=True, automatic=True):
+def transform_image(image, paper_dims=(825, 1100), output_image="scannedImage.jpg", black_background=True, automatic=True,
+                    show=True):
     """
     :param image: image frame
     :param paper_dims: dimensions of paper (in pixels) to scale scanned image to
     :param output_image: name of file to write new image to
     :param black_background: if True, will perform page calibration by casting background to black 
     :param automatic: if True, will perform page calibration automatically
+    :param show: if True, displays the detected corners and warped page for checking
     :return: returns transformation matrix
     """
     global screenCnt
+    # forget corners found in a previous call
+    screenCnt = []
 
     # preserve original image
     orig = image.copy()
@@ -73,8 +80,6 @@ def transform_image(image, paper_dims=(825, 1100), output_image="scannedImage.jp
             # approximate the contour
             peri = cv2.arcLength(c, True)
             approx = cv2.approxPolyDP(c, 0.02 * peri, True)
-            print(approx)
-            print(len(approx))
 
             # if our approximated contour has four points, then we can assume that we have found our screen
             if len(approx) == 4:
@@ -85,7 +90,8 @@ def transform_image(image, paper_dims=(825, 1100), output_image="scannedImage.jp
                 # colors = [(0, 0, 255), (0, 255, 0), (255, 0, 0), (255, 255, 255), (255, 255, 255), (255, 255, 255)]
                 for i in range(4):
                     with_corners = cv2.circle(orig, (approx[i][0][0], approx[i][0][1]), radius=5, color=red, thickness=-1)
-                show_image(with_corners)
+                if show:
+                    show_image(with_corners)
                 break
     else:
         # display image so it can be clicked on
@@ -102,11 +108,12 @@ def transform_image(image, paper_dims=(825, 1100), output_image="scannedImage.jp
         screenCnt = np.asarray(screenCnt)
     
     # check if we successfully found our screen
-    if screenCnt == []:
+    if len(screenCnt) == 0:
         return None, None
 
     # show the contour (outline) of the piece of paper
-    print("STEP 2: Find contours of paper")
+    if show:
+        print("STEP 2: Find contours of paper")
     # cv2.drawContours(image, [screenCnt], -1, (0, 255, 0), 2)
     # image = cv2.resize(image, (1280,800))
     # cv2.imshow("Outline", image)
@@ -116,7 +123,8 @@ def transform_image(image, paper_dims=(825, 1100), output_image="scannedImage.jp
     # apply the four point transform to obtain a top-down
     # view of the original image
     M, warped, dims = four_point_transform(orig, screenCnt.reshape(4, 2))
-    show_image(warped)
+    if show:
+        show_image(warped)
     #show_image(warped)
     #find_markers(warped)
     # convert the warped image to grayscale, then threshold it
@@ -126,13 +134,15 @@ def transform_image(image, paper_dims=(825, 1100), output_image="scannedImage.jp
     # warped = (warped > T).astype("uint8") * 255
 
     # show the original and scanned images
-    print("STEP 3: Apply perspective transform")
+    if show:
+        print("STEP 3: Apply perspective transform")
 
     # cv2.imwrite(output_image, cv2.resize(warped, paper_dims))
     # cv2.imshow("Scanned", cv2.resize(warped, paper_dims))
     # cv2.waitKey(0)
 
-    print("Done transform initialization")
+    if show:
+        print("Done transform initialization")
 
     return M, dims
 
@@ -154,6 +164,16 @@ class TransformMetadata:
     im_dims: (int, int)
     desired_dimensions: (int, int)
 
+    @cached_property
+    def scaled_matrix(self):
+        """
+        Homography followed by the desired_dimensions / im_dims rescale, precomposed into one 3x3 matrix
+        """
+        scale = np.diag([self.desired_dimensions[0] / self.im_dims[0],
+                         self.desired_dimensions[1] / self.im_dims[1],
+                         1.0])
+        return scale @ np.asarray(self.transformation_matrix, dtype=np.float64)
+
 
 def transform_point(point: (int, int), transform_metadata: TransformMetadata):
     """
@@ -161,31 +181,100 @@ def transform_point(point: (int, int), transform_metadata: TransformMetadata):
     :param M: transformation matrix
     :return: prints point that point is transformed to in new plane
     """
-    a = np.array([np.array([point], dtype='float32')])
-    cur = cv2.perspectiveTransform(a, transform_metadata.transformation_matrix)
-    x = cur.flatten()[0] * transform_metadata.desired_dimensions[0] / transform_metadata.im_dims[0]
-    y = cur.flatten()[1] * transform_metadata.desired_dimensions[1] / transform_metadata.im_dims[1]
-    return x, y
+    x, y = transform_points(np.array(point), transform_metadata)
+    return float(x), float(y)
+
+
+def transform_points(points, transform_metadata: TransformMetadata):
+    """
+    Transforms many points into the page plane with a single perspectiveTransform call
+    :param points: array of shape (..., 2), e.g. (N, 2) or (frames, fingers, 2), of points in original plane
+    :param transform_metadata: page transform
+    :return: float64 array of the same shape with the points in page dimensions
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if points.size == 0:
+        return points.copy()
+    cur = cv2.perspectiveTransform(points.reshape(-1, 1, 2), transform_metadata.scaled_matrix)
+    return cur.reshape(points.shape)
+
+
+def page_corners(transform_metadata: TransformMetadata):
+    """
+    :param transform_metadata: page transform
+    :return: (4, 2) array of the page corners in the original plane: top-left, top-right, bottom-right, bottom-left
+    """
+    width, height = transform_metadata.im_dims
+    warped_corners = np.array([[[0, 0]], [[width - 1, 0]], [[width - 1, height - 1]], [[0, height - 1]]],
+                              dtype=np.float64)
+    inverse = np.linalg.inv(np.asarray(transform_metadata.transformation_matrix, dtype=np.float64))
+    return cv2.perspectiveTransform(warped_corners, inverse).reshape(4, 2)
 
 
-def get_transform_video(video_path, desired_dimensions=(11.5, 11.0), black_background=True):
+def page_roi(transform_metadata: TransformMetadata, frame_size, margin=100, include_boxes=()):
+    """
+    Bounding rectangle of the page in the original plane, grown by a margin and clipped to the frame
+    :param transform_metadata: page transform
+    :param frame_size: (width, height) of the frame
+    :param margin: pixels added on every side of the page
+    :param include_boxes: (x, y, w, h) boxes that must also lie inside the rectangle, e.g. the calibration boxes
+    :return: (x, y, w, h) rectangle of integer pixels
+    """
+    points = [page_corners(transform_metadata)]
+    for x, y, w, h in include_boxes:
+        points.append(np.array([[x, y], [x + w, y + h]], dtype=np.float64))
+    points = np.concatenate(points)
+
+    x0, y0 = np.floor(points.min(axis=0) - margin).astype(int)
+    x1, y1 = np.ceil(points.max(axis=0) + margin).astype(int)
+    x0, y0 = max(x0, 0), max(y0, 0)
+    x1, y1 = min(x1, frame_size[0]), min(y1, frame_size[1])
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError('Page does not overlap the frame')
+    return int(x0), int(y0), int(x1 - x0), int(y1 - y0)
+
+
+def get_transform_video(video_path, desired_dimensions=(11.5, 11.0), black_background=True, automatic=True, show=True,
+                        allow_manual=True, frame_size=None):
+    """
+    Finds the page transform from frames near the end of a video
+    :param video_path: path of input video
+    :param desired_dimensions: dimensions of the page (in inches) that transformed points are scaled to
+    :param black_background: if True, will perform page calibration by casting background to black
+    :param automatic: if True, searches for the page outline automatically before asking for manual corner clicks
+    :param show: if True, displays the detected corners and warped page for checking
+    :param allow_manual: if False, raises an exception instead of asking for manual corner clicks
+    :param frame_size: (width, height) frames are resized to before the page is searched for, so the transform maps
+    pixels of frames resized the same way, e.g. the 1920x1080 frames VideoTracker tracks on. None for native frames
+    :return: TransformMetadata of the page
+    """
     cap = cv2.VideoCapture(video_path)
     video_length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    seeker = VideoSeeker.VideoSeeker(cap, video_path, cap.get(cv2.CAP_PROP_FPS))
 
     m = None
+    frame = None
     for i in range(75, 25, -5):
-        cap.set(cv2.CAP_PROP_POS_FRAMES, video_length - i)
-        ret, frame = cap.read()
-        transform_image(frame, automatic=False)
-        break
-        m, im_dims = transform_image(frame, black_background=black_background)
+        seeker.seek(video_length - i)
+        ret, this_frame = cap.read()
+        if not ret:
+            continue
+        frame = this_frame if frame_size is None else cv2.resize(this_frame, tuple(frame_size))
+        if not automatic:
+            break
+        m, im_dims = transform_image(frame, black_background=black_background, show=show)
         if m is not None:
             break
+    cap.release()
+
+    if frame is None:
+        raise Exception("Failed to read video")
 
-    return
-    # if m is still None after this, then default to automatic
+    # if m is still None after this, then default to manual
     if m is None:
-        m, im_dims = transform_image(video_path, automatic=False)
+        if not allow_manual:
+            raise Exception("Failed to find the page automatically")
+        m, im_dims = transform_image(frame, automatic=False)
 
     return TransformMetadata(m, im_dims, desired_dimensions)
 
@@ -0,0 +1,53 @@
+import json
+import queue
+
+import pytest
+
+import BatchTracker
+
+
+def test_failed_sessions_with_the_same_name_finish_the_batch(tmp_path):
+    sessions = [dict(BatchTracker.default_settings, video=str(tmp_path / 'missing.mp4'), page=str(tmp_path / 'p.brf'),
+                     name='session') for i in range(3)]
+    results = BatchTracker.run_batch(sessions, str(tmp_path / 'out'), workers=2)
+    assert [result['name'] for result in results] == ['session', 'session_2', 'session_3']
+    assert all(result['status'] == 'failed' for result in results)
+
+
+def write_manifest(tmp_path, **settings):
+    manifest = {'defaults': {'page': 'p.brf', 'calibration_cache_dir': 'calibration'},
+                'sessions': [dict(video='s01.mp4', **settings)]}
+    manifest_path = tmp_path / 'sessions.json'
+    manifest_path.write_text(json.dumps(manifest))
+    return str(manifest_path)
+
+
+def test_manifest_settings_reach_the_tracker(tmp_path, monkeypatch):
+    sessions = BatchTracker.load_manifest(write_manifest(tmp_path, start_time=3, fast_tracker_type='MOSSE',
+                                                         marker_colors=[[0, 70, 50]]))
+    BatchTracker.assign_output_dirs(sessions, str(tmp_path / 'out'))
+
+    calls = []
+
+    class RecordingTracker:
+        def __init__(self, video_path, page_path, **kwargs):
+            calls.append(kwargs)
+            self.frames_processed = 0
+
+    monkeypatch.setattr(BatchTracker.VideoTracker, 'VideoTracker', RecordingTracker)
+    results = queue.Queue()
+    BatchTracker.run_session(0, sessions[0], results)
+    assert results.get()[1]['status'] == 'ok'
+    assert calls[0]['calibration'].start_time == 3
+    assert calls[0]['tracking'].fast_tracker_type == 'MOSSE'
+    assert calls[0]['tracking'].marker_colors == [[0, 70, 50]]
+    assert calls[0]['calibration'].calibration_cache_dir == str(tmp_path / 'calibration')
+    assert calls[0]['output'].data_output_path == str(tmp_path / 'out' / 's01' / 'BrailleOutput.txt')
+    assert calls[0]['headless']
+
+
+@pytest.mark.parametrize('settings, message', [({'start_tme': 3}, 'unknown settings start_tme'),
+                                               ({'headless': False}, 'which the batch sets')])
+def test_manifest_rejects_settings_it_cannot_apply(tmp_path, settings, message):
+    with pytest.raises(ValueError, match=message):
+        BatchTracker.load_manifest(write_manifest(tmp_path, **settings))
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+import BraillePage
+
+
+@pytest.fixture
+def page_path(tmp_path):
+    # lines of different lengths, so some cells are past the end of their line
+    rng = np.random.default_rng(0)
+    lines = [''.join(chr(c) for c in rng.integers(33, 127, size=rng.integers(0, 43))) for _ in range(26)]
+    path = tmp_path / 'page.brf'
+    path.write_bytes(('\n'.join(lines) + '\n').encode('ascii'))
+    return str(path)
+
+
+def test_positions2chars_matches_position2char(page_path):
+    page = BraillePage.BraillePage(page_path)
+    rng = np.random.default_rng(1)
+    # the whole sheet and a little around it, plus the margin edges themselves
+    x = np.concatenate([rng.uniform(-0.5, 12, 2000), [page.leftMargin, page.pageWidth - page.rightMargin]])
+    y = np.concatenate([rng.uniform(-0.5, 11.5, 2000), [page.topMargin, page.pageHeight - page.botMargin]])
+
+    codes, rows, columns = page.positions2Chars(x, y)
+    for i in range(len(x)):
+        # position2Char names the cell within the line row and the line column
+        char, cell, line = page.position2Char(x[i], y[i])
+        assert page.code2Char(codes[i]) == char
+        assert (rows[i], columns[i]) == (line, cell)
+
+    outside = rows == page.outOfMargin
+    assert outside.any() and not outside.all()
+    assert (columns[outside] == page.outOfMargin).all()
+    assert (codes[outside] == page.outOfMarginCode).all()
+
+
+def test_positions2chars_keeps_the_input_shape(page_path):
+    page = BraillePage.BraillePage(page_path)
+    x = np.array([[1.0, np.nan], [5.0, 20.0]])
+    codes, rows, columns = page.positions2Chars(x, np.full(x.shape, 3.0))
+    assert codes.shape == rows.shape == columns.shape == (2, 2)
+    # NaN and off-page positions read as outside the margins
+    np.testing.assert_array_equal(rows[:, 1], [page.outOfMargin, page.outOfMargin])
+
+
+def page_lines(letter, n=26):
+    """
+    :return: n lines of one page, each starting with letter and numbered, so every line is different
+    """
+    return ''.join('{}{:02d}\n'.format(letter, i) for i in range(n))
+
+
+def test_book_splits_pages_at_form_feeds(tmp_path):
+    path = tmp_path / 'book.brf'
+    # a short page, a full one, then a last page without a trailing form feed or newline
+    path.write_bytes(('a0\na1\n' + '\f' + page_lines('b') + '\f' + 'c0\r\nc1').encode('ascii'))
+    with BraillePage.BrfBook(str(path)) as book:
+        assert len(book) == 3
+        assert bytes(book.page_bytes(0)) == b'a0\na1\n'
+        assert bytes(book.page_bytes(1)) == page_lines('b').encode('ascii')
+        assert bytes(book.page_bytes(2)) == b'c0\r\nc1'
+        last = book.page_grid(2)
+        assert bytes(last[0, :2]) == b'c0' and bytes(last[1, :2]) == b'c1'
+        assert not last[0, 2:].any() and not last[2:].any()
+        with pytest.raises(ValueError):
+            book.page_bytes(3)
+    assert bytes(BraillePage.BraillePage(str(path), 2).charMatrix[1, :2]) == b'c1'
+
+
+def test_book_splits_long_pages_every_num_rows_lines(tmp_path):
+    path = tmp_path / 'book.brf'
+    # two and a half pages without any form feed, then a form feed page, then only blank lines after the last break
+    path.write_bytes((page_lines('a') + page_lines('b') + page_lines('c', 13) + '\f' + page_lines('d', 3) +
+                      '\f\n\n').encode('ascii'))
+    with BraillePage.BrfBook(str(path)) as book:
+        assert len(book) == 4
+        for page_number, letter, rows in [(0, 'a', 26), (1, 'b', 26), (2, 'c', 13), (3, 'd', 3)]:
+            assert bytes(book.page_bytes(page_number)) == page_lines(letter, rows).encode('ascii')
+            grid = book.page_grid(page_number)
+            assert bytes(grid[rows - 1, :3]) == '{}{:02d}'.format(letter, rows - 1).encode('ascii')
+            assert not grid[rows:].any()
+
+
+def test_empty_book_has_one_blank_page(tmp_path):
+    path = tmp_path / 'empty.brf'
+    path.write_bytes(b'')
+    with BraillePage.BrfBook(str(path)) as book:
+        assert len(book) == 1
+        assert not book.page_grid(0).any()
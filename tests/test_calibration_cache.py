@@ -0,0 +1,18 @@
+import numpy as np
+
+import CalibrationCache
+import scan
+
+
+def test_calibration_is_only_reused_for_the_same_frame_size(tmp_path):
+    video_path = tmp_path / 'video.mp4'
+    video_path.write_bytes(b'not really a video')
+    cache_dir = str(tmp_path / 'cache')
+    metadata = scan.TransformMetadata(np.eye(3), (900, 710), (11.5625, 11))
+    CalibrationCache.save_calibration(str(video_path), metadata, [(1, 2, 3, 4)], [(0, 0, 255)], 2, cache_dir)
+
+    cached = CalibrationCache.load_calibration(str(video_path), cache_dir)
+    np.testing.assert_array_equal(cached.transform_metadata.transformation_matrix, np.eye(3))
+    assert cached.bboxes == [(1, 2, 3, 4)]
+    assert cached.second == 2
+    assert CalibrationCache.load_calibration(str(video_path), cache_dir, frame_size=(1280, 720)) is None
@@ -0,0 +1,62 @@
+import cv2
+import numpy as np
+
+import BraillePage
+import CellRaster
+import scan
+
+
+def tilted_page_transform(im_dims=(1156, 1100)):
+    """
+    :return: scan.TransformMetadata of a sheet seen slightly rotated and in perspective in a 1080p frame
+    """
+    corners = np.float32([[520, 90], [1460, 140], [1400, 1010], [480, 960]])
+    warped = np.float32([[0, 0], [im_dims[0] - 1, 0], [im_dims[0] - 1, im_dims[1] - 1], [0, im_dims[1] - 1]])
+    return scan.TransformMetadata(cv2.getPerspectiveTransform(corners, warped), im_dims, (11.5625, 11))
+
+
+def test_raster_agrees_with_the_page_lookup_away_from_cell_edges(tmp_path):
+    path = tmp_path / 'page.brf'
+    rng = np.random.default_rng(0)
+    path.write_bytes(b'\n'.join(line.tobytes() for line in rng.integers(33, 127, (26, 42), dtype=np.uint8)))
+    page = BraillePage.BraillePage(str(path))
+    metadata = tilted_page_transform()
+    dpi = 200
+    raster = CellRaster.CellRaster(metadata, (1920, 1080), dpi=dpi)
+
+    x = rng.uniform(0, 1920, 20000)
+    y = rng.uniform(0, 1080, 20000)
+    codes, rows, columns = raster.positions2Chars(page, x, y)
+    page_points = scan.transform_points(np.stack([x, y], axis=1), metadata)
+    expected_codes, expected_rows, expected_columns = page.positions2Chars(page_points[:, 0], page_points[:, 1])
+
+    # The raster reads the camera pixel nearest each position and the sheet pixel nearest that, so it may only disagree
+    # where moving the position by half a camera pixel, plus one sheet pixel, crosses a cell edge
+    corners = np.array([[-0.5, -0.5], [0.5, -0.5], [0.5, 0.5], [-0.5, 0.5]])
+    moved = scan.transform_points(np.stack([x, y], axis=1)[:, None, :] + corners, metadata)
+    tolerance = np.abs(moved - page_points[:, None, :]).max(axis=1) + 1.0 / dpi
+    row_edges, column_edges = CellRaster.uniform_cell_edges()
+    row_distance = np.abs(page_points[:, 1, None] - row_edges)
+    column_distance = np.abs(page_points[:, 0, None] - column_edges)
+    near_row_edge = row_distance.min(axis=1) <= tolerance[:, 1]
+    near_column_edge = column_distance.min(axis=1) <= tolerance[:, 0]
+    near_margin = (row_distance[:, [0, -1]].min(axis=1) <= tolerance[:, 1]) | \
+                  (column_distance[:, [0, -1]].min(axis=1) <= tolerance[:, 0])
+
+    # in a cell by one lookup and outside the margins by the other, across either axis' margin
+    outside = rows == BraillePage.BraillePage.outOfMargin
+    expected_outside = expected_rows == BraillePage.BraillePage.outOfMargin
+    assert not ((outside != expected_outside) & ~near_margin).any()
+    # in two different cells, only ever neighbours across an edge of the axis that differs
+    inside = ~outside & ~expected_outside
+    row_steps = np.abs(rows.astype(int) - expected_rows)[inside]
+    column_steps = np.abs(columns.astype(int) - expected_columns)[inside]
+    assert (row_steps <= 1).all() and (column_steps <= 1).all()
+    assert not ((row_steps == 1) & ~near_row_edge[inside]).any()
+    assert not ((column_steps == 1) & ~near_column_edge[inside]).any()
+
+    differs = (rows != expected_rows) | (columns != expected_columns)
+    np.testing.assert_array_equal(codes[~differs], expected_codes[~differs])
+    # about 0.6% of random positions are that close to an edge
+    assert differs.mean() < 0.01
+    assert inside.mean() > 0.25
@@ -0,0 +1,179 @@
+import cv2
+import numpy as np
+import pytest
+
+import ChunkTracker
+import TrackerBenchmark
+
+
+def test_chunks_cover_the_video_with_overlap():
+    chunks = ChunkTracker.chunk_ranges(0, 600, 150, 30)
+    assert chunks == [(0, 1, 151), (120, 151, 301), (270, 301, 451), (420, 451, None)]
+
+
+def moving_boxes(n_frames, n_fingers):
+    steps = np.arange(n_frames, dtype=np.float32)[:, None]
+    boxes = np.zeros((n_frames, n_fingers, 4), dtype=np.float32)
+    boxes[:, :, 0] = 100 * np.arange(n_fingers) + steps
+    boxes[:, :, 1] = 50
+    boxes[:, :, 2:] = 20
+    return boxes
+
+
+def test_overlap_matches_finds_reordered_tracks():
+    previous = moving_boxes(30, 3)
+    current = np.concatenate([previous[:, [2, 0, 1]], moving_boxes(10, 3)[:, [2, 0, 1]]])
+    matches = ChunkTracker.overlap_matches(previous, current, 30, False, 15.0)
+    np.testing.assert_array_equal(matches, [1, 2, 0])
+
+
+def test_overlap_matches_asks_for_a_retrack():
+    previous = moving_boxes(30, 3)
+    # a finger whose marker was not found
+    assert ChunkTracker.overlap_matches(previous, previous[:, :2], 30, False, 15.0) is None
+    # no markers at all, or a chunk that ended early
+    assert ChunkTracker.overlap_matches(previous, np.zeros((0, 0, 4), np.float32), 30, False, 15.0) is None
+    assert ChunkTracker.overlap_matches(previous, previous[:20], 30, False, 15.0) is None
+
+
+def test_stitch_switches_where_the_tracks_are_closest():
+    previous = moving_boxes(10, 2)
+    current = previous[:, ::-1].copy()
+    # the later chunk's track of finger 0 drifts in from 8 pixels away and is closest on frame 6
+    current[:, 1, 0] += np.abs(np.arange(10) - 6)[:, None].ravel()
+    stitched = ChunkTracker.stitch(previous, current, np.array([1, -1]))
+    np.testing.assert_array_equal(stitched[:6], previous[:6])
+    np.testing.assert_array_equal(stitched[6:, 0], current[6:, 1])
+    # a finger without a match keeps the earlier chunk's track
+    np.testing.assert_array_equal(stitched[:, 1], previous[:, 1])
+
+
+def test_fill_unseen_keeps_the_last_box_of_a_marker():
+    boxes = moving_boxes(5, 2)
+    expected = boxes.copy()
+    boxes[1:3, 0] = np.nan
+    boxes[:2, 1] = np.nan
+    ChunkTracker.fill_unseen(boxes)
+    expected[1:3, 0] = expected[0, 0]
+    np.testing.assert_array_equal(boxes[:, 0], expected[:, 0])
+    # never seen yet
+    assert np.isnan(boxes[:2, 1]).all()
+    np.testing.assert_array_equal(boxes[2:, 1], expected[2:, 1])
+
+    # continued from the frame before, as when written chunk by chunk
+    later = np.full((2, 2, 4), np.nan, dtype=np.float32)
+    later[1, 0] = 7
+    ChunkTracker.fill_unseen(later, boxes[-1])
+    np.testing.assert_array_equal(later[:, 1], [boxes[-1, 1]] * 2)
+    np.testing.assert_array_equal(later[:, 0], [boxes[-1, 0], [7] * 4])
+
+
+def fake_track_chunk(truth, lost_chunk_seed):
+    """
+    Stands in for ChunkTracker.track_chunk, following the true boxes exactly. Chunks started from markers list them
+    in reverse finger order, and on the seed frame lost_chunk_seed one marker is not found.
+    """
+    calls = []
+
+    def track_chunk(video_path, seed_frame, stop, seed_boxes, settings):
+        calls.append((seed_frame, seed_boxes is None))
+        boxes = truth[seed_frame + 1:stop]
+        if seed_boxes is not None:
+            return boxes.copy()
+        if seed_frame == lost_chunk_seed:
+            return boxes[:, :0:-1].copy()
+        return boxes[:, ::-1].copy()
+    return track_chunk, calls
+
+
+def test_track_chunks_streams_stitched_boxes_and_retracks_a_chunk(monkeypatch):
+    truth = moving_boxes(200, 3)
+    track_chunk, calls = fake_track_chunk(truth, lost_chunk_seed=90)
+    # threads, so the stand-in is used by the workers
+    monkeypatch.setattr(ChunkTracker, 'track_chunk', track_chunk)
+    monkeypatch.setattr(ChunkTracker.concurrent.futures, 'ProcessPoolExecutor',
+                        lambda workers, mp_context: ChunkTracker.concurrent.futures.ThreadPoolExecutor(workers))
+    chunks = ChunkTracker.chunk_ranges(0, 200, 50, 10)
+    settings = {'tracker_type': 'KCF'}
+
+    written = []
+    run_info = ChunkTracker.track_chunks('video.mp4', chunks, truth[0], settings, written.append, workers=2)
+    assert [len(boxes) for boxes in written] == [40, 10, 40, 10, 40, 10, 49]
+    np.testing.assert_array_equal(np.concatenate(written), truth[1:])
+    # the chunk without every marker was tracked again from the chunk before it
+    assert run_info['queued_retracks'] == run_info['retracked_chunks'] == [2]
+    assert (90, False) in calls
+
+
+def smooth_video(video_path, n_frames=150, n_fingers=3, markers=True):
+    """
+    Writes a 960x540 video of round fingertips drifting smoothly over a dotted page, colored like the benchmark's
+    markers or all gray
+    :return: (n_frames, n_fingers, 2) true centers in 1920x1080 pixels
+    """
+    t = np.arange(n_frames)[:, None]
+    fingers = np.arange(n_fingers)[None]
+    centers = np.stack([960 * (0.3 + 0.12 * fingers) + 60 * np.sin(t / 40 + fingers),
+                        270 + 40 * np.cos(t / 55 + 2 * fingers)], axis=2)
+    background = np.full((540, 960, 3), 30, np.uint8)
+    background[60:480, 150:810] = 200
+    for y in range(80, 470, 12):
+        for x in range(170, 800, 10):
+            cv2.circle(background, (x, y), 2, (90, 90, 90), -1)
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), 30, (960, 540))
+    for frame_centers in centers:
+        frame = background.copy()
+        for finger, center in enumerate(np.rint(frame_centers).astype(int)):
+            color = TrackerBenchmark.finger_colors[finger] if markers else (60, 60, 60)
+            cv2.circle(frame, (int(center[0]), int(center[1])), 14, color, -1)
+        writer.write(frame)
+    writer.release()
+    return centers * 2
+
+
+def chunk_settings(tracker_type, n_fingers=3):
+    return {'tracker_type': tracker_type, 'tracking_scale': 0.25, 'roi': None, 'fast_tracker_type': 'KCF',
+            'anchor_interval': 15, 'anchor_confidence': 0.5,
+            'marker_colors': TrackerBenchmark.marker_colors(n_fingers), 'marker_delta_h': 10, 'marker_delta_s': 50}
+
+
+def test_chunked_tracking_matches_serial_tracking(tmp_path):
+    video_path = str(tmp_path / 'markers.mp4')
+    centers = smooth_video(video_path)
+    bboxes = np.array([(x - 40, y - 40, 80, 80) for x, y in centers[0]], dtype=np.float32)
+    settings = chunk_settings('KCF')
+    chunks = ChunkTracker.plan_chunks(video_path, 0, len(bboxes), settings, chunk_frames=50, overlap_frames=15)
+    assert len(chunks) == 3
+
+    written = []
+    run_info = ChunkTracker.track_chunks(video_path, chunks, bboxes, settings, written.append, workers=2)
+    assert run_info['retracked_chunks'] == []
+    boxes = np.concatenate(written)
+    serial = ChunkTracker.track_chunk(video_path, 0, None, bboxes, settings)
+    assert boxes.shape == serial.shape == (149, 3, 4)
+    # chunks start afresh on the markers, so they may settle a few pixels from where the serial trackers drifted, but
+    # always on the same finger: within 20 pixels of the serial track, and the 80 pixel boxes never off their finger
+    chunked_centers = boxes[:, :, :2] + boxes[:, :, 2:] / 2
+    serial_centers = serial[:, :, :2] + serial[:, :, 2:] / 2
+    assert np.linalg.norm(chunked_centers - serial_centers, axis=2).max() < 20
+    assert np.linalg.norm(chunked_centers - centers[1:], axis=2).max() < 20
+
+
+def test_color_chunks_match_serial_detection(tmp_path):
+    video_path = str(tmp_path / 'markers.mp4')
+    smooth_video(video_path, n_frames=120)
+    settings = chunk_settings('COLOR')
+    chunks = ChunkTracker.plan_chunks(video_path, 0, 0, settings, chunk_frames=40, overlap_frames=10)
+    written = []
+    ChunkTracker.track_chunks(video_path, chunks, [], settings, written.append, workers=2)
+    serial = ChunkTracker.track_chunk(video_path, 0, None, None, settings)
+    np.testing.assert_array_equal(np.concatenate(written), serial)
+
+
+def test_video_without_markers_is_planned_as_one_chunk(tmp_path):
+    video_path = str(tmp_path / 'plain.mp4')
+    smooth_video(video_path, markers=False)
+    chunks = ChunkTracker.plan_chunks(video_path, 0, 3, chunk_settings('KCF'), chunk_frames=50, overlap_frames=15)
+    assert chunks == [(0, 1, None)]
+    with pytest.raises(ValueError):
+        ChunkTracker.plan_chunks(video_path, 0, 3, chunk_settings('KCF'), chunk_frames=50, overlap_frames=1)
@@ -0,0 +1,69 @@
+import cv2 as cv
+import numpy as np
+
+import ColorMasking
+
+
+def marker_centers(n):
+    """
+    :return: (n, 2) centers of the markers drawn by marker_frame, one per finger slot
+    """
+    return np.array([(150 + 220 * i, 400 + 30 * (i % 3)) for i in range(n)], dtype=np.float64)
+
+
+def marker_frame(detector, seed=0):
+    """
+    1080p frame with one round marker of every color, a smaller decoy of the first color and some noise
+    """
+    rng = np.random.default_rng(seed)
+    frame = np.full((1080, 1920, 3), 90, dtype=np.uint8)
+    frame += rng.integers(0, 20, frame.shape, dtype=np.uint8)
+    colors = detector.draw_colors()
+    for color, center in zip(colors, marker_centers(len(colors))):
+        cv.circle(frame, tuple(int(c) for c in center), 18, color, -1)
+    cv.circle(frame, (900, 900), 6, colors[0], -1)
+    return frame
+
+
+def test_update_finds_each_slot_on_its_own_marker():
+    detector = ColorMasking.ColorMarkerDetector()
+    success, boxes = detector.update(marker_frame(detector))
+    assert success
+    centers = boxes[:, :2] + boxes[:, 2:] / 2
+    np.testing.assert_allclose(centers, marker_centers(len(detector.marker_colors)), atol=1)
+    # the whole marker, not only the pixels of its color that no other color matches
+    np.testing.assert_array_equal(boxes[:, 2:], 37)
+
+
+def test_update_keeps_last_box_of_missing_marker():
+    detector = ColorMasking.ColorMarkerDetector()
+    frame = marker_frame(detector)
+    first = detector.update(frame)[1]
+    # cover the last marker
+    cv.circle(frame, tuple(int(c) for c in marker_centers(8)[7]), 20, (90, 90, 90), -1)
+    success, boxes = detector.update(frame)
+    assert not success
+    np.testing.assert_allclose(boxes, first)
+
+
+def test_overlapping_colors_claim_their_own_marker():
+    # with the default tolerances orange pixels also match red, and red ones orange
+    detector = ColorMasking.ColorMarkerDetector()
+    red, orange = detector.draw_colors()[:2]
+    frame = np.full((1080, 1920, 3), 90, dtype=np.uint8)
+    cv.circle(frame, (150, 400), 24, red, -1)
+    cv.circle(frame, (370, 430), 18, orange, -1)
+    boxes = detector.update(frame)[1]
+    centers = boxes[:, :2] + boxes[:, 2:] / 2
+    np.testing.assert_allclose(centers[0], (150, 400), atol=1)
+    np.testing.assert_allclose(centers[1], (370, 430), atol=1)
+
+
+def test_blob_is_the_marker_of_one_finger_only():
+    detector = ColorMasking.ColorMarkerDetector()
+    frame = np.full((1080, 1920, 3), 90, dtype=np.uint8)
+    cv.circle(frame, (150, 400), 24, detector.draw_colors()[0], -1)
+    success, boxes = detector.update(frame)
+    assert not success
+    assert not np.isnan(boxes[0]).any()
+    assert np.isnan(boxes[1:]).all()
@@ -0,0 +1,82 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+
+# ar_markers is only needed for the real detector, which these tests replace
+sys.modules.setdefault('ar_markers', types.ModuleType('ar_markers'))
+import Coordinates
+
+# each marker is drawn as a square of its own gray level, so it can be found in any crop of the frame
+marker_levels = {2226: 50, 2265: 100, 2421: 150, 2023: 200}
+marker_centers = {2226: (100, 80), 2265: (500, 80), 2421: (500, 380), 2023: (100, 380)}
+
+
+class FakeMarker:
+    def __init__(self, marker_id, ys, xs):
+        self.id = marker_id
+        self.center = (float(xs.mean()), float(ys.mean()))
+        self.contours = np.array([[[xs.min(), ys.min()]], [[xs.max(), ys.min()]],
+                                  [[xs.max(), ys.max()]], [[xs.min(), ys.max()]]])
+
+
+class FakeDetector:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, image):
+        self.calls.append(image.shape[:2])
+        markers = []
+        for marker_id, level in marker_levels.items():
+            ys, xs = np.nonzero(image[:, :, 0] == level)
+            if len(ys):
+                markers.append(FakeMarker(marker_id, ys, xs))
+        return markers
+
+
+def draw_frame(hidden=()):
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    for marker_id, (x, y) in marker_centers.items():
+        if marker_id not in hidden:
+            frame[y - 10:y + 11, x - 10:x + 11] = marker_levels[marker_id]
+    return frame
+
+
+@pytest.fixture
+def detector(monkeypatch):
+    detector = FakeDetector()
+    monkeypatch.setattr(Coordinates.ar, 'detect_markers', detector, raising=False)
+    return detector
+
+
+def test_occluded_marker_keeps_homography_and_limits_full_searches(detector):
+    localizer = Coordinates.MarkerLocalizer(retry_interval=30)
+    first = localizer.update(draw_frame())
+    assert first is not None
+    assert localizer.full_searches == 1
+
+    occluded = draw_frame(hidden=(2421,))
+    for _ in range(90):
+        homography = localizer.update(occluded)
+        np.testing.assert_allclose(homography, first)
+        assert set(localizer.centers) == {2226, 2265, 2023}
+
+    # the whole frame is searched again only every 31st frame while the marker is covered, not every frame
+    assert localizer.full_searches == 3
+    assert sum(shape == (480, 640) for shape in detector.calls) == 3
+
+    # the marker is found again once uncovered
+    localizer.update(draw_frame())
+    for _ in range(30):
+        localizer.update(draw_frame())
+    assert set(localizer.centers) == set(marker_centers)
+    np.testing.assert_allclose(localizer.homography, first)
+
+
+def test_all_markers_visible_needs_one_full_search(detector):
+    localizer = Coordinates.MarkerLocalizer()
+    for _ in range(20):
+        localizer.update(draw_frame())
+    assert localizer.full_searches == 1
+    assert set(localizer.centers) == set(marker_centers)
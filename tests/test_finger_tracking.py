@@ -0,0 +1,47 @@
+import numpy as np
+
+import FingerTracking
+
+
+class StillTracker:
+    """
+    Tracker stub that keeps its box where it was started, optionally failing every update
+    """
+    def __init__(self, ok=True):
+        self.ok = ok
+        self.updates = 0
+
+    def init(self, frame, box):
+        self.box = box
+        return True
+
+    def update(self, frame):
+        self.updates += 1
+        return self.ok, self.box
+
+
+def run_failing_anchor(fast_ok, n_frames=60):
+    """
+    :return: number of re-anchors tried on a still finger whose accurate tracker always fails
+    """
+    frame = np.random.default_rng(0).integers(0, 256, (120, 160, 3), dtype=np.uint8)
+    anchor = StillTracker(ok=False)
+    anchor.init(frame, (40, 40, 20, 20))
+    multi_tracker = FingerTracking.HybridFingerTracker(lambda: StillTracker(fast_ok), anchor_interval=15)
+    multi_tracker.add(anchor, frame, (40, 40, 20, 20))
+
+    for _ in range(n_frames):
+        success, boxes = multi_tracker.update(frame)
+        np.testing.assert_allclose(boxes, [[40, 40, 20, 20]])
+    assert multi_tracker.anchor_summary()['failed'] == anchor.updates
+    return anchor.updates
+
+
+def test_failed_interval_anchor_waits_a_full_interval():
+    # tries at frames 15, 30, 45 and 60 rather than every frame from 15 on
+    assert run_failing_anchor(fast_ok=True) == 4
+
+
+def test_failed_anchors_of_a_lost_finger_back_off():
+    # tries at frames 1, 2, 4, 8, 16, 31 and 46
+    assert run_failing_anchor(fast_ok=False) == 7
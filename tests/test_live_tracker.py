@@ -0,0 +1,71 @@
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+import LiveTracker
+import VideoTracker
+
+
+@pytest.fixture(scope='module')
+def replay_video(tmp_path_factory):
+    """
+    :return: paths of a 2 second 960x540 recording of a page on a neon green background, and of a Braille page
+    """
+    tmp_path = tmp_path_factory.mktemp('replay_video')
+    video_path = str(tmp_path / 'page.mp4')
+    frame = np.zeros((540, 960, 3), dtype=np.uint8)
+    frame[:] = (40, 200, 60)
+    cv2.fillConvexPoly(frame, np.array([[250, 100], [700, 120], [690, 475], [260, 450]], np.int32), (230, 230, 230))
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), 30, (960, 540))
+    for _ in range(60):
+        writer.write(frame)
+    writer.release()
+    page_path = tmp_path / 'page.brf'
+    page_path.write_text('abc\n' * 26)
+    return video_path, str(page_path)
+
+
+def replay(replay_video, tmp_path, latency_budget):
+    """
+    Tracks the recording played back at its own frame rate
+    :return: the LiveTracker, the report written and the frame numbers of the tracked frames
+    """
+    video_path, page_path = replay_video
+    output_path = str(tmp_path / 'output.txt')
+    report_path = str(tmp_path / 'report.json')
+    tracker = LiveTracker.LiveTracker(video_path, page_path,
+                                      VideoTracker.TrackingSettings(tracker_type='MOSSE', tracking_scale=0.5),
+                                      VideoTracker.OutputSettings(data_output_path=output_path),
+                                      replay=True, latency_budget=latency_budget, headless=True,
+                                      report_path=report_path)
+    with open(report_path) as fh:
+        report = json.load(fh)
+    with open(output_path) as fh:
+        frame_nums = [int(line.split('\t')[0]) for line in fh.readlines()[1:]]
+    return tracker, report, frame_nums
+
+
+def test_replay_drops_every_other_frame_when_every_frame_is_late(replay_video, tmp_path):
+    # no frame can make a budget of a microsecond, so stale frames are dropped, but never two in a row
+    tracker, report, frame_nums = replay(replay_video, tmp_path, 1e-6)
+    assert report == dict(tracker.report, tracker_type='MOSSE', tracking_scale=0.5, replay=True)
+    assert report['frames_processed'] == len(frame_nums) == tracker.frames_processed > 0
+    assert report['frames_stale'] in (report['frames_processed'], report['frames_processed'] + 1)
+    assert report['frames_captured'] == report['frames_processed'] + report['frames_stale'] + report['frames_skipped']
+    assert report['drop_rate'] == pytest.approx((report['frames_stale'] + report['frames_skipped']) /
+                                                report['frames_captured'])
+    assert report['over_budget'] == report['frames_processed']
+    # frames keep the numbers the source gave them, so the dropped ones show up as gaps
+    assert (np.diff(frame_nums) >= 2).all()
+
+
+def test_replay_keeps_every_frame_within_a_generous_budget(replay_video, tmp_path):
+    tracker, report, frame_nums = replay(replay_video, tmp_path, 5.0)
+    assert report['budget_ms'] == 5000
+    assert report['frames_stale'] == 0 and report['over_budget'] == 0
+    assert report['frames_captured'] == report['frames_processed'] + report['frames_skipped']
+    assert report['frames_processed'] == len(frame_nums) > 0
+    assert report['p50_ms'] <= report['p99_ms'] <= report['max_ms'] < 5000
+    assert (np.diff(frame_nums) >= 1).all()
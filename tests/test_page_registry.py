@@ -0,0 +1,79 @@
+import cv2
+import numpy as np
+
+import PageRegistry
+import VideoTracker
+
+
+def write_pages(path, *lines):
+    """
+    Writes a .brf file with one page per line given, that line repeated on every row, pages split by form feeds
+    """
+    path.write_text('\f'.join(line * 26 for line in lines))
+    return str(path)
+
+
+def qr_frame(payload, size=(960, 540)):
+    """
+    :return: BGR frame of a page on a neon green background with a QR code of payload printed on it
+    """
+    frame = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    frame[:] = (40, 200, 60)
+    cv2.fillConvexPoly(frame, np.array([[250, 100], [700, 120], [690, 475], [260, 450]], np.int32), (230, 230, 230))
+    code = cv2.QRCodeEncoder.create().encode(payload)
+    code = cv2.resize(code, (150, 150), interpolation=cv2.INTER_NEAREST)
+    frame[200:350, 400:550] = cv2.cvtColor(code, cv2.COLOR_GRAY2BGR)
+    return frame
+
+
+def test_least_recently_used_page_is_evicted(tmp_path):
+    brf_path = write_pages(tmp_path / 'book.brf', 'abc\n', 'def\n', 'ghi\n')
+    registry = PageRegistry.PageRegistry({'a': (brf_path, 0), 'b': (brf_path, 1), 'c': (brf_path, 2)}, cache_size=2)
+    with registry:
+        first = registry.page('a')
+        registry.page('b')
+        # using a again makes b the least recently used page
+        assert registry.page('a') is first
+        registry.page('c')
+        assert list(registry.cache) == [(brf_path, 0), (brf_path, 2)]
+        assert registry.page('a') is first
+        assert (registry.hits, registry.misses) == (2, 3)
+        # b was evicted and is parsed again, evicting c
+        assert registry.page('b').charMatrix[0, 0] == ord('d')
+        assert list(registry.cache) == [(brf_path, 0), (brf_path, 1)]
+        assert len(registry.books) == 1
+    assert registry.books == {}
+    # closing keeps the cache, and pages evicted later open the file again
+    assert registry.page('a') is first
+    assert registry.page('c').charMatrix[0, 0] == ord('g')
+    registry.close()
+
+
+def test_detector_switches_pages_when_the_qr_code_changes(tmp_path):
+    brf_path = write_pages(tmp_path / 'book.brf', 'abc\n', 'def\n')
+    registry = PageRegistry.PageRegistry({'page-a': (brf_path, 0), 'page-b': (brf_path, 1)})
+    detector = PageRegistry.PageDetector(registry, interval=10)
+    frames = [qr_frame('page-a')] * 25 + [qr_frame('page-b')] * 25
+    switches = [(i, detector.payload) for i, frame in enumerate(frames) if detector.update(frame) is not None]
+    # decoded on frames 0, 10, 20, 30 and 40 only
+    assert switches == [(0, 'page-a'), (30, 'page-b')]
+    registry.close()
+
+
+def test_video_tracker_switches_pages_mid_video_and_closes_the_registry(tmp_path):
+    video_path = str(tmp_path / 'pages.mp4')
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), 30, (960, 540))
+    for i in range(60):
+        writer.write(qr_frame('page-a' if i < 30 else 'page-b'))
+    writer.release()
+    brf_path = write_pages(tmp_path / 'book.brf', 'abc\n', 'def\n')
+    registry = PageRegistry.PageRegistry({'page-a': (brf_path, 0), 'page-b': (brf_path, 1)})
+
+    tracker = VideoTracker.VideoTracker(video_path, None, VideoTracker.TrackingSettings(tracker_type='COLOR'),
+                                        VideoTracker.CalibrationSettings(page_registry=registry, qr_interval=10),
+                                        VideoTracker.OutputSettings(data_output_path=str(tmp_path / 'output.txt')),
+                                        headless=True)
+    # the calibration frame is video frame 0 and tracked frame i is video frame i + 1, decoded every 10 frames
+    assert tracker.page_switches == [(0, 'page-a'), (29, 'page-b')]
+    assert tracker.braille_page is registry.page('page-b')
+    assert registry.books == {}
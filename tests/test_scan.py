@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+import pytest
+
+import scan
+
+
+def test_transform_image_is_quiet_without_show(capsys):
+    # light page on the neon green background black_background calibration expects
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    frame[:] = (40, 200, 60)
+    corners = np.array([[500, 200], [1400, 240], [1380, 950], [520, 900]], dtype=np.int32)
+    cv2.fillConvexPoly(frame, corners, (230, 230, 230))
+
+    m, im_dims = scan.transform_image(frame, black_background=True, show=False)
+    assert m is not None
+    assert im_dims == (900, 710)
+    assert capsys.readouterr().out == ''
+
+
+def per_point_transform(point, transform_metadata):
+    # the per-point transform transform_points replaced: homography, then the page scale
+    cur = cv2.perspectiveTransform(np.array([[point]], dtype=np.float32), transform_metadata.transformation_matrix)
+    x = cur.flatten()[0] * transform_metadata.desired_dimensions[0] / transform_metadata.im_dims[0]
+    y = cur.flatten()[1] * transform_metadata.desired_dimensions[1] / transform_metadata.im_dims[1]
+    return x, y
+
+
+def test_transform_points_matches_per_point_transform():
+    corners = np.float32([[500, 200], [1400, 240], [1380, 950], [520, 900]])
+    paper = np.float32([[0, 0], [899, 0], [899, 709], [0, 709]])
+    metadata = scan.TransformMetadata(cv2.getPerspectiveTransform(corners, paper), (900, 710), (11.5625, 11))
+    points = np.random.default_rng(0).uniform((0, 0), (1920, 1080), size=(30, 8, 2))
+
+    transformed = scan.transform_points(points, metadata)
+    assert transformed.shape == points.shape
+    expected = np.array([per_point_transform(point, metadata) for point in points.reshape(-1, 2)])
+    np.testing.assert_allclose(transformed.reshape(-1, 2), expected, atol=1e-4)
+    assert scan.transform_point(tuple(points[3, 2]), metadata) == pytest.approx(tuple(expected[3 * 8 + 2]), abs=1e-4)
+    assert scan.transform_points(np.zeros((0, 2)), metadata).shape == (0, 2)
+
+
+def test_video_transform_is_found_on_resized_frames(tmp_path):
+    # a 960x540 video, calibrated for the 1920x1080 frames the tracker sees
+    video_path = str(tmp_path / 'page.mp4')
+    frame = np.zeros((540, 960, 3), dtype=np.uint8)
+    frame[:] = (40, 200, 60)
+    corners = np.array([[250, 100], [700, 120], [690, 475], [260, 450]])
+    cv2.fillConvexPoly(frame, corners.astype(np.int32), (230, 230, 230))
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), 30, (960, 540))
+    for _ in range(100):
+        writer.write(frame)
+    writer.release()
+
+    native = scan.get_transform_video(video_path, show=False, allow_manual=False)
+    resized = scan.get_transform_video(video_path, show=False, allow_manual=False, frame_size=(1920, 1080))
+    np.testing.assert_allclose(scan.page_corners(native), corners, atol=1.5)
+    np.testing.assert_allclose(scan.page_corners(resized), 2 * corners, atol=1.5)
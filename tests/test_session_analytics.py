@@ -0,0 +1,30 @@
+import numpy as np
+
+import SessionAnalytics
+import TrackingOutput
+
+
+def write_session(path, n_frames, seed):
+    # one finger moving along a row of letters with a blank cell after each one
+    rng = np.random.default_rng(seed)
+    with TrackingOutput.TsvOutputWriter(str(path)) as writer:
+        for frame_num in range(n_frames):
+            column = frame_num // 10
+            code = int(rng.integers(97, 123)) if column % 2 else 0
+            writer.write_frame(frame_num, [0.5 + 0.3 * column], [1.0], [code], [1], [column])
+
+
+def test_summary_reads_sessions_in_chunks(tmp_path):
+    paths = [tmp_path / 'session_{}.txt'.format(i) for i in range(3)]
+    for seed, path in enumerate(paths):
+        write_session(path, 95, seed)
+
+    chunked = SessionAnalytics.SessionAnalytics([str(path) for path in paths], chunk_sessions=1)
+    summary = chunked.summary()
+    # whole-study queries must not keep every session's events in memory
+    assert chunked.table is None
+
+    loaded = SessionAnalytics.SessionAnalytics([str(path) for path in paths])
+    loaded.events()
+    assert summary == loaded.summary()
+    assert summary['total_words'] > 0
@@ -0,0 +1,158 @@
+import os
+
+import numpy as np
+
+import SessionAnalytics
+import TrackingOutput
+
+
+def test_export_tsv_keeps_fingers_after_a_missing_one(tmp_path):
+    frames = [(0, [1.0, np.nan, 3.0], [4.0, np.nan, 6.0], [97, 32, 98], [2, -1, 3], [5, -1, 7]),
+              (1, [1.5, 2.5], [4.5, 5.5], [97, 99], [2, 2], [5, 6]),
+              (2, [], [], [], [], [])]
+    track_path = str(tmp_path / 'tracks.npy')
+    direct_path = str(tmp_path / 'direct.txt')
+    with TrackingOutput.NpyTrackWriter(track_path) as npy_writer, \
+            TrackingOutput.TsvOutputWriter(direct_path) as tsv_writer:
+        for frame in frames:
+            npy_writer.write_frame(*frame)
+            tsv_writer.write_frame(*frame)
+
+    exported_path = str(tmp_path / 'exported.txt')
+    TrackingOutput.export_tsv(track_path, exported_path)
+    with open(direct_path) as direct, open(exported_path) as exported:
+        assert exported.read() == direct.read()
+
+
+def random_frames(n_frames, n_fingers=8, seed=0):
+    rng = np.random.default_rng(seed)
+    for frame_num in range(n_frames):
+        n_boxes = int(rng.integers(0, n_fingers + 1))
+        yield (frame_num, rng.uniform(0, 11, n_boxes).astype(np.float32), rng.uniform(0, 11, n_boxes).astype(np.float32),
+               rng.integers(32, 127, n_boxes), rng.integers(-1, 26, n_boxes), rng.integers(-1, 42, n_boxes))
+
+
+def test_npy_header_length_does_not_depend_on_the_frame_count():
+    dtype = TrackingOutput.track_dtype()
+    lengths = {len(TrackingOutput.npy_header(dtype, n)) for n in (0, 1, 999, 10 ** 12)}
+    assert len(lengths) == 1
+    assert lengths.pop() % 64 == 0
+
+
+def test_npy_tracks_stream_and_round_trip(tmp_path):
+    track_path = str(tmp_path / 'tracks.npy')
+    frames = list(random_frames(250))
+    with TrackingOutput.NpyTrackWriter(track_path, flush_every=16) as writer:
+        header_size = os.path.getsize(track_path)
+        for frame in frames[:100]:
+            writer.write_frame(*frame)
+        # flushed records can be read while the session is still being written
+        assert len(TrackingOutput.load_tracks(track_path)) == 96
+        for frame in frames[100:]:
+            writer.write_frame(*frame)
+
+    dtype = TrackingOutput.track_dtype()
+    # the record count was patched into the header without moving the data
+    assert os.path.getsize(track_path) == header_size + len(frames) * dtype.itemsize
+    tracks = TrackingOutput.load_tracks(track_path)
+    # plain numpy reads the file too
+    assert np.load(track_path).tobytes() == tracks.tobytes()
+    for record, (frame_num, x, y, codes, rows, columns) in zip(tracks, frames):
+        n_boxes = len(x)
+        assert record['frame'] == frame_num
+        np.testing.assert_array_equal(record['x'][:n_boxes], x)
+        np.testing.assert_array_equal(record['y'][:n_boxes], y)
+        assert np.isnan(record['x'][n_boxes:]).all()
+        np.testing.assert_array_equal(record['char'][:n_boxes], codes)
+        np.testing.assert_array_equal(record['row'][:n_boxes], rows)
+        np.testing.assert_array_equal(record['col'][:n_boxes], columns)
+
+
+def test_streamed_tsv_matches_exported_npy(tmp_path):
+    track_path = str(tmp_path / 'tracks.npy')
+    direct_path = str(tmp_path / 'direct.txt')
+    frames = list(random_frames(250, seed=1))
+    with TrackingOutput.NpyTrackWriter(track_path, flush_every=16) as npy_writer, \
+            TrackingOutput.TsvOutputWriter(direct_path, flush_every=16) as tsv_writer:
+        for frame in frames:
+            npy_writer.write_frame(*frame)
+            tsv_writer.write_frame(*frame)
+        assert tsv_writer.n_frames == len(frames)
+
+    exported_path = str(tmp_path / 'exported.txt')
+    TrackingOutput.export_tsv(track_path, exported_path, chunk_frames=64)
+    with open(direct_path) as direct, open(exported_path) as exported:
+        direct_lines = direct.readlines()
+        assert exported.readlines() == direct_lines
+    assert direct_lines[0] == TrackingOutput.tsv_header()
+    assert len(direct_lines) == len(frames) + 1
+
+
+def test_dwell_events_start_and_end_where_the_cell_changes(tmp_path):
+    dwell_path = str(tmp_path / 'dwell.txt')
+    a, b = (97, 2, 5), (98, 2, 6)
+    # finger 1 rests on a, moves to b and back, finger 2 rests on a, is lost for a frame and comes back to a
+    cells = [[a, a], [a, a], [b], [b, a], [a, a]]
+    with TrackingOutput.DwellEventWriter(dwell_path, n_fingers=3, flush_every=2) as writer:
+        for frame_num, frame_cells in enumerate(cells):
+            codes, rows, columns = zip(*frame_cells)
+            x = [1.0 + frame_num, 2.0][:len(frame_cells)]
+            # a finger whose position is unknown on a frame still stays on its cell
+            y = [np.nan if frame_num == 1 else 3.0, 4.0][:len(frame_cells)]
+            writer.write_frame(frame_num, x, y, codes, rows, columns)
+        # events are written once they end, long before the file is closed
+        assert writer.n_events == 3
+        with open(dwell_path) as fh:
+            assert len(fh.readlines()) == 1 + 2
+
+    with open(dwell_path) as fh:
+        lines = fh.readlines()
+    assert lines[0] == TrackingOutput.dwell_header()
+    assert lines[1].split('\t')[:8] == ['1', '97', "'a'", '2', '5', '0', '1', '2']
+    events = TrackingOutput.load_dwell_events(dwell_path)
+    events = events[np.lexsort((events['start'], events['finger']))]
+    assert events[['finger', 'code', 'row', 'col', 'start', 'end', 'frames']].tolist() == [
+        (1, 97, 2, 5, 0, 1, 2), (1, 98, 2, 6, 2, 3, 2), (1, 97, 2, 5, 4, 4, 1),
+        (2, 97, 2, 5, 0, 1, 2), (2, 97, 2, 5, 3, 4, 2)]
+    # the means leave out the frame without a position
+    np.testing.assert_allclose(events['x'], [1.0, 3.5, 5.0, 2.0, 2.0])
+    np.testing.assert_allclose(events['y'], [3.0, 3.0, 3.0, 4.0, 4.0])
+
+
+def resting_frames(n_frames, n_fingers=8, seed=0):
+    """
+    Frames of fingers that mostly stay on their cell, sometimes move to a neighbour, and sometimes are not tracked
+    """
+    rng = np.random.default_rng(seed)
+    cells = np.stack([rng.integers(97, 123, n_fingers), rng.integers(0, 26, n_fingers),
+                      rng.integers(0, 42, n_fingers)], axis=1)
+    for frame_num in range(n_frames):
+        moved = rng.random(n_fingers) < 0.1
+        cells[moved, 0] = rng.integers(97, 123, moved.sum())
+        cells[moved, 2] = np.minimum(cells[moved, 2] + 1, 41)
+        n_boxes = n_fingers if rng.random() < 0.9 else int(rng.integers(0, n_fingers))
+        yield (frame_num, rng.uniform(0, 11, n_boxes).astype(np.float32),
+               rng.uniform(0, 11, n_boxes).astype(np.float32), cells[:n_boxes, 0].copy(), cells[:n_boxes, 1].copy(),
+               cells[:n_boxes, 2].copy())
+
+
+def test_dwell_events_round_trip_the_tracks(tmp_path):
+    track_path = str(tmp_path / 'tracks.npy')
+    dwell_path = str(tmp_path / 'dwell.txt')
+    with TrackingOutput.NpyTrackWriter(track_path) as npy_writer, \
+            TrackingOutput.DwellEventWriter(dwell_path, flush_every=16) as dwell_writer:
+        for frame in resting_frames(400):
+            npy_writer.write_frame(*frame)
+            dwell_writer.write_frame(*frame)
+
+    events = TrackingOutput.load_dwell_events(dwell_path)
+    assert len(events) == dwell_writer.n_events
+    events = events[np.lexsort((events['start'], events['finger']))]
+    # the same events as collapsing the per-frame tracks
+    expected = SessionAnalytics.track_events(TrackingOutput.load_tracks(track_path))
+    assert len(events) == len(expected['start'])
+    assert (events['frames'] > 1).mean() > 0.5
+    for name in ('finger', 'code', 'row', 'col', 'start', 'end', 'frames'):
+        np.testing.assert_array_equal(events[name], expected[name])
+    np.testing.assert_allclose(events['x'], expected['x'], rtol=1e-5)
+    np.testing.assert_allclose(events['y'], expected['y'], rtol=1e-5)
@@ -0,0 +1,122 @@
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+import CalibrationCache
+import ColorMasking
+import VideoTracker
+
+
+@pytest.fixture(scope='module')
+def page_video(tmp_path_factory):
+    """
+    :return: paths of a short 960x540 video of a page on a neon green background, and of a Braille page
+    """
+    tmp_path = tmp_path_factory.mktemp('page_video')
+    video_path = str(tmp_path / 'page.mp4')
+    frame = np.zeros((540, 960, 3), dtype=np.uint8)
+    frame[:] = (40, 200, 60)
+    cv2.fillConvexPoly(frame, np.array([[250, 100], [700, 120], [690, 475], [260, 450]], np.int32), (230, 230, 230))
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), 30, (960, 540))
+    for _ in range(80):
+        writer.write(frame)
+    writer.release()
+    page_path = tmp_path / 'page.brf'
+    page_path.write_text('abc\n' * 26)
+    return video_path, str(page_path)
+
+
+def test_calibration_cache_keeps_modes_apart(page_video, tmp_path):
+    video_path, page_path = page_video
+    cache_dir = str(tmp_path / 'cache')
+    output_path = str(tmp_path / 'output.txt')
+
+    # a COLOR run caches the page transform but no boxes
+    calibration = VideoTracker.CalibrationSettings(calibration_cache_dir=cache_dir)
+    output = VideoTracker.OutputSettings(data_output_path=output_path)
+    VideoTracker.VideoTracker(video_path, page_path, VideoTracker.TrackingSettings(tracker_type='COLOR'), calibration,
+                              output, headless=True)
+    with open(CalibrationCache.cache_path(video_path, cache_dir)) as fh:
+        assert json.load(fh)['boxes'] == {}
+    # so a manual run still needs its boxes drawn
+    with pytest.raises(Exception, match='Manual calibration needs a display'):
+        VideoTracker.VideoTracker(video_path, page_path, VideoTracker.TrackingSettings(tracker_type='MOSSE'),
+                                  calibration, output, headless=True)
+
+    # boxes drawn by hand on second 1 of an earlier run
+    transform_metadata = CalibrationCache.load_calibration(video_path, cache_dir).transform_metadata
+    CalibrationCache.save_calibration(video_path, transform_metadata, [(100, 100, 50, 50)], [(0, 0, 255)], 1,
+                                      cache_dir)
+    manual = VideoTracker.VideoTracker(video_path, page_path, VideoTracker.TrackingSettings(tracker_type='MOSSE'),
+                                       calibration, output, headless=True)
+    assert manual.frames_processed == 80 - 30 - 1
+    with open(output_path) as fh:
+        # one finger tracked, the columns of the other seven are left at 0
+        row = fh.readlines()[1].split('\t')
+        assert row[0] == '0' and row[1] != '0' and row[3:17] == ['0'] * 14
+
+    # auto calibration keeps its predefined boxes and starts at 0
+    auto = VideoTracker.VideoTracker(video_path, page_path, VideoTracker.TrackingSettings(tracker_type='MOSSE'),
+                                     VideoTracker.CalibrationSettings(auto_calibrate=True,
+                                                                      calibration_cache_dir=cache_dir),
+                                     output, headless=True)
+    assert auto.frames_processed == 80 - 1
+    with open(output_path) as fh:
+        row = fh.readlines()[1].split('\t')
+        assert '0' not in row[1:17]
+
+
+def test_chunked_run_writes_what_a_serial_run_writes(page_video, tmp_path):
+    page_path = page_video[1]
+    # the page video with a red and a blue marker moving over the page
+    marker_colors = [ColorMasking.default_marker_colors[0], ColorMasking.default_marker_colors[4]]
+    draw_colors = ColorMasking.ColorMarkerDetector(marker_colors).draw_colors()
+    video_path = str(tmp_path / 'markers.mp4')
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), 30, (960, 540))
+    for i in range(80):
+        frame = np.zeros((540, 960, 3), dtype=np.uint8)
+        frame[:] = (40, 200, 60)
+        cv2.fillConvexPoly(frame, np.array([[250, 100], [700, 120], [690, 475], [260, 450]], np.int32),
+                           (230, 230, 230))
+        cv2.circle(frame, (300 + 4 * i, 200), 10, draw_colors[0], -1)
+        cv2.circle(frame, (400 + 2 * i, 300 + i), 10, draw_colors[1], -1)
+        writer.write(frame)
+    writer.release()
+
+    cache_dir = str(tmp_path / 'cache')
+    serial_path = str(tmp_path / 'serial.txt')
+    chunked_path = str(tmp_path / 'chunked.txt')
+    tracking = VideoTracker.TrackingSettings(tracker_type='COLOR', marker_colors=marker_colors)
+    calibration = VideoTracker.CalibrationSettings(calibration_cache_dir=cache_dir)
+    VideoTracker.VideoTracker(video_path, page_path, tracking, calibration,
+                              VideoTracker.OutputSettings(data_output_path=serial_path), headless=True)
+    chunked = VideoTracker.VideoTracker(video_path, page_path, tracking, calibration,
+                                        VideoTracker.OutputSettings(data_output_path=chunked_path),
+                                        VideoTracker.ChunkSettings(chunk_workers=2, chunk_seconds=1,
+                                                                   chunk_overlap=0.25),
+                                        headless=True)
+    assert chunked.frames_processed == 80 - 1
+    with open(serial_path) as serial, open(chunked_path) as chunked_output:
+        serial_rows = [line.split('\t') for line in serial]
+        chunked_rows = [line.split('\t') for line in chunked_output]
+    assert len(chunked_rows) == len(serial_rows) == 80
+    for serial_row, chunked_row in zip(serial_rows[1:], chunked_rows[1:]):
+        # same frames and letters, positions up to the float32 boxes chunks are tracked in
+        assert chunked_row[0] == serial_row[0] and chunked_row[17:] == serial_row[17:]
+        np.testing.assert_allclose(np.array(chunked_row[1:17], float), np.array(serial_row[1:17], float), atol=1e-4)
+    # both markers were on the page
+    assert '-1' not in serial_rows[1][17] + serial_rows[1][18]
+
+
+def test_chunked_run_without_markers_is_tracked_in_one_pass(page_video, tmp_path, capsys):
+    video_path, page_path = page_video
+    tracker = VideoTracker.VideoTracker(video_path, page_path, VideoTracker.TrackingSettings(tracker_type='MOSSE'),
+                                        VideoTracker.CalibrationSettings(auto_calibrate=True),
+                                        VideoTracker.OutputSettings(data_output_path=str(tmp_path / 'output.txt')),
+                                        VideoTracker.ChunkSettings(chunk_workers=2, chunk_seconds=1,
+                                                                   chunk_overlap=0.25),
+                                        headless=True)
+    assert tracker.frames_processed == 80 - 1
+    assert 'tracking it in one pass' in capsys.readouterr().out